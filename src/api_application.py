@@ -3,6 +3,8 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 
+from services.metrics import MetricsMiddleware
+
 
 
 class Server(uvicorn.Server):
@@ -19,6 +21,7 @@ class ApiApplication():
 			allow_methods=["*"],
 			allow_headers=["*"],
 		)
+		app.add_middleware(MetricsMiddleware)
 
 		config = uvicorn.Config(app=app, host=host, port=port)
 		self.server = Server(config=config)
@@ -9,6 +9,7 @@ from pydantic import BaseModel
 
 from services.dtos import RefreshTokenDto
 from services.exceptions import AppException
+from services.token_cache import VerifiedTokenCache
 
 
 
@@ -59,6 +60,20 @@ class TokenUtils:
 		payload = jwt.decode(jwt=token, key=TokenUtils.key(), algorithms=TokenUtils.algorithms, *args, **kwargs)
 		return RefreshToken(sub=payload["sub"], exp=payload["exp"])
 	
+	@staticmethod
+	def verify_access_token(token: str) -> Token:
+		# Verified tokens are cached until their exp, so a token that is sent again skips the signature check
+		return VerifiedTokenCache.get().verify("access", token, TokenUtils.decode_access_token)
+
+	@staticmethod
+	def verify_refresh_token(token: str) -> RefreshToken:
+		return VerifiedTokenCache.get().verify("refresh", token, TokenUtils.decode_refresh_token)
+
+	@staticmethod
+	def purge_cached_tokens(user_id: str) -> int:
+		# Not a revocation: the user's tokens stay valid until their exp, they are only verified again on their next use
+		return VerifiedTokenCache.get().purge_subject(user_id)
+	
 	@staticmethod
 	def get_bearer_token(request: Request):
 		authorization = request.headers.get("Authorization")
@@ -88,7 +103,7 @@ class TokenUtils:
 	@staticmethod
 	def validated_access_token(token = Depends(get_bearer_token)):
 		try:
-			payload = TokenUtils.decode_access_token(token)
+			payload = TokenUtils.verify_access_token(token)
 		except Exception as e:
 			traceback.print_exc()
 			raise HTTPException(status_code=403)
@@ -98,7 +113,7 @@ class TokenUtils:
 	@staticmethod
 	def validated_refresh_token(token = Depends(get_refresh_token)):
 		try:
-			payload = TokenUtils.decode_refresh_token(token)
+			payload = TokenUtils.verify_refresh_token(token)
 		except Exception as e:
 			traceback.print_exc()
 			raise HTTPException(status_code=403)
@@ -166,12 +181,8 @@ def get_refresh_token(token: Token = Depends(TokenUtils.validated_refresh_token)
 	return token
 
 def get_ws_token(websocket: WebSocket, token: str = Depends(TokenUtils.validate_bearer_token)) -> Token:
-	key = TokenUtils.key()
-	
 	try:
-		token = jwt.decode(token, algorithms=["HS256"], key=key)
+		return TokenUtils.verify_access_token(token)
 	except Exception as e:
 		print(f"Failed to decode JWT: token={token}")
 		raise
-
-	return Token(**token)
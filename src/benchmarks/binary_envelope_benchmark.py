@@ -0,0 +1,36 @@
+# Compares sending audio as base64 inside a JSON message with sending it in a binary Envelope:
+# bytes on the wire and server-side decode time per message.
+#
+# Run from the src directory:
+#   python -m benchmarks.binary_envelope_benchmark
+import base64
+import os
+import timeit
+import orjson
+from services.binary_envelope import Envelope, EnvelopeType
+
+
+def main(repeats: int = 200):
+	for size in (16 * 1024, 256 * 1024, 2 * 1024 * 1024):
+		audio = os.urandom(size)
+
+		json_frame = orjson.dumps({"type": "audio_data", "seq": 1, "audio": base64.b64encode(audio).decode()})
+		envelope_frame = Envelope.encode(EnvelopeType.Audio, audio, seq=1)
+
+		def decode_json():
+			message = orjson.loads(json_frame)
+			return base64.b64decode(message["audio"])
+
+		def decode_envelope():
+			return Envelope.parse(envelope_frame).payload
+
+		json_seconds = timeit.timeit(decode_json, number=repeats) / repeats
+		envelope_seconds = timeit.timeit(decode_envelope, number=repeats) / repeats
+		print(
+			f"{size // 1024:5d} KiB audio: json+base64 {len(json_frame):9d} bytes {json_seconds * 1e6:9.1f} us"
+			f" | envelope {len(envelope_frame):9d} bytes {envelope_seconds * 1e6:7.2f} us"
+		)
+
+
+if __name__ == '__main__':
+	main()
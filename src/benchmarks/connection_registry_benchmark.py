@@ -0,0 +1,89 @@
+# Measures client_id lookup and cross-worker delivery latency of the connection registry backends.
+# The Unix socket backend runs one owner process that claims the clients and one process doing the lookups.
+#
+# Run from the src directory:
+#   python -m benchmarks.connection_registry_benchmark [clients] [lookups]
+import asyncio
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from services.base_websocket_worker import ConnectionManager
+from services.connection_registry import ConnectionRegistry, LocalConnectionRegistry, UnixSocketConnectionRegistry
+
+
+def print_stats(name: str, registry: ConnectionRegistry, seconds: float, count: int):
+	stats = registry.stats()
+	print(
+		f"{name:>6}: {count / seconds:10.0f} lookups/s"
+		f"  p50 {stats['p50_lookup_seconds'] * 1e6:7.1f} us"
+		f"  p99 {stats['p99_lookup_seconds'] * 1e6:7.1f} us"
+		f"  max {stats['max_lookup_seconds'] * 1e6:8.1f} us"
+	)
+
+
+async def run_lookups(name: str, registry: ConnectionRegistry, clients: int, lookups: int):
+	client_ids = [f"client-{random.randrange(clients)}" for _ in range(lookups)]
+	start = time.perf_counter()
+	for client_id in client_ids:
+		await registry.owner("chat", client_id)
+	print_stats(name, registry, time.perf_counter() - start, lookups)
+
+	start = time.perf_counter()
+	for client_id in client_ids[:lookups // 10]:
+		await registry.deliver("chat", client_id, '{"type":"ping"}')
+	print(f"{'':>6}  deliver round trip: {(time.perf_counter() - start) / (lookups // 10) * 1e6:7.1f} us")
+
+
+async def owner_process(socket_path: str, clients: int, ready, done):
+	registry = UnixSocketConnectionRegistry(socket_path)
+	registry.attach(ConnectionManager("chat", registry))
+	await registry.start()
+	for i in range(clients):
+		await registry.claim("chat", f"client-{i}", "token")
+
+	# A lookup round trip guarantees that all claims were processed by the coordinator:
+	await registry.owner("chat", "client-0")
+	ready.set()
+	while not done.is_set():
+		await asyncio.sleep(0.05)
+	await registry.close()
+
+
+async def lookup_process(socket_path: str, clients: int, lookups: int, ready, done):
+	registry = UnixSocketConnectionRegistry(socket_path)
+	await registry.start()
+	while not ready.is_set():
+		await asyncio.sleep(0.05)
+	await run_lookups("unix", registry, clients, lookups)
+	done.set()
+	await registry.close()
+
+
+def main(clients: int = 10000, lookups: int = 20000):
+	local = LocalConnectionRegistry()
+	manager = ConnectionManager("chat", local)
+	local.attach(manager)
+	manager.connections = {f"client-{i}": None for i in range(clients)}
+	asyncio.run(run_lookups("local", local, clients, lookups))
+
+	socket_path = os.path.join(tempfile.mkdtemp(), "registry.sock")
+	context = multiprocessing.get_context("spawn")
+	ready, done = context.Event(), context.Event()
+	owner = context.Process(target=run_owner, args=(socket_path, clients, ready, done))
+	owner.start()
+	time.sleep(0.5)
+	asyncio.run(lookup_process(socket_path, clients, lookups, ready, done))
+	owner.join()
+
+
+def run_owner(socket_path: str, clients: int, ready, done):
+	asyncio.run(owner_process(socket_path, clients, ready, done))
+
+
+if __name__ == '__main__':
+	clients = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+	lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+	main(clients, lookups)
@@ -0,0 +1,80 @@
+# Measures fanout of one topic message to many websocket connections: per-connection send_json (which encodes
+# the message for every recipient) against ConnectionManager.publish (encoded once). Sockets are simulated,
+# so the numbers are the server-side cost until every connection has written the message.
+#
+# Run from the src directory:
+#   python -m benchmarks.fanout_benchmark [connections] [messages]
+import asyncio
+import sys
+import time
+from fastapi.websockets import WebSocketState
+from services.base_websocket_worker import BaseWebsocketWorker, ConnectionManager, WebsocketDataBase
+from services.outbound_writer import OutboundLimits, OutboundWriter
+
+
+class LeaderboardEvent(WebsocketDataBase):
+	type: str = "leaderboard"
+	entries: list[dict]
+
+
+class SimulatedWebsocket:
+	application_state = WebSocketState.CONNECTED
+	client_state = WebSocketState.CONNECTED
+
+	def __init__(self):
+		self.received = 0
+
+	async def send_text(self, data: str):
+		self.received += 1
+
+	async def send_bytes(self, data: bytes):
+		self.received += 1
+
+
+async def connect(manager: ConnectionManager, connections: int) -> list[BaseWebsocketWorker]:
+	workers = []
+	for i in range(connections):
+		worker = BaseWebsocketWorker()
+		worker.websocket = SimulatedWebsocket()
+		worker.writer = OutboundWriter(worker.websocket, OutboundLimits(), worker.on_slow_consumer)
+		worker.writer.start()
+		worker.fanout = manager.fanout
+		worker.subscribe("class-1")
+		manager.connections[f"client-{i}"] = worker
+		workers.append(worker)
+	return workers
+
+
+async def wait_until_received(workers: list[BaseWebsocketWorker], expected: int):
+	while any(worker.websocket.received < expected for worker in workers):
+		await asyncio.sleep(0.001)
+
+
+async def main(connections: int = 10000, messages: int = 10):
+	manager = ConnectionManager("benchmark")
+	workers = await connect(manager, connections)
+	event = LeaderboardEvent(entries=[{"user": f"learner-{i}", "score": 1000 - i} for i in range(20)])
+
+	start = time.perf_counter()
+	for message in range(messages):
+		for worker in workers:
+			await worker.send_json(event)
+		await wait_until_received(workers, message + 1)
+	per_connection = (time.perf_counter() - start) / messages
+
+	start = time.perf_counter()
+	for message in range(messages):
+		await manager.publish("class-1", event)
+		await wait_until_received(workers, messages + message + 1)
+	publish = (time.perf_counter() - start) / messages
+
+	print(f"{connections} connections, {len(event.model_dump_json())} byte message")
+	print(f"send_json per connection: {per_connection * 1000:8.2f} ms per message")
+	print(f"publish (encoded once):   {publish * 1000:8.2f} ms per message")
+	print(f"Fanout stats: {manager.fanout.stats()}")
+
+
+if __name__ == '__main__':
+	connections = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+	messages = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+	asyncio.run(main(connections, messages))
@@ -0,0 +1,69 @@
+# Load test of concurrent logins: event-loop lag (how late a 5 ms sleep wakes up) while a burst of logins runs with
+# bcrypt called inline in the handler, as before, against the PasswordHasher pool, and against the pool behind the
+# LoginThrottle when the burst comes from one address. Only the password work and the throttling run, no database.
+#
+# Run from the src directory:
+#   python -m benchmarks.login_load_benchmark [logins] [bcrypt_rounds]
+import asyncio
+import sys
+import time
+import bcrypt
+from services.exceptions import AppException
+from services.login_throttle import LoginThrottle
+from services.password_hasher import PasswordHasher
+
+
+async def probe_lag(lags: list[float], stop: asyncio.Event):
+	while not stop.is_set():
+		start = time.perf_counter()
+		await asyncio.sleep(0.005)
+		lags.append(time.perf_counter() - start - 0.005)
+
+
+async def run(login, logins: int) -> dict:
+	lags = []
+	stop = asyncio.Event()
+	probe = asyncio.create_task(probe_lag(lags, stop))
+	await asyncio.sleep(0.05)
+
+	start = time.perf_counter()
+	results = await asyncio.gather(*(login(index) for index in range(logins)), return_exceptions=True)
+	elapsed = time.perf_counter() - start
+	stop.set()
+	await probe
+
+	lags.sort()
+	return {
+		"seconds": elapsed,
+		"max_lag": lags[-1],
+		"p99_lag": lags[int(len(lags) * 0.99)],
+		"rejected": sum(1 for result in results if isinstance(result, AppException)),
+	}
+
+
+def main():
+	logins = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+	rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+	hashed = bcrypt.hashpw(b"1234", bcrypt.gensalt(rounds)).decode()
+
+	async def inline(index):
+		await asyncio.sleep(0)
+		return bcrypt.checkpw(b"1234", hashed.encode())
+
+	async def pooled(index):
+		return await PasswordHasher.get().verify("1234", hashed)
+
+	async def throttled(index):
+		LoginThrottle.get().check("frode_flodhest@hotmail.com", "10.0.0.1")
+		return await PasswordHasher.get().verify("1234", hashed)
+
+	print(f"{logins} concurrent logins, bcrypt rounds {rounds}")
+	for name, login in (("inline bcrypt", inline), ("PasswordHasher pool", pooled), ("pool + LoginThrottle", throttled)):
+		PasswordHasher.configure()
+		LoginThrottle.configure()
+		result = asyncio.run(run(login, logins))
+		print(f"  {name:22} {result['seconds'] * 1000:7.0f} ms  loop lag max {result['max_lag'] * 1000:6.1f} ms  p99 {result['p99_lag'] * 1000:6.1f} ms  {result['rejected']:3} rejected")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,55 @@
+# Measures the cost of a single metrics observation on the hot paths (counter increment, histogram observation,
+# histogram timer) and of rendering /metrics with many label sets.
+#
+# Run from the src directory:
+#   python -m benchmarks.metrics_benchmark [observations]
+import sys
+import time
+from services.metrics import MetricsRegistry
+
+
+def per_call_ns(func, observations: int) -> float:
+	start = time.perf_counter()
+	for _ in range(observations):
+		func()
+	return (time.perf_counter() - start) * 1e9 / observations
+
+
+def main():
+	observations = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+	registry = MetricsRegistry()
+
+	counter = registry.counter("bench_bytes_total", "Counter", ["connection_type"])
+	histogram = registry.histogram("bench_seconds", "Histogram", ["connection_type", "message_type"])
+	counter_child = counter.labels("chat")
+	histogram_child = histogram.labels("chat", "audio")
+
+	def empty():
+		pass
+
+	def timed():
+		with histogram_child.time():
+			pass
+
+	baseline = per_call_ns(empty, observations)
+	results = {
+		"counter inc (cached child)": per_call_ns(lambda: counter_child.inc(512), observations),
+		"counter inc (labels lookup)": per_call_ns(lambda: counter.labels("chat").inc(512), observations),
+		"histogram observe (cached child)": per_call_ns(lambda: histogram_child.observe(0.042), observations),
+		"histogram observe (labels lookup)": per_call_ns(lambda: histogram.labels("chat", "audio").observe(0.042), observations),
+		"histogram timer": per_call_ns(timed, observations),
+	}
+
+	print(f"{observations} observations each, call overhead {baseline:.0f} ns subtracted")
+	for name, ns in results.items():
+		print(f"  {name:36} {ns - baseline:6.0f} ns")
+
+	for index in range(1000):
+		histogram.labels(f"type-{index % 10}", f"message-{index}").observe(index / 1000)
+	start = time.perf_counter()
+	text = registry.render()
+	print(f"Render 1000 histogram label sets: {(time.perf_counter() - start) * 1000:.1f} ms, {len(text) / 1024:.0f} KiB")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,33 @@
+# Measures the CPU cost of the pronunciation/fluency analysis, in CPU milliseconds per minute of audio.
+#
+# Run from the src directory:
+#   python -m benchmarks.speech_feedback_benchmark [minutes_of_audio]
+import sys
+import time
+from benchmarks.vad_benchmark import synthetic_speech
+from services.speech_feedback import SpeechFeedbackEngine
+
+
+def main(minutes: float = 5, repeats: int = 5):
+	engine = SpeechFeedbackEngine()
+
+	# Typical utterances are short, so measure both a single long recording and many 10 second ones:
+	for utterance_seconds in (minutes * 60, 10):
+		utterances = [synthetic_speech(utterance_seconds, seed=i) for i in range(max(int(minutes * 60 / utterance_seconds), 1))]
+		audio_minutes = sum(utterance.seconds for utterance in utterances) / 60
+
+		feedback = engine.analyze(utterances[0])
+		print(f"Feedback: {feedback.to_dict()}")
+
+		start = time.process_time()
+		for _ in range(repeats):
+			for utterance in utterances:
+				engine.analyze(utterance)
+		cpu_seconds = (time.process_time() - start) / repeats
+
+		print(f"{len(utterances)} x {utterance_seconds:.0f} s: {cpu_seconds / audio_minutes * 1000:8.2f} CPU ms per minute of audio")
+
+
+if __name__ == '__main__':
+	minutes = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+	main(minutes)
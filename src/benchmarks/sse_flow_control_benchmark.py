@@ -0,0 +1,71 @@
+# Measures how long one slow SSE client holds up the producer coroutine of an AsyncStreamingResponse: send_json as it
+# was before the per-client buffer (awaiting the ASGI send for every event) against the Block, DropOldest and
+# Coalesce buffer policies. The client takes a fixed time to write each body chunk; events are state updates that
+# share one coalescing key.
+#
+# Run from the src directory:
+#   python -m benchmarks.sse_flow_control_benchmark [events] [send_ms]
+import asyncio
+import sys
+import time
+from services.base_sse_service import AsyncStreamingResponse
+from services.sse_hub import SseBufferLimits, SseBufferPolicy
+from services.websocket_codec import WebsocketCodec
+
+
+class PreviousStreamingResponse(AsyncStreamingResponse):
+	# send_json as it was before the buffer: every event waits for the client
+	async def send_json(self, content, key=None):
+		await self.send({"type": "http.response.body", "body": b"".join((b"data: ", WebsocketCodec.encode(content), b"\n\n")), "more_body": True})
+		return True
+
+
+class SlowClient:
+	def __init__(self, send_seconds: float):
+		self.send_seconds = send_seconds
+		self.events = 0
+
+	async def send(self, message: dict):
+		if message["type"] == "http.response.body":
+			self.events += message["body"].count(b"data: ")
+			await asyncio.sleep(self.send_seconds)
+
+	async def receive(self) -> dict:
+		await asyncio.Event().wait()
+
+
+async def run(response: AsyncStreamingResponse, events: int, send_seconds: float) -> dict:
+	client = SlowClient(send_seconds)
+	result = {}
+
+	async def produce():
+		start = time.perf_counter()
+		for i in range(events):
+			await response.send_json({"type": "progress", "done": i, "total": events}, key="progress")
+		result["producer"] = time.perf_counter() - start
+
+	response.set_coroutine_function(produce)
+	start = time.perf_counter()
+	await response({"type": "http"}, client.receive, client.send)
+	result["total"] = time.perf_counter() - start
+	result["delivered"] = client.events
+	return result
+
+
+def main():
+	events = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+	send_seconds = (float(sys.argv[2]) if len(sys.argv) > 2 else 5) / 1000
+
+	print(f"{events} events, {send_seconds * 1000:.0f} ms per client write, buffer of 32 events")
+	cases = [("unbuffered send_json", lambda: PreviousStreamingResponse(media_type="text/event-stream"))]
+	for policy in SseBufferPolicy:
+		limits = SseBufferLimits(max_events=32, policy=policy)
+		cases.append((policy.value, lambda limits=limits: AsyncStreamingResponse(media_type="text/event-stream", limits=limits)))
+
+	for name, create in cases:
+		result = asyncio.run(run(create(), events, send_seconds))
+		print(f"  {name:22} producer {result['producer'] * 1000:8.1f} ms  stream {result['total'] * 1000:8.1f} ms  {result['delivered']:5} events delivered")
+
+
+if __name__ == "__main__":
+	main()
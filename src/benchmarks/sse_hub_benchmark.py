@@ -0,0 +1,120 @@
+# Compares the per-client SSE pattern (AsyncStreamingResponse: two tasks per client besides the request task, each client
+# encoding the event with json.dumps) with SseHubResponse streams on the shared SseHub (encoded once, one writer per
+# client) for many concurrent clients. Clients are simulated ASGI connections, so the numbers are the server-side
+# cost until every client has written each event. Memory is traced while the clients connect only.
+#
+# Run from the src directory:
+#   python -m benchmarks.sse_hub_benchmark [clients] [events]
+import asyncio
+import json
+import sys
+import time
+import tracemalloc
+from services.base_sse_service import AsyncStreamingResponse, SseHubResponse
+from services.sse_hub import SseHub
+
+
+EVENT = {"type": "leaderboard", "entries": [{"user": f"user-{i}", "score": 1000 - i} for i in range(20)]}
+
+
+class PreviousStreamingResponse(AsyncStreamingResponse):
+	# send_json as it was before the hub: json.dumps for every client
+	async def send_json(self, content):
+		json_payload = json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"))
+		await self.send({"type": "http.response.body", "body": f"data: {json_payload}\n\n".encode(self.charset), "more_body": True})
+
+
+class SimulatedClient:
+	def __init__(self, expected: int, done: asyncio.Event, counter: list[int]):
+		self.received = 0
+		self.expected = expected
+		self.done = done
+		self.counter = counter
+		self.disconnected = asyncio.Event()
+
+	async def send(self, message: dict):
+		if message["type"] == "http.response.body" and message["body"].startswith((b"data", b"id")):
+			self.received += 1
+			if self.received == self.expected:
+				self.counter[0] -= 1
+				if self.counter[0] == 0:
+					self.done.set()
+
+	async def receive(self) -> dict:
+		await self.disconnected.wait()
+		return {"type": "http.disconnect"}
+
+
+async def run_per_client(clients: int, events: int) -> dict:
+	tracemalloc.start()
+	done = asyncio.Event()
+	counter = [clients]
+	simulated = [SimulatedClient(events, done, counter) for _ in range(clients)]
+	queues = [asyncio.Queue() for _ in range(clients)]
+	tasks = []
+
+	for client, queue in zip(simulated, queues):
+		response = PreviousStreamingResponse(media_type="text/event-stream")
+
+		async def stream(response=response, queue=queue):
+			for _ in range(events):
+				await response.send_json(await queue.get())
+
+		response.set_coroutine_function(stream)
+		tasks.append(asyncio.create_task(response({"type": "http"}, client.receive, client.send)))
+
+	await asyncio.sleep(0.5)
+	task_count = len(asyncio.all_tasks())
+	memory = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	start = time.perf_counter()
+	for _ in range(events):
+		for queue in queues:
+			queue.put_nowait(EVENT)
+		await asyncio.sleep(0)
+	await done.wait()
+	elapsed = time.perf_counter() - start
+
+	for client in simulated:
+		client.disconnected.set()
+	await asyncio.gather(*tasks, return_exceptions=True)
+	return {"tasks": task_count, "seconds": elapsed, "memory": memory}
+
+
+async def run_hub(clients: int, events: int) -> dict:
+	tracemalloc.start()
+	done = asyncio.Event()
+	counter = [clients]
+	SseHub.configure(heartbeat_seconds=15)
+	simulated = [SimulatedClient(events, done, counter) for _ in range(clients)]
+	tasks = [asyncio.create_task(SseHubResponse(["leaderboard"])({"type": "http", "headers": []}, client.receive, client.send)) for client in simulated]
+
+	await asyncio.sleep(0.5)
+	task_count = len(asyncio.all_tasks())
+	memory = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	start = time.perf_counter()
+	for _ in range(events):
+		SseHub.instance.publish("leaderboard", EVENT)
+		await asyncio.sleep(0)
+	await done.wait()
+	elapsed = time.perf_counter() - start
+
+	for client in simulated:
+		client.disconnected.set()
+	await asyncio.gather(*tasks, return_exceptions=True)
+	return {"tasks": task_count, "seconds": elapsed, "memory": memory}
+
+
+def main():
+	clients = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+	events = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+	print(f"{clients} clients, {events} events")
+	for name, run in (("per-client responses", run_per_client), ("SseHub", run_hub)):
+		result = asyncio.run(run(clients, events))
+		print(f"  {name:22} {result['tasks']:6} tasks  {result['memory'] / clients / 1024:5.1f} KiB per client  {result['seconds'] * 1000 / events:7.1f} ms per event")
+
+
+if __name__ == "__main__":
+	main()
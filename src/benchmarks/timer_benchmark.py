@@ -0,0 +1,82 @@
+# Compares RestartableTimer on the shared timing wheel with the previous task-per-timer implementation,
+# for many idle timers that are restarted on every message, and for many timers that fire.
+#
+# Run from the src directory:
+#   python -m benchmarks.timer_benchmark [timers] [restarts]
+import asyncio
+from datetime import timedelta
+import sys
+import time
+from restartable_timer import RestartableTimer
+from timing_wheel import TimingWheel
+
+
+class TaskRestartableTimer:
+	# The previous implementation: every (re)start cancels the old task and creates a new one
+	def __init__(self):
+		self._timer_task = None
+
+	async def _callback_with_delay(self, delay: timedelta, callback):
+		await asyncio.sleep(delay.total_seconds())
+		callback()
+
+	def cancel(self):
+		if self._timer_task:
+			self._timer_task.cancel()
+
+	def schedule(self, delay: timedelta, callback):
+		self.cancel()
+		self._timer_task = asyncio.create_task(self._callback_with_delay(delay, callback))
+
+
+async def restarts(timer_class, timers: int, restarts: int) -> float:
+	items = [timer_class() for _ in range(timers)]
+	idle_timeout = timedelta(seconds=60)
+
+	start = time.perf_counter()
+	for _ in range(restarts):
+		for timer in items:
+			timer.schedule(idle_timeout, lambda: None)
+		# Let the loop run, like it would between messages (and let cancelled tasks finish)
+		await asyncio.sleep(0)
+	elapsed = time.perf_counter() - start
+
+	for timer in items:
+		timer.cancel()
+	await asyncio.sleep(0.01)
+	return timers * restarts / elapsed
+
+
+async def firing(timer_class, timers: int, delay_seconds: float = 0.2) -> tuple[float, float]:
+	fired = 0
+	last_fired_at = 0.0
+
+	def callback():
+		nonlocal fired, last_fired_at
+		fired += 1
+		last_fired_at = time.perf_counter()
+
+	items = [timer_class() for _ in range(timers)]
+	start_cpu = time.process_time()
+	start = time.perf_counter()
+	for timer in items:
+		timer.schedule(timedelta(seconds=delay_seconds), callback)
+
+	while fired < timers:
+		await asyncio.sleep(0.01)
+
+	return last_fired_at - start - delay_seconds, time.process_time() - start_cpu
+
+
+async def main(timers: int = 20000, restart_count: int = 10):
+	print(f"{timers} timers, restarted {restart_count} times each (tick {TimingWheel.tick_seconds * 1000:.0f} ms)")
+	for name, timer_class in (("task per timer", TaskRestartableTimer), ("timing wheel", RestartableTimer)):
+		rate = await restarts(timer_class, timers, restart_count)
+		lateness, cpu = await firing(timer_class, timers)
+		print(f"{name:>15}: {rate:10.0f} restarts/s, all {timers} fired {lateness * 1000:6.1f} ms after the deadline, {cpu * 1000:7.1f} CPU ms")
+
+
+if __name__ == '__main__':
+	timers = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+	restart_count = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+	asyncio.run(main(timers, restart_count))
@@ -0,0 +1,57 @@
+# Measures the auth overhead per request: the token verification as it was before the cache (HS256 verify plus a
+# Token model for every request) against VerifiedTokenCache hits, misses and a mix of clients that reuse their token.
+#
+# Run from the src directory:
+#   python -m benchmarks.token_cache_benchmark [requests] [clients]
+import sys
+import time
+import jwt
+from auth import Token, TokenUtils
+from services.token_cache import VerifiedTokenCache
+
+
+def per_call_us(func, requests: int) -> float:
+	start = time.perf_counter()
+	for index in range(requests):
+		func(index)
+	return (time.perf_counter() - start) * 1e6 / requests
+
+
+def main():
+	requests = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+	clients = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+	tokens = [TokenUtils.create_access_token(str(index)) for index in range(clients)]
+	unique = [TokenUtils.create_access_token(str(index)) for index in range(requests)]
+	key = TokenUtils.key()
+
+	def previous_http(index):
+		TokenUtils.decode_access_token(tokens[index % clients])
+
+	def previous_ws(index):
+		Token(**jwt.decode(tokens[index % clients], algorithms=["HS256"], key=key))
+
+	VerifiedTokenCache.configure(max_entries=clients)
+
+	def cached(index):
+		TokenUtils.verify_access_token(tokens[index % clients])
+
+	def miss(index):
+		TokenUtils.verify_access_token(unique[index])
+
+	results = {
+		"before: decode_access_token": per_call_us(previous_http, requests),
+		"before: get_ws_token decode": per_call_us(previous_ws, requests),
+		"cache miss (new token)": per_call_us(miss, requests),
+	}
+	VerifiedTokenCache.configure(max_entries=clients)
+	results[f"cache ({clients} clients reusing tokens)"] = per_call_us(cached, requests)
+
+	print(f"{requests} requests, {clients} clients")
+	for name, us in results.items():
+		print(f"  {name:40} {us:6.2f} us")
+	print(f"  {VerifiedTokenCache.instance.stats()}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,61 @@
+# Measures voice activity detection throughput, in seconds of audio processed per CPU-second.
+#
+# Run from the src directory:
+#   python -m benchmarks.vad_benchmark [minutes_of_audio]
+import sys
+import time
+import numpy as np
+from services.voice_activity import Endpointer, PcmAudio, VoiceActivityDetector
+
+
+def synthetic_speech(seconds: float, sample_rate: int = 16000, seed: int = 0) -> PcmAudio:
+	# Alternating "words" (amplitude modulated harmonics) and pauses over a low noise floor:
+	rng = np.random.default_rng(seed)
+	samples = rng.normal(0, 30, int(seconds * sample_rate))
+	position = 0
+
+	while position < len(samples):
+		word_length = int(rng.uniform(0.2, 0.8) * sample_rate)
+		pause_length = int(rng.choice([0.1, 0.3, 1.5]) * sample_rate)
+		t = np.arange(min(word_length, len(samples) - position)) / sample_rate
+		pitch = rng.uniform(100, 250)
+		word = np.sin(2 * np.pi * pitch * t) + 0.5 * np.sin(4 * np.pi * pitch * t)
+		samples[position:position + len(t)] += 6000 * word * np.sin(np.pi * t / t[-1] if len(t) > 1 else 1)
+		position += word_length + pause_length
+
+	return PcmAudio(np.clip(samples, -32768, 32767).astype(np.int16), sample_rate)
+
+
+def measure(name: str, func, audio_seconds: float, repeats: int = 5):
+	start = time.process_time()
+	for _ in range(repeats):
+		func()
+	cpu_seconds = (time.process_time() - start) / repeats
+
+	print(f"{name:>10}: {audio_seconds / cpu_seconds:12.0f} seconds of audio per CPU-second ({cpu_seconds * 1000:.1f} ms CPU for {audio_seconds:.0f} s)")
+
+
+def main(minutes: float = 10):
+	audio = synthetic_speech(minutes * 60)
+	detector = VoiceActivityDetector()
+
+	_, stats = detector.trim(audio)
+	print(f"VAD: {stats}")
+
+	measure("trim", lambda: detector.trim(audio), audio.seconds)
+
+	# The endpointer sees the same audio as 40 ms upload chunks:
+	pcm = audio.samples.tobytes()
+	chunk_bytes = audio.sample_rate * 2 * 40 // 1000
+
+	def endpoint():
+		endpointer = Endpointer(detector, sample_rate=audio.sample_rate)
+		for offset in range(0, len(pcm), chunk_bytes):
+			endpointer.feed(pcm[offset:offset + chunk_bytes])
+
+	measure("endpointer", endpoint, audio.seconds, repeats=1)
+
+
+if __name__ == '__main__':
+	minutes = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+	main(minutes)
@@ -0,0 +1,51 @@
+# Measures time-to-first-audio-byte of the buffered and the streaming voice pipeline against the in-process
+# fake AI backend, so the numbers only depend on the configured upstream latencies.
+#
+# Run from the src directory:
+#   python -m benchmarks.voice_pipeline_benchmark [concurrent_users]
+import asyncio
+import statistics
+import sys
+import time
+from services.ai_providers import FakeAiBackend
+from services.voice_pipeline import VoicePipeline
+
+
+async def run_turn(pipeline: VoicePipeline, streaming: bool):
+	first_byte_at = None
+	start = time.perf_counter()
+
+	async def send_audio(data: bytes):
+		nonlocal first_byte_at
+		if first_byte_at is None:
+			first_byte_at = time.perf_counter()
+
+	if streaming:
+		await pipeline.respond_streaming(b"audio", send_audio)
+	else:
+		await send_audio(await pipeline.respond_buffered(b"audio"))
+
+	return first_byte_at - start, time.perf_counter() - start
+
+
+async def measure(streaming: bool, turns: int, users: int):
+	pipeline = VoicePipeline(FakeAiBackend())
+	results = []
+
+	for _ in range(turns):
+		results += await asyncio.gather(*[run_turn(pipeline, streaming) for _ in range(users)])
+
+	ttfb = [result[0] for result in results]
+	total = [result[1] for result in results]
+	return ttfb, total
+
+
+async def main(turns: int = 5, users: int = 1):
+	for name, streaming in (("buffered", False), ("streaming", True)):
+		ttfb, total = await measure(streaming, turns, users)
+		print(f"{name:>10}: users={users}, time-to-first-byte={statistics.mean(ttfb) * 1000:7.1f} ms (max {max(ttfb) * 1000:7.1f} ms), total={statistics.mean(total) * 1000:7.1f} ms")
+
+
+if __name__ == '__main__':
+	users = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+	asyncio.run(main(users=users))
@@ -0,0 +1,59 @@
+# Compares messages per second of the websocket codec with the previous json.loads + model(**data) decoding
+# and json.dumps(model_dump()) encoding.
+#
+# Run from the src directory:
+#   python -m benchmarks.websocket_codec_benchmark
+import json
+import time
+from services.chat_service import FeedbackEvent, SpeechEnd, TestData
+from services.websocket_codec import WebsocketCodec
+
+
+MODELS = [TestData, SpeechEnd, FeedbackEvent]
+
+
+def legacy_decode(data_models: dict, text: str):
+	json_data = json.loads(text)
+	model = data_models.get(json_data["type"], None)
+	return model(**json_data)
+
+
+def legacy_encode(data):
+	return json.dumps(data.model_dump())
+
+
+def measure(name: str, func, messages: list, seconds: float = 1.0):
+	count = 0
+	start = time.perf_counter()
+	while time.perf_counter() - start < seconds:
+		for message in messages:
+			func(message)
+		count += len(messages)
+
+	rate = count / (time.perf_counter() - start)
+	print(f"{name:>16}: {rate:12,.0f} messages/s")
+	return rate
+
+
+def main():
+	codec = WebsocketCodec(MODELS)
+	data_models = {model.model_fields["type"].default: model for model in MODELS}
+
+	feedback = FeedbackEvent(
+		words_per_minute=112.5, syllables_per_second=3.2, pause_ratio=0.21, mean_pause_seconds=0.48,
+		pause_count=4, pitch_variability_semitones=2.7, speech_seconds=6.4,
+	)
+	outbound = [TestData(data="hello " * 20), SpeechEnd(), feedback]
+	inbound = [legacy_encode(message) for message in outbound]
+
+	legacy = measure("legacy decode", lambda text: legacy_decode(data_models, text), inbound)
+	fast = measure("codec decode", codec.decode, inbound)
+	print(f"{'':>16}  {fast / legacy:.2f}x")
+
+	legacy = measure("legacy encode", legacy_encode, outbound)
+	fast = measure("codec encode", codec.encode, outbound)
+	print(f"{'':>16}  {fast / legacy:.2f}x")
+
+
+if __name__ == '__main__':
+	main()
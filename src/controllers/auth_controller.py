@@ -1,10 +1,12 @@
 import traceback
 from typing import Optional
-from fastapi import Depends, FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request
 from auth import Token, get_refresh_token, get_token
 from services.dtos import LoginRequest
 from services.exceptions import AppException
 from services.auth_service import AuthService
+from services.login_throttle import LoginThrottled
+from services.password_hasher import PasswordHasherBusy
 
 
 
@@ -17,10 +19,16 @@ class AuthController:
 		@app.post("/login")
 		async def login(
 			dto: LoginRequest,
+			request: Request,
 			account_service: AuthService = Depends()
 		):
 			try:
-				return await account_service.login(dto.email_address, dto.password)
+				client_ip = request.client.host if request.client else None
+				return await account_service.login(dto.email_address, dto.password, client_ip)
+			except LoginThrottled as e:
+				raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+			except PasswordHasherBusy as e:
+				raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
 			except AppException as e:
 				self.handle_exception(e)
 		
@@ -1,4 +1,5 @@
 import traceback
+from typing import Optional
 from fastapi import Depends, FastAPI, HTTPException, WebSocket
 from auth import Token, get_token, get_ws_token
 from services.exceptions import AppException
@@ -16,9 +17,11 @@ class ChatController:
 		async def chat(
 			websocket: WebSocket,
 			token: Token = Depends(get_ws_token),
-			chat_service: ChatService = Depends()
+			chat_service: ChatService = Depends(),
+			resume_token: Optional[str] = None,
+			last_seq: Optional[int] = None,
 		):
 			try:
-				return await chat_service.start_voice_chat(websocket)
+				return await chat_service.start_voice_chat(websocket, token.sub, resume_token, last_seq)
 			except AppException as e:
 				self.handle_exception(e)
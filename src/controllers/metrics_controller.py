@@ -0,0 +1,11 @@
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from services.metrics import metrics
+
+
+class MetricsController:
+	def __init__(self, app: FastAPI):
+		@app.get("/metrics", response_class=PlainTextResponse)
+		async def get_metrics():
+			# Prometheus text exposition format
+			return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -42,11 +42,12 @@ class BaseRepository:
 	async def delete(self, statement):
 		await self.session.execute(statement)
 
+	# The select helpers may read from a replica; once the session has written, they read from the primary
 	async def select_first(self, statement):
-		return (await self.session.scalars(statement)).first()
+		return (await self.session.scalars(statement, bind_arguments={"replica": True})).first()
 	
 	async def select_all(self, statement):
-		return (await self.session.scalars(statement)).all()
+		return (await self.session.scalars(statement, bind_arguments={"replica": True})).all()
 
 	async def select_all_unique(self, statement):
-		return (await self.session.execute(statement)).unique().scalars().all()
+		return (await self.session.execute(statement, bind_arguments={"replica": True})).unique().scalars().all()
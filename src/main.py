@@ -7,9 +7,20 @@ from api_application import ApiApplication
 from controllers.chat_controller import ChatController
 from controllers.static_data_controller import StaticDataController
 from controllers.auth_controller import AuthController
+from controllers.metrics_controller import MetricsController
 from controllers.user_controller import UserController
 from seed_database import SeedDatabaseService
+from services.ai_providers import AiProvider
+from services.ai_scheduler import AiCallScheduler
+from services.connection_registry import ConnectionRegistry
+from services.login_throttle import LoginThrottle
+from services.metrics import metrics
+from services.password_hasher import PasswordHasher
+from services.sse_hub import SseBufferLimits, SseHub
+from services.token_cache import VerifiedTokenCache
+from services.tts_cache import TtsCache
 from services.base_database_service import BaseDatabaseService
+from timing_wheel import TimingWheel
 
 
 
@@ -21,17 +32,110 @@ class Main:
 		env_path = os.environ.get("DOTENV_PATH", ".env")
 		load_dotenv(override=True, dotenv_path=env_path)
 
+		# Password hashing (also used by the seeding below) runs on a few threads; logins beyond its queue get a 503
+		PasswordHasher.configure(
+			workers=int(os.environ.get("PASSWORD_HASH_WORKERS", 0)) or None,
+			max_queue=int(os.environ.get("PASSWORD_HASH_MAX_QUEUE", 32)),
+		)
+		LoginThrottle.configure(
+			ip_attempts=int(os.environ.get("LOGIN_IP_ATTEMPTS", 20)),
+			account_attempts=int(os.environ.get("LOGIN_ACCOUNT_ATTEMPTS", 5)),
+			window_seconds=float(os.environ.get("LOGIN_THROTTLE_WINDOW_SECONDS", 60)),
+		)
+
 		# Set up database
 		await BaseDatabaseService.configure(
 			host=os.environ.get("DATABASE_HOST"),
 			port=os.environ.get("DATABASE_PORT"),
 			database_name=os.environ.get("DATABASE_NAME"),
 			user=os.environ.get("DATABASE_USER"),
-			password=os.environ.get("DATABASE_PASSWORD")
+			password=os.environ.get("DATABASE_PASSWORD"),
+			# Comma-separated "host" or "host:port"; the select helpers of the repositories read from them
+			replica_hosts=[host for host in os.environ.get("DATABASE_REPLICA_HOSTS", "").split(",") if host.strip()],
+			replica_selection=os.environ.get("DATABASE_REPLICA_SELECTION", "round_robin"),
 		)
 		
 		await BaseDatabaseService.init_models()
 		await SeedDatabaseService().seed_database()
+
+		# Set up the shared AI provider (OpenAI, or an in-process fake for offline load tests)
+		if os.environ.get("AI_BACKEND", "openai") == "fake":
+			AiProvider.configure(
+				backend="fake",
+				stt_latency=float(os.environ.get("FAKE_AI_STT_LATENCY", 0.4)),
+				llm_first_token_latency=float(os.environ.get("FAKE_AI_LLM_FIRST_TOKEN_LATENCY", 0.35)),
+				llm_token_latency=float(os.environ.get("FAKE_AI_LLM_TOKEN_LATENCY", 0.02)),
+				tts_latency=float(os.environ.get("FAKE_AI_TTS_LATENCY", 0.3)),
+			)
+		else:
+			AiProvider.configure(
+				backend="openai",
+				api_key=os.environ.get("OPENAI_API_KEY"),
+				max_connections=int(os.environ.get("AI_MAX_CONNECTIONS", 100)),
+				max_keepalive_connections=int(os.environ.get("AI_MAX_KEEPALIVE_CONNECTIONS", 20)),
+				keepalive_expiry=float(os.environ.get("AI_KEEPALIVE_EXPIRY", 60)),
+				connect_timeout=float(os.environ.get("AI_CONNECT_TIMEOUT", 5)),
+				read_timeout=float(os.environ.get("AI_READ_TIMEOUT", 60)),
+			)
+
+		AiCallScheduler.configure(
+			concurrency={
+				"stt": int(os.environ.get("AI_STT_CONCURRENCY", 8)),
+				"llm": int(os.environ.get("AI_LLM_CONCURRENCY", 16)),
+				"tts": int(os.environ.get("AI_TTS_CONCURRENCY", 16)),
+			},
+			max_queue=int(os.environ.get("AI_MAX_QUEUE", 100)),
+		)
+
+		if os.environ.get("TTS_CACHE_ENABLED", "true").lower() == "true":
+			TtsCache.configure(
+				memory_max_bytes=int(os.environ.get("TTS_CACHE_MEMORY_MB", 64)) * 1024 * 1024,
+				disk_path=os.environ.get("TTS_CACHE_DIR"),
+				disk_max_bytes=int(os.environ.get("TTS_CACHE_DISK_MB", 1024)) * 1024 * 1024,
+			)
+
+		# Verified JWTs, reused until they expire
+		VerifiedTokenCache.configure(max_entries=int(os.environ.get("AUTH_TOKEN_CACHE_SIZE", 10000)))
+
+		# Resolution of the shared timing wheel behind RestartableTimer
+		TimingWheel.configure(tick_seconds=float(os.environ.get("TIMER_TICK_MS", 10)) / 1000)
+
+		# Set up the websocket connection registry ("unix" when several worker processes share a host)
+		if os.environ.get("CONNECTION_REGISTRY", "local") == "unix":
+			ConnectionRegistry.configure(
+				backend="unix",
+				socket_path=os.environ.get("CONNECTION_REGISTRY_SOCKET", "/tmp/lingomate-connections.sock"),
+			)
+		else:
+			ConnectionRegistry.configure(backend="local")
+		await ConnectionRegistry.instance.start()
+
+		# Shared server-sent event channels: history kept for Last-Event-ID replay (and how long a channel without
+		# clients keeps it), the keep-alive interval, and the per-client buffer of slow clients (drop_oldest or
+		# coalesce; the hub never waits for a client)
+		SseHub.configure(
+			history_size=int(os.environ.get("SSE_HISTORY_SIZE", 256)),
+			heartbeat_seconds=float(os.environ.get("SSE_HEARTBEAT_SECONDS", 15)),
+			history_seconds=float(os.environ.get("SSE_HISTORY_SECONDS", 300)),
+			max_channels=int(os.environ.get("SSE_MAX_CHANNELS", 10000)),
+			limits=SseBufferLimits(
+				max_events=int(os.environ.get("SSE_BUFFER_MAX_EVENTS", 256)),
+				max_bytes=int(os.environ.get("SSE_BUFFER_MAX_BYTES", 1024 * 1024)),
+				policy=os.environ.get("SSE_BUFFER_POLICY", "drop_oldest"),
+			),
+		)
+
+		# Expose the stats the services already keep on /metrics
+		metrics.add_stats("ai_scheduler", "AI call scheduler", lambda: AiCallScheduler.instance.stats(), ["stage"])
+		metrics.add_stats("tts_cache", "TTS cache", lambda: TtsCache.instance.stats() if TtsCache.instance else None)
+		metrics.add_stats("connection_registry", "Websocket connection registry", lambda: ConnectionRegistry.instance.stats())
+		metrics.add_stats("timing_wheel", "Shared timing wheel", lambda: TimingWheel.get().stats())
+		metrics.add_stats("sse_hub", "Server-sent event hub", lambda: SseHub.instance.stats())
+		metrics.add_stats("token_cache", "Verified token cache", lambda: VerifiedTokenCache.get().stats())
+		metrics.add_stats("password_hasher", "Password hashing pool", lambda: PasswordHasher.get().stats())
+		metrics.add_stats("login_throttle", "Login throttling", lambda: LoginThrottle.get().stats())
+		metrics.add_stats("db_pool", "Database connection pool", BaseDatabaseService.pool_stats, ["database"])
+		metrics.add_stats("db_replicas", "Database read replica routing", BaseDatabaseService.replica_stats, ["database"])
    
 		# Set up API application
 		UVICORN_HOST = os.environ.get("UVICORN_HOST")
@@ -43,6 +147,7 @@ class Main:
 		static_data_controller = StaticDataController(app)
 		user_controller = UserController(app)
 		chat_controller = ChatController(app)
+		metrics_controller = MetricsController(app)
 
 		# Register Ctrl+C signal handler to stop the event loop
 		signal.signal(signal.SIGINT, lambda signum, frame: asyncio.create_task(self.shutdown(signum, frame)))
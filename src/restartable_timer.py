@@ -1,52 +1,75 @@
 import asyncio
 from datetime import timedelta
+from functools import partial
 import traceback
 from typing import Callable
 
+from timing_wheel import TimingWheel, WheelTimer
+
 
 class RestartableTimer:
-	def __init__(self):
-		self._timer_task = None
+	# Timers live in the event loop's shared TimingWheel, so restarting or cancelling one does not create or
+	# cancel a task. Only a callback that returns a coroutine gets a task of its own, when it fires.
+	def __init__(self, wheel: TimingWheel = None):
+		self._wheel = wheel
+		self._timer: WheelTimer = None
+		self._callback: Callable = None
+		self._callback_task = None
 		self.on_cancel = None
-	
+
 	def __enter__(self):
 		return self
-	
+
 	def __exit__(self, exc_type, exc_val, exc_tb):
 		self.cancel()
-	
-	async def _callback_with_delay(self, delay: timedelta, callback: Callable):
+
+	def _fire(self, callback: Callable):
+		self._timer = None
 		try:
-			await asyncio.sleep(delay.total_seconds())
-			
-			try:
-				result = callback()
-				if asyncio.iscoroutine(result):
-					await result
-			except Exception as e:
-				traceback.print_exc()
+			result = callback()
+			if asyncio.iscoroutine(result):
+				self._callback_task = asyncio.create_task(self._await_callback(result, callback))
+		except Exception as e:
+			traceback.print_exc()
 
+	async def _await_callback(self, result, callback: Callable):
+		try:
+			await result
 		except asyncio.CancelledError:
 			if self.on_cancel:
-				result = callback()
-				if asyncio.iscoroutine(result):
-					await result
+				self._run_callback(callback)
 			else:
 				raise
+		except Exception as e:
+			traceback.print_exc()
+
+	def _run_callback(self, callback: Callable):
+		result = callback()
+		if asyncio.iscoroutine(result):
+			asyncio.create_task(result)
 
 	def pending(self):
-		return self._timer_task and not self._timer_task.done()
+		return (self._timer is not None and self._timer.scheduled) or (self._callback_task is not None and not self._callback_task.done())
 
 	def cancel(self):
-		if self._timer_task:
-			self._timer_task.cancel()
+		if self._timer is not None:
+			timer, self._timer = self._timer, None
+			if self._wheel.cancel(timer) and self.on_cancel:
+				self._run_callback(self._callback)
+
+		if self._callback_task is not None:
+			self._callback_task.cancel()
+			self._callback_task = None
 
 	def schedule(self, delay: timedelta, callback: Callable, on_cancel: Callable = None):
 		self.on_cancel = on_cancel
 		self.cancel()
-		self._timer_task = asyncio.create_task(self._callback_with_delay(delay, callback))
-	
+		if self._wheel is None:
+			self._wheel = TimingWheel.get()
+		self._callback = callback
+		self._timer = self._wheel.schedule(delay.total_seconds(), partial(self._fire, callback))
+
 	def schedule_no_restart(self, delay: timedelta, callback: Callable, on_cancel: Callable = None):
 		self.on_cancel = on_cancel
-		if not self._timer_task or self._timer_task.done():
+		if not self.pending():
 			self.schedule(delay, callback)
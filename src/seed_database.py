@@ -22,6 +22,7 @@ class SeedDatabaseService:
 	async def seed_database(self):
 		async with BaseDatabaseService.get_session_maker("lingomate-db")() as session:
 			self.session: AsyncSession = session
+			BaseDatabaseService.use_primary(session)
 			self.account_service: AuthService = AuthService(self.session)
 			self.user_repository: UserRepository = self.account_service.user_repository
 
@@ -29,5 +30,5 @@ class SeedDatabaseService:
 
 	async def seed_accounts(self):
 		if True:
-			await self.try_add_user(User(id="Frod-c549abab-4753-853f-e205668dbb95", email_address="frode_flodhest@hotmail.com", password=self.account_service._hash_password("1234"), created_at=datetime.datetime.now(pytz.UTC)))
-			await self.try_add_user(User(id="Huss-c549abab-4753-853f-e205668dbb95", email_address="hussein_united@hotmail.com", password=self.account_service._hash_password("1234"), created_at=datetime.datetime.now(pytz.UTC)))
+			await self.try_add_user(User(id="Frod-c549abab-4753-853f-e205668dbb95", email_address="frode_flodhest@hotmail.com", password=await self.account_service._hash_password("1234"), created_at=datetime.datetime.now(pytz.UTC)))
+			await self.try_add_user(User(id="Huss-c549abab-4753-853f-e205668dbb95", email_address="hussein_united@hotmail.com", password=await self.account_service._hash_password("1234"), created_at=datetime.datetime.now(pytz.UTC)))
@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import io
+import time
+from typing import AsyncIterator
+import httpx
+from openai import AsyncOpenAI
+
+from services.exceptions import AppException
+
+
+class AiBackend:
+	async def warm_up(self):
+		pass
+
+	async def close(self):
+		pass
+
+	async def transcribe(self, audio: bytes, filename: str, model: str) -> str:
+		raise NotImplementedError()
+
+	async def complete(self, messages: list[dict], model: str, max_tokens: int) -> str:
+		raise NotImplementedError()
+
+	def stream_completion(self, messages: list[dict], model: str, max_tokens: int) -> AsyncIterator[str]:
+		raise NotImplementedError()
+
+	async def synthesize(self, text: str, model: str, voice: str, audio_format: str) -> bytes:
+		raise NotImplementedError()
+
+
+class OpenAiBackend(AiBackend):
+	def __init__(
+		self,
+		api_key: str,
+		max_connections: int = 100,
+		max_keepalive_connections: int = 20,
+		keepalive_expiry: float = 60.0,
+		connect_timeout: float = 5.0,
+		read_timeout: float = 60.0,
+		max_retries: int = 2,
+	):
+		self.keepalive_expiry = keepalive_expiry
+		self.last_warm_up = 0.0
+
+		# One connection pool for the whole process, so turns (and users) reuse keep-alive connections:
+		self.http_client = httpx.AsyncClient(
+			limits=httpx.Limits(
+				max_connections=max_connections,
+				max_keepalive_connections=max_keepalive_connections,
+				keepalive_expiry=keepalive_expiry,
+			),
+			timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+		)
+		self.client = AsyncOpenAI(api_key=api_key, http_client=self.http_client, max_retries=max_retries)
+
+	async def warm_up(self):
+		# A connection that was used within the keep-alive window is still open, so there is nothing to warm up:
+		now = time.monotonic()
+		if now - self.last_warm_up < self.keepalive_expiry / 2:
+			return
+		self.last_warm_up = now
+
+		try:
+			await self.http_client.head(str(self.client.base_url))
+		except httpx.HTTPError as e:
+			print(f"AI provider warm-up failed: {e.__class__.__name__}: {e}")
+
+	async def close(self):
+		await self.client.close()
+		await self.http_client.aclose()
+
+	async def transcribe(self, audio: bytes, filename: str, model: str) -> str:
+		buffer = io.BytesIO(audio)
+		buffer.name = filename
+
+		return await self.client.audio.transcriptions.create(
+			model=model,
+			file=buffer,
+			response_format="text"
+		)
+
+	async def complete(self, messages: list[dict], model: str, max_tokens: int) -> str:
+		response = await self.client.chat.completions.create(
+			model=model,
+			messages=messages,
+			max_tokens=max_tokens,
+		)
+
+		return response.choices[0].message.content
+
+	async def stream_completion(self, messages: list[dict], model: str, max_tokens: int) -> AsyncIterator[str]:
+		stream = await self.client.chat.completions.create(
+			model=model,
+			messages=messages,
+			max_tokens=max_tokens,
+			stream=True,
+		)
+
+		async for chunk in stream:
+			if not chunk.choices:
+				continue
+
+			delta = chunk.choices[0].delta.content
+			if delta:
+				yield delta
+
+	async def synthesize(self, text: str, model: str, voice: str, audio_format: str) -> bytes:
+		response = await self.client.audio.speech.create(
+			model=model,
+			voice=voice,
+			input=text,
+			response_format=audio_format
+		)
+
+		return response.content
+
+
+class FakeAiBackend(AiBackend):
+	default_reply = (
+		"That is a great question. In Norwegian, you would say it a little differently. "
+		"Try to stress the first syllable of the word. Let's practice it together a few times. "
+		"Say it after me, slowly at first, and then a bit faster."
+	)
+
+	def __init__(
+		self,
+		stt_latency: float = 0.4,
+		llm_first_token_latency: float = 0.35,
+		llm_token_latency: float = 0.02,
+		tts_latency: float = 0.3,
+		tts_latency_per_char: float = 0.002,
+		reply: str = default_reply,
+	):
+		self.stt_latency = stt_latency
+		self.llm_first_token_latency = llm_first_token_latency
+		self.llm_token_latency = llm_token_latency
+		self.tts_latency = tts_latency
+		self.tts_latency_per_char = tts_latency_per_char
+		self.reply = reply
+
+	async def transcribe(self, audio: bytes, filename: str, model: str) -> str:
+		await asyncio.sleep(self.stt_latency)
+		return f"Transcription of {len(audio)} bytes of audio."
+
+	async def complete(self, messages: list[dict], model: str, max_tokens: int) -> str:
+		tokens = self.reply.split(" ")
+		await asyncio.sleep(self.llm_first_token_latency + self.llm_token_latency * len(tokens))
+		return self.reply
+
+	async def stream_completion(self, messages: list[dict], model: str, max_tokens: int) -> AsyncIterator[str]:
+		await asyncio.sleep(self.llm_first_token_latency)
+
+		tokens = self.reply.split(" ")
+		for i, token in enumerate(tokens):
+			await asyncio.sleep(self.llm_token_latency)
+			yield token if i == len(tokens) - 1 else token + " "
+
+	async def synthesize(self, text: str, model: str, voice: str, audio_format: str) -> bytes:
+		await asyncio.sleep(self.tts_latency + self.tts_latency_per_char * len(text))
+
+		# Deterministic "audio" that depends on the input, roughly as large as real MP3 speech:
+		digest = hashlib.sha256(f"{model}|{voice}|{audio_format}|{text}".encode()).digest()
+		return digest * (len(text) * 100 // len(digest) + 1)
+
+
+class AiProvider:
+	backend: AiBackend = None
+
+	@staticmethod
+	def configure(backend: str = "openai", **kwargs):
+		if backend == "openai":
+			AiProvider.backend = OpenAiBackend(**kwargs)
+		elif backend == "fake":
+			AiProvider.backend = FakeAiBackend(**kwargs)
+		else:
+			raise AppException(f"Unknown AI backend: {backend}")
+
+		# Run a background task that will ensure that the connection pool is closed before the event loop is closed:
+		async def run():
+			try:
+				while True:
+					await asyncio.sleep(86400)
+			except asyncio.exceptions.CancelledError:
+				await AiProvider.backend.close()
+
+		asyncio.create_task(run())
+
+	@staticmethod
+	def get() -> AiBackend:
+		if AiProvider.backend is None:
+			raise AppException("AiProvider.configure must be called before the AI backend is used")
+		return AiProvider.backend
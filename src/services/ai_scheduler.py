@@ -0,0 +1,139 @@
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+import time
+
+from services.exceptions import AppException
+
+
+class SchedulerRejected(AppException):
+	pass
+
+
+class CallLane:
+	def __init__(self, kind: str, concurrency: int, max_queue: int, initial_service_seconds: float = 1.0, smoothing: float = 0.2):
+		self.kind = kind
+		self.concurrency = concurrency
+		self.max_queue = max_queue
+		self.smoothing = smoothing
+		self.active = 0
+
+		# Waiting calls grouped per user. Users are served round-robin: the user that got a slot moves to the back.
+		self.waiting: OrderedDict[str, deque[asyncio.Future]] = OrderedDict()
+		self.queued = 0
+
+		self.average_service_seconds = initial_service_seconds
+		self.calls = 0
+		self.rejected = 0
+		self.wait_seconds_total = 0.0
+		self.wait_seconds_max = 0.0
+
+	def estimated_wait(self) -> float:
+		return (self.queued // self.concurrency + 1) * self.average_service_seconds
+
+	def enqueue(self, user_id: str) -> asyncio.Future:
+		future = asyncio.get_running_loop().create_future()
+		self.waiting.setdefault(user_id, deque()).append(future)
+		self.queued += 1
+		return future
+
+	def remove(self, user_id: str, future: asyncio.Future):
+		waiters = self.waiting.get(user_id)
+		if waiters is not None and future in waiters:
+			waiters.remove(future)
+			self.queued -= 1
+			if not waiters:
+				del self.waiting[user_id]
+
+	def release(self, service_seconds: float):
+		self.average_service_seconds += self.smoothing * (service_seconds - self.average_service_seconds)
+
+		# Hand the slot directly to the next user in round-robin order, so a burst from one user cannot starve others:
+		while self.waiting:
+			user_id, waiters = next(iter(self.waiting.items()))
+			future = waiters.popleft()
+			self.queued -= 1
+			if waiters:
+				self.waiting.move_to_end(user_id)
+			else:
+				del self.waiting[user_id]
+
+			if not future.done():
+				future.set_result(None)
+				return
+
+		self.active -= 1
+
+	def record_wait(self, wait_seconds: float):
+		self.calls += 1
+		self.wait_seconds_total += wait_seconds
+		self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+
+	def stats(self) -> dict:
+		return {
+			"active": self.active,
+			"queued": self.queued,
+			"calls": self.calls,
+			"rejected": self.rejected,
+			"average_wait_seconds": self.wait_seconds_total / self.calls if self.calls else 0.0,
+			"max_wait_seconds": self.wait_seconds_max,
+			"average_service_seconds": self.average_service_seconds,
+		}
+
+
+class AiCallScheduler:
+	instance: "AiCallScheduler" = None
+
+	def __init__(self, concurrency: dict[str, int], max_queue: int = 100):
+		self.lanes = {kind: CallLane(kind, limit, max_queue) for kind, limit in concurrency.items()}
+
+	@staticmethod
+	def configure(**kwargs):
+		AiCallScheduler.instance = AiCallScheduler(**kwargs)
+
+	def stats(self) -> dict:
+		return {kind: lane.stats() for kind, lane in self.lanes.items()}
+
+	@asynccontextmanager
+	async def slot(self, kind: str, user_id: str, deadline: float = None):
+		# Waits for a free slot for an upstream call of the given kind ("stt", "llm" or "tts").
+		# The deadline is a time.monotonic() value; calls that cannot start before it are rejected right away.
+		lane = self.lanes[kind]
+		enqueued_at = time.monotonic()
+
+		if lane.active < lane.concurrency and lane.queued == 0:
+			lane.active += 1
+		else:
+			if lane.queued >= lane.max_queue:
+				lane.rejected += 1
+				raise SchedulerRejected(f"Too many {kind} requests are waiting, please try again")
+
+			if deadline is not None and enqueued_at + lane.estimated_wait() > deadline:
+				lane.rejected += 1
+				raise SchedulerRejected(f"The {kind} request would not finish in time, please try again")
+
+			future = lane.enqueue(user_id)
+			try:
+				timeout = None if deadline is None else max(deadline - enqueued_at, 0)
+				await asyncio.wait_for(asyncio.shield(future), timeout)
+
+			except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+				if future.done() and not future.cancelled():
+					# The slot was handed over just as the wait ended, so give it to the next caller:
+					lane.release(lane.average_service_seconds)
+				else:
+					future.cancel()
+					lane.remove(user_id, future)
+
+				if isinstance(e, asyncio.TimeoutError):
+					lane.rejected += 1
+					raise SchedulerRejected(f"The {kind} request timed out while waiting, please try again")
+				raise
+
+		started = time.monotonic()
+		lane.record_wait(started - enqueued_at)
+
+		try:
+			yield
+		finally:
+			lane.release(time.monotonic() - started)
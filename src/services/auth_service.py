@@ -1,4 +1,3 @@
-import bcrypt
 from sqlalchemy import select
 from auth import TokenUtils
 from data.base_repository import BaseRepository
@@ -6,6 +5,8 @@ from data.models import User
 from services.base_database_service import BaseDatabaseService, Depend
 from services.dtos import LoginResponse, RefreshTokenResponse
 from services.exceptions import AppException
+from services.login_throttle import LoginThrottle
+from services.password_hasher import PasswordHasher
 from services.user_service import UserRepository
 
 
@@ -13,11 +14,16 @@ class AuthService(BaseDatabaseService):
 	user_repository = Depend(UserRepository)
 
 	
-	async def login(self, username: str, password: str):
+	async def login(self, username: str, password: str, client_ip: str = None):
+		# Raises LoginThrottled before the database and the password hasher are used
+		throttle = LoginThrottle.get()
+		throttle.check(username, client_ip)
+
 		user = await self.user_repository.get_user_by_email(username)
-		if not user or not self._validate_password(password, user.password):
+		if not user or not await self._validate_password(password, user.password):
 			raise AppException("Incorrect username or password")
 		
+		throttle.succeeded(username)
 		access_token = TokenUtils.create_access_token(user.id)
 		refresh_token = TokenUtils.create_refresh_token(user.id)
 		return LoginResponse(
@@ -28,6 +34,8 @@ class AuthService(BaseDatabaseService):
 	async def refresh_token(self, user_id: str):
 		admin = await self.user_repository.get_user(user_id)
 		if not admin:
+			# The user is gone: drop its tokens from the cache (they are not revoked, only verified again on use)
+			TokenUtils.purge_cached_tokens(user_id)
 			raise AppException(f"Failed to refresh access token")
 
 		access_token = TokenUtils.create_access_token(admin.id)
@@ -35,9 +43,8 @@ class AuthService(BaseDatabaseService):
 			access_token=access_token,
 		)
 
-	def _hash_password(self, password: str):
-		salt = bcrypt.gensalt()
-		return bcrypt.hashpw(password.encode('utf-8'), salt)
+	async def _hash_password(self, password: str):
+		return await PasswordHasher.get().hash(password)
 	
-	def _validate_password(self, password: str, hashed_password: str):
-		return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+	async def _validate_password(self, password: str, hashed_password: str):
+		return await PasswordHasher.get().verify(password, hashed_password)
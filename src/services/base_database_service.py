@@ -1,10 +1,19 @@
 import asyncio
 from functools import wraps
-from typing import Type, TypeVar
+import itertools
+import os
+import random
+import re
+import time
+from typing import Callable, Type, TypeVar
 from fastapi import Depends, Request
+from sqlalchemy import Select, event
+from sqlalchemy.exc import DisconnectionError, TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncEngine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from data.models import Base
+from services.metrics import metrics
 
 
 async def get_database_session():
@@ -37,34 +46,352 @@ class BaseDatabaseService2:
 		await self.session.close()
 
 
+class PoolSettings:
+	pre_ping_strategies = ("always", "idle", "never")
+
+	def __init__(
+		self,
+		pool_size: int = 5,
+		max_overflow: int = 5,
+		pool_timeout: float = 30.0,
+		pool_recycle: int = 3600,
+		pre_ping: str = "idle",
+		pre_ping_idle_seconds: float = 30.0,
+		warm_up: int = None,
+	):
+		if pre_ping not in PoolSettings.pre_ping_strategies:
+			raise ValueError(f"pre_ping must be one of {PoolSettings.pre_ping_strategies}, got {pre_ping}")
+
+		self.pool_size = pool_size
+		self.max_overflow = max_overflow
+		self.pool_timeout = pool_timeout
+		self.pool_recycle = pool_recycle
+		# "always" pings on every checkout, "idle" only connections that were idle longer than pre_ping_idle_seconds
+		self.pre_ping = pre_ping
+		self.pre_ping_idle_seconds = pre_ping_idle_seconds
+		# Connections opened at startup, all of pool_size by default
+		self.warm_up = pool_size if warm_up is None else min(warm_up, pool_size + max_overflow)
+
+	@staticmethod
+	def from_env(database: str = None) -> "PoolSettings":
+		# DATABASE_POOL_SIZE applies to every database, DATABASE_POOL_SIZE__LINGOMATE_DB only to "lingomate-db"
+		suffix = "__" + re.sub(r"[^A-Z0-9]", "_", database.upper()) if database else None
+
+		def get(name: str, default):
+			value = os.environ.get(name + suffix) if suffix else None
+			if value is None:
+				value = os.environ.get(name)
+			return default if value is None or value == "" else value
+
+		warm_up = get("DATABASE_POOL_WARM_UP", None)
+		return PoolSettings(
+			pool_size=int(get("DATABASE_POOL_SIZE", 5)),
+			max_overflow=int(get("DATABASE_POOL_MAX_OVERFLOW", 5)),
+			pool_timeout=float(get("DATABASE_POOL_TIMEOUT_SECONDS", 30)),
+			pool_recycle=int(get("DATABASE_POOL_RECYCLE_SECONDS", 3600)),
+			pre_ping=get("DATABASE_POOL_PRE_PING", "idle"),
+			pre_ping_idle_seconds=float(get("DATABASE_POOL_PRE_PING_IDLE_SECONDS", 30)),
+			warm_up=None if warm_up is None else int(warm_up),
+		)
+
+
+class MonitoredQueuePool(AsyncAdaptedQueuePool):
+	# Times every checkout, including the wait for a free connection and opening a new one
+	monitor: "PoolMonitor" = None
+
+	def _do_get(self):
+		started = time.perf_counter()
+		try:
+			return super()._do_get()
+		except PoolTimeoutError:
+			if self.monitor is not None:
+				self.monitor.timeouts += 1
+			raise
+		finally:
+			if self.monitor is not None:
+				self.monitor.record_wait(time.perf_counter() - started)
+
+	def recreate(self):
+		pool = super().recreate()
+		pool.monitor = self.monitor
+		return pool
+
+
+class PoolMonitor:
+	def __init__(self, database: str, settings: PoolSettings, engine: AsyncEngine):
+		self.database = database
+		self.settings = settings
+		self.engine = engine
+		self.wait_histogram = metrics.histogram("db_pool_checkout_wait_seconds", "Time to check out a database connection", ["database"]).labels(database)
+
+		self.checkouts = 0
+		self.timeouts = 0
+		self.wait_seconds_total = 0.0
+		self.wait_seconds_max = 0.0
+		self.max_checked_out = 0
+		self.connects = 0
+		self.closes = 0
+		self.invalidations = 0
+		self.pings = 0
+		self.ping_failures = 0
+
+		engine.sync_engine.pool.monitor = self
+		# Listeners on the engine move along when the pool is recreated
+		event.listen(engine.sync_engine, "connect", self.on_connect)
+		event.listen(engine.sync_engine, "checkout", self.on_checkout)
+		event.listen(engine.sync_engine, "checkin", self.on_checkin)
+		event.listen(engine.sync_engine, "close", self.on_close)
+		event.listen(engine.sync_engine, "close_detached", self.on_close_detached)
+		event.listen(engine.sync_engine, "invalidate", self.on_invalidate)
+
+	def record_wait(self, seconds: float):
+		self.wait_seconds_total += seconds
+		self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+		self.wait_histogram.observe(seconds)
+
+	def on_connect(self, dbapi_connection, connection_record):
+		self.connects += 1
+
+	def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+		self.checkouts += 1
+		self.max_checked_out = max(self.max_checked_out, self.engine.sync_engine.pool.checkedout())
+
+		if self.settings.pre_ping != "idle":
+			return
+		checked_in_at = connection_record.info.get("checked_in_at")
+		if checked_in_at is None or time.monotonic() - checked_in_at <= self.settings.pre_ping_idle_seconds:
+			return
+
+		self.pings += 1
+		try:
+			self.engine.dialect.do_ping(dbapi_connection)
+		except Exception as e:
+			self.ping_failures += 1
+			# The pool discards the connection and checks out another one
+			raise DisconnectionError(f"Connection was lost while idle: {e}") from e
+
+	def on_checkin(self, dbapi_connection, connection_record):
+		connection_record.info["checked_in_at"] = time.monotonic()
+
+	def on_close(self, dbapi_connection, connection_record):
+		self.closes += 1
+
+	def on_close_detached(self, dbapi_connection):
+		self.closes += 1
+
+	def on_invalidate(self, dbapi_connection, connection_record, exception):
+		self.invalidations += 1
+
+	def stats(self) -> dict:
+		pool = self.engine.sync_engine.pool
+		checked_out = pool.checkedout()
+		capacity = self.settings.pool_size + self.settings.max_overflow
+		return {
+			"pool_size": self.settings.pool_size,
+			"max_overflow": self.settings.max_overflow,
+			"connections": checked_out + pool.checkedin(),
+			"checked_out": checked_out,
+			"utilization": checked_out / capacity if capacity else 0.0,
+			"max_checked_out": self.max_checked_out,
+			"checkouts": self.checkouts,
+			"timeouts": self.timeouts,
+			"average_wait_seconds": self.wait_seconds_total / self.checkouts if self.checkouts else 0.0,
+			"max_wait_seconds": self.wait_seconds_max,
+			# Churn: connections opened and closed after warm-up mean recycling, invalidation or overflow
+			"connects": self.connects,
+			"closes": self.closes,
+			"invalidations": self.invalidations,
+			"pings": self.pings,
+			"ping_failures": self.ping_failures,
+		}
+
+
+class ReplicaSet:
+	selections = ("round_robin", "random", "least_busy")
+
+	def __init__(self, database: str, addresses: list[tuple[str, str]], selection: str = "round_robin"):
+		if selection not in ReplicaSet.selections:
+			raise ValueError(f"Replica selection must be one of {ReplicaSet.selections}, got {selection}")
+
+		self.database = database
+		self.addresses = addresses
+		self.names = [BaseDatabaseService.engine_name(database, host, port) for host, port in addresses]
+		self.engines = [BaseDatabaseService.get_engine(database, host, port) for host, port in addresses]
+		self.selection = selection
+		self.cycle = itertools.cycle(range(len(self.engines)))
+
+		self.sessions = [0] * len(self.engines)
+		self.replica_reads = [0] * len(self.engines)
+		# Reads that could have gone to a replica, but went to the primary because their session had written
+		self.sticky_reads = 0
+
+	def choose(self) -> int:
+		if self.selection == "random":
+			return random.randrange(len(self.engines))
+		if self.selection == "least_busy":
+			return min(range(len(self.engines)), key=lambda index: self.engines[index].sync_engine.pool.checkedout())
+		return next(self.cycle)
+
+	def stats(self) -> dict:
+		stats = {name: {"sessions": self.sessions[index], "reads": self.replica_reads[index]} for index, name in enumerate(self.names)}
+		stats[self.database] = {"sticky_reads": self.sticky_reads}
+		return stats
+
+
+class RoutingSession(Session):
+	# Reads that allow a replica (bind_arguments={"replica": True}) go to one replica, chosen once per session. After
+	# the session's first write everything goes to the primary, so the session reads its own writes.
+	def get_bind(self, mapper=None, *, clause=None, replica: bool = False, **kwargs):
+		replicas: ReplicaSet = self.info.get("replicas")
+
+		if self._flushing or (clause is not None and not isinstance(clause, Select)):
+			self.info["primary"] = True
+
+		elif replica and replicas is not None:
+			if self.info.get("primary"):
+				replicas.sticky_reads += 1
+			else:
+				index = self.info.get("replica")
+				if index is None:
+					index = self.info["replica"] = replicas.choose()
+					replicas.sessions[index] += 1
+				replicas.replica_reads[index] += 1
+				return replicas.engines[index].sync_engine
+
+		return super().get_bind(mapper, clause=clause, **kwargs)
+
+
 class BaseDatabaseService:
 	engines: dict[str, AsyncEngine] = {}
 	session_makers: dict[str, sessionmaker] = {}
+	pool_settings: dict[str, PoolSettings] = {}
+	pool_monitors: dict[str, PoolMonitor] = {}
+	replica_sets: dict[str, ReplicaSet] = {}
+	# (database, host, port) -> engine URL; the MySQL URL of the configured credentials when not set
+	url_factory: Callable[[str, str, str], str] = None
 
 	@staticmethod
-	def get_engine(database: str):
-		engine = BaseDatabaseService.engines.get(database)
-		if engine is None:
-			url = "mysql+aiomysql://" + BaseDatabaseService.user + ":" + BaseDatabaseService.password + "@" + BaseDatabaseService.host + ":" + BaseDatabaseService.port + "/" + database
+	def url(database: str, host: str = None, port: str = None) -> str:
+		host = host or BaseDatabaseService.host
+		port = port or BaseDatabaseService.port
+		if BaseDatabaseService.url_factory is not None:
+			return BaseDatabaseService.url_factory(database, host, port)
+		return "mysql+aiomysql://" + BaseDatabaseService.user + ":" + BaseDatabaseService.password + "@" + host + ":" + port + "/" + database
+
+	@staticmethod
+	def engine_name(database: str, host: str = None, port: str = None) -> str:
+		# The primary is known by the database name, a replica by "<database>@<host>:<port>"
+		return database if host is None else f"{database}@{host}:{port}"
 
-			engine = create_async_engine(url, future=True, echo=False, pool_size=0, max_overflow=1, pool_recycle=3600, pool_pre_ping=True)
-			BaseDatabaseService.engines[database] = engine
+	@staticmethod
+	def get_pool_settings(database: str) -> PoolSettings:
+		settings = BaseDatabaseService.pool_settings.get(database)
+		if settings is None:
+			settings = BaseDatabaseService.pool_settings[database] = PoolSettings.from_env(database)
+		return settings
+
+	@staticmethod
+	def get_engine(database: str, host: str = None, port: str = None):
+		name = BaseDatabaseService.engine_name(database, host, port)
+		engine = BaseDatabaseService.engines.get(name)
+		if engine is None:
+			settings = BaseDatabaseService.get_pool_settings(database)
+			engine = create_async_engine(
+				BaseDatabaseService.url(database, host, port),
+				future=True,
+				echo=False,
+				poolclass=MonitoredQueuePool,
+				pool_size=settings.pool_size,
+				max_overflow=settings.max_overflow,
+				pool_timeout=settings.pool_timeout,
+				pool_recycle=settings.pool_recycle,
+				pool_pre_ping=settings.pre_ping == "always",
+			)
+			BaseDatabaseService.engines[name] = engine
+			BaseDatabaseService.pool_monitors[name] = PoolMonitor(name, settings, engine)
 		
 		return engine
 
+	@staticmethod
+	async def warm_up(database: str, host: str = None, port: str = None):
+		# Opens the pool's connections up front, so the first requests after startup do not pay for the connects
+		name = BaseDatabaseService.engine_name(database, host, port)
+		engine = BaseDatabaseService.get_engine(database, host, port)
+		count = BaseDatabaseService.get_pool_settings(database).warm_up
+		if count <= 0:
+			return
+
+		started = time.perf_counter()
+		results = await asyncio.gather(*(engine.connect().start() for _ in range(count)), return_exceptions=True)
+		connections = [result for result in results if not isinstance(result, BaseException)]
+		for connection in connections:
+			await connection.close()
+
+		errors = [result for result in results if isinstance(result, BaseException)]
+		if errors:
+			print(f"Database pool {name}: warmed up {len(connections)} of {count} connections, {len(errors)} failed: {errors[0]}")
+		else:
+			print(f"Database pool {name}: warmed up {count} connections in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+	@staticmethod
+	async def dispose():
+		# Closes every pool; engines and session makers are created again on next use
+		for engine in BaseDatabaseService.engines.values():
+			await engine.dispose()
+		BaseDatabaseService.engines.clear()
+		BaseDatabaseService.session_makers.clear()
+		BaseDatabaseService.pool_settings.clear()
+		BaseDatabaseService.pool_monitors.clear()
+		BaseDatabaseService.replica_sets.clear()
+
+	@staticmethod
+	def pool_stats() -> dict:
+		return {database: monitor.stats() for database, monitor in BaseDatabaseService.pool_monitors.items()}
+
+	@staticmethod
+	def configure_replicas(database: str, hosts: list[str], selection: str = "round_robin") -> ReplicaSet:
+		# hosts are "host" or "host:port"; the replicas use the primary's credentials and the same database name
+		addresses = []
+		for address in hosts:
+			host, _, port = address.strip().partition(":")
+			if host:
+				addresses.append((host, port or BaseDatabaseService.port))
+		replicas = BaseDatabaseService.replica_sets[database] = ReplicaSet(database, addresses, selection)
+		# Sessions made before now keep reading from the primary
+		BaseDatabaseService.session_makers.pop(database, None)
+		return replicas
+
+	@staticmethod
+	def use_primary(session: AsyncSession):
+		# For sessions that read what they are about to write, e.g. check-then-insert
+		session.info["primary"] = True
+
+	@staticmethod
+	def replica_stats() -> dict:
+		stats = {}
+		for replicas in BaseDatabaseService.replica_sets.values():
+			stats.update(replicas.stats())
+		return stats
+
 	@staticmethod
 	def get_session_maker(database: str):
 		session_maker = BaseDatabaseService.session_makers.get(database)
 		if session_maker is None:
 			engine = BaseDatabaseService.get_engine(database)
 
-			session_maker = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+			session_maker = sessionmaker(
+				engine,
+				expire_on_commit=False,
+				class_=AsyncSession,
+				sync_session_class=RoutingSession,
+				info={"replicas": BaseDatabaseService.replica_sets.get(database)},
+			)
 			BaseDatabaseService.session_makers[database] = session_maker
 		
 		return session_maker
 	
 	@staticmethod
-	async def configure(host, port, database_name, user, password):
+	async def configure(host, port, database_name, user, password, replica_hosts: list[str] = None, replica_selection: str = "round_robin", url_factory: Callable[[str, str, str], str] = None):
 		complete_sql_string = user + ":" + password + "@" + host +":" + port + "/" + database_name
 		DATABASE_URL = "mysql+aiomysql://" + complete_sql_string
 		# database = databases.Database(DATABASE_URL)
@@ -74,11 +401,19 @@ class BaseDatabaseService:
 		BaseDatabaseService.database = database_name
 		BaseDatabaseService.user = user
 		BaseDatabaseService.password = password
+		BaseDatabaseService.url_factory = url_factory
 		# BaseDatabaseService.engine = create_async_engine(DATABASE_URL, future=True, echo=False, pool_size=0, max_overflow=1)
 		# BaseDatabaseService.create_session = sessionmaker(BaseDatabaseService.engine, expire_on_commit=False, class_=AsyncSession)
 		BaseDatabaseService.engine = BaseDatabaseService.get_engine(database_name)
+		if replica_hosts:
+			BaseDatabaseService.configure_replicas(database_name, replica_hosts, replica_selection)
 		BaseDatabaseService.create_session = BaseDatabaseService.get_session_maker(database_name)
 
+		await BaseDatabaseService.warm_up(database_name)
+		if replica_hosts:
+			for host, port in BaseDatabaseService.replica_sets[database_name].addresses:
+				await BaseDatabaseService.warm_up(database_name, host, port)
+
 		# Run a background task that will ensure that the engine is disposed of before the event loop is closed:
 		async def run():
 			try:
@@ -1,11 +1,12 @@
 import asyncio
-import json
 from typing import Any, Callable, Mapping, Optional
 from fastapi import Depends, Response
 from starlette.background import BackgroundTask
+from starlette.datastructures import Headers
 from starlette.types import Receive, Scope, Send
-import anyio
-from anyio.abc import TaskStatus
+
+from services.sse_hub import SseBufferLimits, SseBufferPolicy, SseHub, SseStream
+from services.websocket_codec import WebsocketCodec
 
 
 class FunctionWrapper:
@@ -17,45 +18,53 @@ class FunctionWrapper:
 
 
 class AsyncStreamingResponse(Response):
+	# The producer coroutine queues events in a bounded per-client buffer that the request task writes. With the
+	# default Block policy the producer only waits while the buffer is full; DropOldest and Coalesce never make it wait.
 	def __init__(
 		self,
 		status_code: int = 200,
 		headers: Optional[Mapping[str, str]] = None,
 		media_type: Optional[str] = None,
 		background: Optional[BackgroundTask] = None,
+		limits: SseBufferLimits = None,
 	) -> None:
 		self.coroutine_function: Optional[Callable] = None
 		self.status_code = status_code
 		self.media_type = self.media_type if media_type is None else media_type
 		self.background = background
 		self.init_headers(headers)
+		self.sleep_task: asyncio.Task = None
+		# Created here, so events sent before the response is called are kept
+		self.stream = SseStream(None, limits or SseBufferLimits(policy=SseBufferPolicy.Block))
 	
 	async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
 		if self.coroutine_function is None:
 			raise Exception("coroutine_function must be set before the __call__ method of AsyncStreamingResponse is invoked")
 		
-		async with anyio.create_task_group() as task_group:
-			self.send = send
-			self.receive = receive
-			self.task_group = task_group
-			await task_group.start(self.connect)
-
-			self.sleep_task = asyncio.create_task(self.coroutine_function())
-			self.disconnect_listener_task = asyncio.create_task(self.listen_for_disconnect())
-
-			try:
-				await self.sleep_task
-
-			except asyncio.CancelledError:
-				pass
-
-			finally:
-				await send({"type": "http.response.body", "body": b"", "more_body": False})
-				task_group.cancel_scope.cancel()
-
-	async def connect(self, task_status: TaskStatus):
-		task_status.started()
-
+		self.send = send
+		self.receive = receive
+		self.stream.send = send
+		await self.connect()
+
+		self.sleep_task = asyncio.create_task(self.coroutine_function())
+		self.sleep_task.add_done_callback(lambda task: self.stream.finish())
+		self.disconnect_listener_task = asyncio.create_task(self.listen_for_disconnect())
+
+		try:
+			await self.stream.run()
+			# Errors of the producer are raised here, as before the buffer
+			if self.sleep_task.done() and not self.sleep_task.cancelled():
+				self.sleep_task.result()
+
+		finally:
+			self.sleep_task.cancel()
+			self.disconnect_listener_task.cancel()
+			stats = self.stream.stats()
+			if stats["dropped"] or stats["coalesced"] or stats["blocked"]:
+				print(f"SSE stream: {stats}")
+			await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+	async def connect(self):
 		await self.send({
 			"type": "http.response.start",
 			"status": self.status_code,
@@ -68,22 +77,13 @@ class AsyncStreamingResponse(Response):
 		await self.send({"type": "http.response.body", "body": chunk.encode(self.charset), "more_body": True})
 	
 	def close(self):
-		self.sleep_task.cancel()
-
-	async def send_json(self, content: Any) -> None:
-		json_payload = json.dumps(
-            content,
-            ensure_ascii=False,
-            allow_nan=False,
-            indent=None,
-            separators=(",", ":"),
-        )
+		if self.sleep_task is not None:
+			self.sleep_task.cancel()
+		self.stream.close()
 
-		await self.send({
-			"type": "http.response.body",
-			"body": f"data: {json_payload}\n\n".encode(self.charset),
-			"more_body": True,
-		})
+	async def send_json(self, content: Any, key: str = None) -> bool:
+		# Returns False once the client is gone
+		return await self.stream.put(b"".join((b"data: ", WebsocketCodec.encode(content), b"\n\n")), key)
 
 	def set_coroutine_function(self, coroutine_function: Callable):
 		self.coroutine_function = coroutine_function
@@ -98,6 +98,51 @@ class AsyncStreamingResponse(Response):
 		
 		self.close()
 
+
+
+class SseHubResponse(Response):
+	# Streams channels of the shared SseHub. Per client there is only the request task, which writes the queued
+	# events, and one task that waits for the disconnect.
+	media_type = "text/event-stream"
+
+	def __init__(self, channels: list[str], hub: SseHub = None, headers: Optional[Mapping[str, str]] = None, limits: SseBufferLimits = None, name: str = ""):
+		self.channels = channels
+		self.hub = hub or SseHub.get()
+		self.limits = limits or self.hub.limits
+		self.name = name
+		self.status_code = 200
+		self.background = None
+		self.init_headers({"Cache-Control": "no-cache", **(headers or {})})
+
+	async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+		# Browsers send the id of the last event they received when the EventSource reconnects
+		last_event_id = Headers(scope=scope).get("last-event-id")
+
+		await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+		await send({"type": "http.response.body", "body": b":\n\n", "more_body": True})
+
+		stream = SseStream(send, self.limits, self.name)
+		self.hub.subscribe(stream, self.channels, last_event_id)
+		disconnect_listener_task = asyncio.create_task(self.listen_for_disconnect(receive, stream))
+
+		try:
+			await stream.run()
+
+		finally:
+			self.hub.unsubscribe(stream)
+			disconnect_listener_task.cancel()
+			stats = stream.stats()
+			if stats["dropped"] or stats["coalesced"]:
+				print(f"SSE stream {self.name}: {stats}")
+			await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+	async def listen_for_disconnect(self, receive: Receive, stream: SseStream):
+		while True:
+			message = await receive()
+			if message["type"] == "http.disconnect":
+				break
+		stream.close()
+
 		
 class SSEResponse:
 	def __new__(cls, coroutine_function: Callable) -> AsyncStreamingResponse:
@@ -132,8 +177,15 @@ class BaseSSEService:
 		asyncio.create_task(stream_coro)
 		return self.sse
 
-	async def send_json(self, data: any):
-		await self.sse.send_json(data)
+	async def send_json(self, data: any, key: str = None):
+		await self.sse.send_json(data, key)
+
+	def publish(self, channel: str, data: Any, event: str = None, key: str = None) -> int:
+		# Encoded once and queued for every client of the channel, in this process; returns the event id
+		return SseHub.get().publish(channel, data, event, key)
+
+	def channel_response(self, *channels: str) -> SseHubResponse:
+		return SseHubResponse(list(channels))
 	
 	def close(self):
 		self.cleanup_callback.func = lambda: None
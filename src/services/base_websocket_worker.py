@@ -1,17 +1,32 @@
 import asyncio
 import enum
 from functools import partial
-import json
+import hmac
+import secrets
 import traceback
-from typing import Any
+from typing import Any, Union
+import uuid
 from fastapi import WebSocket, WebSocketDisconnect
 from fastapi.websockets import WebSocketState
 from pydantic import BaseModel
-from websockets import ConnectionClosedOK
+from websockets import ConnectionClosed
 from services.dtos import EventBase
-from asyncio import Queue
 
+from services.binary_envelope import Envelope, EnvelopeType
+from services.connection_registry import ConnectionRegistry
 from services.exceptions import AppException
+from services.inbound_queue import InboundBudget, InboundLimits, QueueOverflow
+from services.message_lanes import LaneMode, MessageLane
+from services.metrics import metrics
+from services.outbound_writer import OutboundLimits, OutboundWriter, SendPriority
+from services.replay_buffer import ReplayBuffer, ReplayLimits
+from services.topic_fanout import TopicFanout
+from services.utterance_assembler import UploadLimits, UtteranceAssembler
+from services.websocket_codec import WebsocketCodec
+
+
+active_connections = metrics.gauge("websocket_connections", "Open websocket connections", ["connection_type"])
+received_bytes = metrics.counter("websocket_received_bytes_total", "Bytes received over websockets", ["connection_type"])
 
 
 class WebsocketDataBase(EventBase):
@@ -20,54 +35,133 @@ class WebsocketDataBase(EventBase):
 class DataMode(enum.IntEnum):
 	Text = 0
 	Binary = 1
+	# Binary frames carry an Envelope: typed messages and raw audio share the channel without base64
+	Envelope = 2
 
 
 class BaseWebsocketWorker:
-	def __init__(self, data_models: list[WebsocketDataBase] = [], data_mode=DataMode.Text):
-		self.data_models: dict[str, WebsocketDataBase] = {model.model_fields["type"].default: model for model in data_models}
+	def __init__(self, data_models: list[WebsocketDataBase] = [], data_mode=DataMode.Text, upload_limits: UploadLimits = None, inbound_limits: InboundLimits = None, outbound_limits: OutboundLimits = None, replay_limits: ReplayLimits = None):
+		self.codec = WebsocketCodec(data_models)
+		self.data_models: dict[str, WebsocketDataBase] = self.codec.models
 		self.data_mode = data_mode
+		self.assembler = UtteranceAssembler(upload_limits) if upload_limits is not None else None
 		self.websocket = None
 		self.should_exit = False
-		self.queue = Queue()
-		self.queue_task = None
+		# Label for this connection's metrics; the ConnectionManager replaces it with its connection_type
+		self.connection_type = type(self).__name__
+		self.inbound_limits = inbound_limits or InboundLimits()
+		self.outbound_limits = outbound_limits or OutboundLimits()
+		self.writer: OutboundWriter = None
+		self.envelope_seq = 0
+
+		# With replay limits the session outlives a dropped socket, and the client can resume it with the
+		# resume token it received in the session message (see ConnectionManager.begin_unique)
+		self.replay_limits = replay_limits
+		self.resume_token = secrets.token_urlsafe(24) if replay_limits is not None else None
+		self.resumed = asyncio.Event()
+
+		# Set by the ConnectionManager, so the connection can subscribe to topics
+		self.fanout: TopicFanout = None
+		self.topics: set[str] = set()
+
+		# Messages are handled in lanes. Everything goes to the serial "default" lane unless a subclass routes
+		# a message type (or binary data) to a lane of its own with add_lane.
+		self.lanes: dict[str, MessageLane] = {"default": MessageLane("default", LaneMode.Serial)}
+		self.lane_routes: dict[str, str] = {}
+		self.binary_lane = "default"
 
 	@property
 	def is_connected(self):
 		return self.websocket is not None and self.websocket.application_state == WebSocketState.CONNECTED
 
-	async def process_queue(self):
-		while not self.should_exit:
-			coro_func = await self.queue.get()
-			await coro_func()
-			self.queue.task_done()
-	
+	@property
+	def can_send(self):
+		# A resumable session keeps queueing while the client is away; its writer refuses data once the session is closed
+		return self.writer is not None and (self.replay_limits is not None or self.websocket.application_state == WebSocketState.CONNECTED)
+
+	def add_lane(self, lane: MessageLane, message_types: list[type[WebsocketDataBase]] = [], binary: bool = False):
+		self.lanes[lane.name] = lane
+		for model in message_types:
+			self.lane_routes[model.model_fields["type"].default] = lane.name
+		if binary:
+			self.binary_lane = lane.name
+
+	def lane_stats(self) -> dict:
+		return {name: lane.stats() for name, lane in self.lanes.items()}
+
+	# The process_* methods run directly in the receive loop, which is the only producer for the lane queues.
+	# Messages are parsed before they are queued, so the queues only hold handler calls.
 	async def process_json_message(self, text: str):
 		try:
-			json_data = json.loads(text)
-
-			if "type" not in json_data:
-				raise AppException(f"No type field in message: {json_data}")
-			
-			model = self.data_models.get(json_data["type"], None)
-			if model is None:
-				raise AppException(f"Invalid data model in message: {json_data}")
+			data = self.codec.decode(text)
 
-			data = model(**json_data)
-			task_creator = partial(self.on_json_data, data)
-			self.queue.put_nowait(task_creator)
-		
-		# Handle pydantic validation errors
-		except (json.JSONDecodeError, AppException) as e:
+		# Handle invalid JSON and pydantic validation errors
+		except AppException as e:
 			traceback.print_exc()
-			error_resp = {
-				"message": f"{e.__class__.__name__}: {e}",
-				"type": "error"
-			}
-			await self.websocket.send_json(error_resp)
+			await self.send_error(e)
+			return
+
+		task_creator = partial(self.on_json_data, data)
+		await self.lanes[self.lane_routes.get(data.type, "default")].put(task_creator, len(text), data.type)
 	
 	async def process_binary_message(self, data: bytes):
 		task_creator = partial(self.on_binary_data, data)
-		self.queue.put_nowait(task_creator)
+		await self.lanes[self.binary_lane].put(task_creator, len(data), "binary")
+
+	async def process_upload_frame(self, frame: bytes):
+		try:
+			if self.assembler.starts_utterance(frame):
+				await self.on_utterance_started()
+
+			utterance = self.assembler.feed(frame)
+
+		except AppException as e:
+			traceback.print_exc()
+			await self.send_error(e)
+			return
+
+		if utterance is not None:
+			task_creator = partial(self.on_binary_data, utterance)
+			await self.lanes[self.binary_lane].put(task_creator, len(utterance), "binary")
+
+	async def process_envelope(self, frame: bytes):
+		try:
+			envelope = Envelope.parse(frame)
+
+			if envelope.type == EnvelopeType.Message:
+				data = self.codec.decode(bytes(envelope.meta))
+				task_creator = partial(self.on_json_data, data)
+				lane = self.lanes[self.lane_routes.get(data.type, "default")]
+				message_type = data.type
+
+			elif envelope.type == EnvelopeType.Audio:
+				if self.assembler is not None:
+					# A whole utterance in one envelope gets the same size limit as an assembled one
+					self.assembler.check_utterance(envelope.payload)
+					await self.on_utterance_started()
+				task_creator = partial(self.on_binary_data, envelope.payload)
+				lane = self.lanes[self.binary_lane]
+				message_type = "binary"
+
+			elif self.assembler is not None and envelope.type in (EnvelopeType.UtteranceStart, EnvelopeType.UtteranceChunk, EnvelopeType.UtteranceEnd):
+				if envelope.type == EnvelopeType.UtteranceStart:
+					await self.on_utterance_started()
+				utterance = self.assembler.feed_chunk(envelope.type, envelope.payload)
+				if utterance is None:
+					return
+				task_creator = partial(self.on_binary_data, utterance)
+				lane = self.lanes[self.binary_lane]
+				message_type = "binary"
+
+			else:
+				raise AppException(f"Unsupported envelope type: {envelope.type}")
+
+		except AppException as e:
+			traceback.print_exc()
+			await self.send_error(e)
+			return
+
+		await lane.put(task_creator, len(frame), message_type)
 
 	async def begin(self, websocket: WebSocket):
 		self.websocket = websocket
@@ -77,95 +171,252 @@ class BaseWebsocketWorker:
 			# This usually means the connection was closed before the handshake was completed
 			return
 
-		if self.data_mode == DataMode.Text:
-			receive_func = websocket.receive_text
-			process_func = self.process_json_message
-		else:
-			receive_func = websocket.receive_bytes
-			process_func = self.process_binary_message
-		
 		await websocket.accept()
 
+		# All sends go through the writer task, so handlers never wait on the network
+		replay = ReplayBuffer(self.replay_limits) if self.replay_limits is not None else None
+		self.writer = OutboundWriter(websocket, self.outbound_limits, self.on_slow_consumer, self.connection_type, replay)
+		await self.send_session_info(websocket, 0, resumed=False)
+		self.writer.start()
+
+		handed_over = False
 		try:
 			await self.on_connected()
-			self.queue_task = asyncio.create_task(self.process_queue())
-			
+			# All lanes together buffer at most inbound_limits.max_messages messages and max_bytes bytes
+			budget = InboundBudget(self.inbound_limits)
+			for lane in self.lanes.values():
+				lane.start(self.inbound_limits, self.connection_type, budget)
+
+			handed_over = await self.receive_messages(websocket)
+
+		finally:
+			if not handed_over:
+				await self.finish()
+
+	async def take_over(self, websocket: WebSocket, last_seq: int) -> bool:
+		# Moves the session to a new socket. The lanes kept running while the client was away, so a turn that was
+		# in flight has queued its reply; the frames after last_seq are written again first. Returns False (and the
+		# session keeps waiting for a resume) when the new socket is gone before it could take over.
+		if websocket.application_state == WebSocketState.DISCONNECTED:
+			return False
+
+		try:
+			await websocket.accept()
+			await self.send_session_info(websocket, last_seq, resumed=True)
+		except (ConnectionClosed, WebSocketDisconnect, RuntimeError):
+			return False
+
+		previous = self.websocket
+		self.writer.detach()
+		self.websocket = websocket
+		self.writer.attach(websocket, last_seq)
+		self.resumed.set()
+
+		if previous is not None and previous.client_state == WebSocketState.CONNECTED:
+			# The old socket has not noticed the drop yet; its receive loop ends with its next message
+			asyncio.create_task(self.close_socket(previous, 1001))
+		return True
+
+	async def resume(self, websocket: WebSocket):
+		# Runs the session on the socket that took it over
+		handed_over = False
+		try:
+			handed_over = await self.receive_messages(websocket)
+
+		finally:
+			if not handed_over:
+				await self.finish()
+
+	async def receive_messages(self, websocket: WebSocket) -> bool:
+		# Returns True when the session continues on another socket, and False when it is over
+		connections = active_connections.labels(self.connection_type)
+		connections.inc()
+		received = received_bytes.labels(self.connection_type)
+		closed_normally = False
+
+		try:
 			while not self.should_exit:
+				# While a lane queue is full (with the Block policy), the process_* call waits and nothing is received
 				data = await websocket.receive()
+				if data["type"] == "websocket.disconnect":
+					closed_normally = data.get("code") == 1000
+					break
+				if websocket is not self.websocket:
+					break
+
 				text = data.get("text", None)
 				if text is not None:
-					task_creator = partial(self.process_json_message, text)
-					self.queue.put_nowait(task_creator)
+					received.inc(len(text))
+					await self.process_json_message(text)
 				else:
 					binary = data.get("bytes", None)
 					if binary is not None:
-						task_creator = partial(self.process_binary_message, binary)
-						self.queue.put_nowait(task_creator)
+						received.inc(len(binary))
+					if binary is not None and self.data_mode == DataMode.Envelope:
+						await self.process_envelope(binary)
+					elif binary is not None and self.assembler is not None:
+						await self.process_upload_frame(binary)
+					elif binary is not None:
+						await self.process_binary_message(binary)
 		
 		except WebSocketDisconnect as e:
-			pass
+			closed_normally = e.code == 1000
+
+		except QueueOverflow as e:
+			print(f"Closing connection: {e}")
+			await self.send_error(e)
+			await self.close(code=1009)
 
 		finally:
-			await self.close()
-			await self.on_disconnected()
+			connections.dec()
 
-	async def close(self):
-		if self.queue_task is not None:
-			self.queue_task.cancel()
+		if websocket is not self.websocket:
+			return not self.should_exit
+		# A normal close ends the session; after anything else (like a dropped network) it can be resumed
+		if self.should_exit or closed_normally or self.replay_limits is None:
+			return False
+		return await self.wait_for_resume(websocket)
+
+	async def wait_for_resume(self, websocket: WebSocket) -> bool:
+		# The client dropped without closing the session. Turns keep running and queue their messages until
+		# the client resumes on another socket, or the session ends after ttl_seconds.
+		self.writer.detach()
+		self.resumed.clear()
+		try:
+			await asyncio.wait_for(self.resumed.wait(), self.replay_limits.ttl_seconds)
+		except asyncio.TimeoutError:
+			print(f"Session expired after {self.replay_limits.ttl_seconds} seconds without a resume")
+			return False
+
+		return websocket is not self.websocket and not self.should_exit
+
+	def can_resume(self, resume_token: str, last_seq: int) -> bool:
+		return (
+			self.replay_limits is not None
+			and not self.should_exit
+			and self.writer is not None
+			and last_seq is not None
+			# As bytes, since compare_digest rejects str with non-ASCII characters
+			and hmac.compare_digest(resume_token.encode(), self.resume_token.encode())
+			and self.writer.replay.covers(last_seq)
+		)
+
+	async def send_session_info(self, websocket: WebSocket, seq: int, resumed: bool):
+		# Sent first on every socket of a resumable session, outside of the numbered frames. The frames after it
+		# are numbered seq + 1, seq + 2, ...; the client reports the last number it received when it resumes.
+		if self.replay_limits is None:
+			return
+		info = {"type": "session", "resume_token": self.resume_token, "seq": seq, "resumed": resumed}
+		await websocket.send_text(self.codec.encode(info).decode())
+
+	async def finish(self):
+		for name, stats in self.lane_stats().items():
+			if stats.get("dropped") or stats.get("blocked") or stats.get("failed"):
+				print(f"Inbound lane {name}: {stats}")
+
+		outbound_stats = self.writer.stats()
+		if outbound_stats["dropped"] or outbound_stats["slow_consumer"]:
+			print(f"Outbound writer: {outbound_stats}")
+		if self.writer.replay is not None and self.writer.replay.replayed:
+			print(f"Replay buffer: {self.writer.replay.stats()}")
+
+		await self.close()
+		await self.on_disconnected()
+
+	async def close(self, code: int = 1000):
+		for lane in self.lanes.values():
+			lane.stop()
+		if self.fanout is not None:
+			self.fanout.unsubscribe_all(self)
 			
 		self.should_exit = True
+		# Ends a session that is waiting for a resume
+		self.resumed.set()
+		if self.writer is not None:
+			# Give events that are already queued (like a final error) a chance to go out first:
+			if self.websocket.client_state == WebSocketState.CONNECTED:
+				await self.writer.drain(self.outbound_limits.close_drain_seconds)
+			self.writer.stop()
+
 		if self.websocket:
-			try:
-				await self.websocket.close()
+			await self.close_socket(self.websocket, code)
 
-			except RuntimeError:
-				# Will be thrown if the connection is already closed
-				pass
+	async def close_socket(self, websocket: WebSocket, code: int):
+		try:
+			await websocket.close(code)
 
-	async def send(self, data: Any):
+		except RuntimeError:
+			# Will be thrown if the connection is already closed
+			pass
+
+	# The send methods only queue the data for the writer task. They return False when the connection is
+	# closed or the data could not be queued. Data sent with a turn can be discarded when that turn is cancelled.
+	async def send(self, data: Any, priority: SendPriority = SendPriority.Control):
 		# Verify that the data type inherits from BaseModel:
 		# if not issubclass(type(data), BaseModel):
 		# 	raise LingoException(f"Data type {type(data)} does not inherit from BaseModel")
 		
-		if self.websocket and self.websocket.application_state == WebSocketState.CONNECTED:
-			# print(f"ACTUALLY Sending: {data}")
-			try:
-				await self.websocket.send_json(data)
-			except ConnectionClosedOK as e:
-				pass
-
-			return True
+		if self.can_send:
+			return self.writer.enqueue(self.codec.encode(data).decode(), priority)
 		else:
 			return False
 	
-	async def send_json(self, data: BaseModel):
+	async def send_json(self, data: BaseModel, priority: SendPriority = SendPriority.Control, turn: int = None):
 		# Verify that the data type inherits from BaseModel:
 		if not issubclass(type(data), BaseModel):
 			raise AppException(f"Data type {type(data)} does not inherit from BaseModel")
 		
-		if self.websocket and self.websocket.application_state == WebSocketState.CONNECTED:
-			try:
-				await self.websocket.send_text(json.dumps(data.model_dump()))
-			except ConnectionClosedOK as e:
-				pass
-
-			return True
+		if self.can_send:
+			return self.writer.enqueue(self.codec.encode(data).decode(), priority, turn)
 		else:
 			return False
 	
-	async def send_binary(self, data: bytes):
-		if self.websocket and self.websocket.application_state == WebSocketState.CONNECTED:
-			try:
-				await self.websocket.send_bytes(data)
-			except ConnectionClosedOK as e:
-				pass
-
-			return True
+	async def send_error(self, e: Exception):
+		error_resp = {
+			"message": f"{e.__class__.__name__}: {e}",
+			"type": "error"
+		}
+		return await self.send(error_resp)
+
+	async def send_binary(self, data: bytes, priority: SendPriority = SendPriority.Bulk, turn: int = None):
+		if self.can_send:
+			return self.writer.enqueue(bytes(data), priority, turn)
+		else:
+			return False
+
+	async def send_envelope(self, envelope_type: int, payload: bytes = b"", meta: Any = None, flags: int = 0, priority: SendPriority = SendPriority.Bulk, turn: int = None):
+		if self.can_send:
+			self.envelope_seq += 1
+			return self.writer.enqueue(Envelope.encode(envelope_type, payload, self.envelope_seq, flags, meta), priority, turn)
+		else:
+			return False
+
+	async def send_encoded(self, payload: Union[str, bytes], priority: SendPriority = SendPriority.Control):
+		# For messages that were encoded elsewhere, e.g. forwarded from another worker process
+		if self.can_send:
+			return self.writer.enqueue(payload, priority)
 		else:
 			return False
+
+	def subscribe(self, topic: str):
+		if self.fanout is None:
+			raise AppException("Only connections started by a ConnectionManager can subscribe to topics")
+		self.fanout.subscribe(topic, self)
+
+	def unsubscribe(self, topic: str):
+		if self.fanout is not None:
+			self.fanout.unsubscribe(topic, self)
+
+	async def on_slow_consumer(self, reason: str):
+		print(f"Closing slow consumer: {reason}")
+		self.should_exit = True
+		try:
+			await self.websocket.close(1008)
+		except RuntimeError:
+			pass
 		
 	def add_data_models_in(self, models: dict[str, BaseModel]):
-		self.data_models.update(models)
+		self.codec.register(models)
 
 	async def on_connected(self):
 		pass
@@ -179,36 +430,99 @@ class BaseWebsocketWorker:
 	async def on_binary_data(self, data: bytes):
 		pass
 
+	async def on_utterance_started(self):
+		pass
+
 
 
 class ConnectionManager:
-	def __init__(self, connection_type: str):
+	def __init__(self, connection_type: str, registry: ConnectionRegistry = None, fanout: TopicFanout = None):
 		self.connection_type = connection_type
 		self.connections: dict[str, BaseWebsocketWorker] = {}
+		self.tokens: dict[str, str] = {}
+		self.registry = registry
+		self.fanout = fanout or TopicFanout()
 	
-
-	async def begin_unique(self, websocket: WebSocket, client_id: str, **kwargs: Any):
+	def get_registry(self) -> ConnectionRegistry:
+		# Resolved lazily, since managers are usually created before the registry is configured
+		if self.registry is None:
+			self.registry = ConnectionRegistry.get()
+			self.registry.attach(self)
+		return self.registry
+
+	async def begin_unique(self, websocket: WebSocket, client_id: str, resume_token: str = None, last_seq: int = None, **kwargs: Any):
+		registry = self.get_registry()
 		existing_connection = self.connections.get(client_id, None)
+		token = uuid.uuid4().hex
+
+		# A client that reconnects with the resume token of its session (and a last_seq that is still in the
+		# replay buffer) continues that session on the new socket. Otherwise the session starts over.
+		resumed = existing_connection is not None and resume_token is not None and existing_connection.can_resume(resume_token, last_seq)
+		if resumed:
+			# The session only changes owner once the new socket has taken it over. Until then it stays with the
+			# socket that is waiting for the resume, which ends it when the resume never comes.
+			if not await existing_connection.take_over(websocket, last_seq):
+				print(f"Resume failed: {client_id} ({self.connection_type}), the new socket is already closed")
+				return
+			connection = existing_connection
+		else:
+			connection = self.create_connection(client_id, websocket, **kwargs)
+			connection.fanout = self.fanout
+			connection.connection_type = self.connection_type
+
+		self.connections[client_id] = connection
+		self.tokens[client_id] = token
+
+		# Claiming the client also kicks a connection for the same client in another worker:
+		await registry.claim(self.connection_type, client_id, token)
 
 		# Close the connection
-		if existing_connection is not None:
+		if resumed:
+			print(f"Connected: {client_id} (Resumed {self.connection_type} after frame {last_seq})")
+		elif existing_connection is not None:
 			print(f"Connected: {client_id} (Replacement {self.connection_type})")
-			connection = self.create_connection(client_id, websocket, **kwargs)
-			self.connections[client_id] = connection
-
 			await existing_connection.close()
-			await connection.begin()
-
 		else:
 			print(f"Connected: {client_id} ({self.connection_type})")
-			connection = self.create_connection(client_id, websocket, **kwargs)
-			self.connections[client_id] = connection
-			await connection.begin()
 
-		# Remove the client from the list of clients only if it owns the websocket connection:
-		if connection == self.connections[client_id]:
-			print(f"Disconnected: {client_id} ({self.connection_type})")
-			del self.connections[client_id]
+		try:
+			if resumed:
+				await connection.resume(websocket)
+			else:
+				await connection.begin(websocket)
+
+		finally:
+			# Remove the client from the list of clients only if this socket still owns the session:
+			if self.tokens.get(client_id) == token:
+				print(f"Disconnected: {client_id} ({self.connection_type})")
+				del self.connections[client_id]
+				del self.tokens[client_id]
+				await registry.release(self.connection_type, client_id, token)
+
+	async def kick(self, client_id: str, token: str):
+		# Called by the registry when the client connected again in another worker
+		connection = self.connections.get(client_id)
+		if connection is not None and self.tokens.get(client_id) == token:
+			print(f"Disconnected: {client_id} (Replaced in another worker, {self.connection_type})")
+			await connection.close()
+
+	async def send_to(self, client_id: str, data: Any) -> bool:
+		# Sends to the client's connection, whichever worker process it lives in
+		connection = self.connections.get(client_id)
+		if connection is not None:
+			return await connection.send(data)
+		return await self.get_registry().deliver(self.connection_type, client_id, WebsocketCodec.encode(data).decode())
+
+	async def publish(self, topic: str, data: Any, priority: SendPriority = SendPriority.Control) -> int:
+		# Encoded once for all subscribers, in this worker and (through the registry) in the other workers.
+		# Returns the number of local subscribers the message was queued for.
+		payload = WebsocketCodec.encode(data).decode()
+		await self.get_registry().publish(self.connection_type, topic, payload, priority)
+		return await self.fanout.publish(topic, payload, priority)
+
+	async def deliver_local(self, client_id: str, payload: str) -> bool:
+		connection = self.connections.get(client_id)
+		return connection is not None and await connection.send_encoded(payload)
 	
 
 	def create_connection(self, client_id: str, websocket: WebSocket) -> BaseWebsocketWorker:
@@ -0,0 +1,67 @@
+import enum
+import struct
+from typing import Any, Union
+import orjson
+
+from services.exceptions import AppException
+from services.utterance_assembler import UploadMarker
+
+
+class EnvelopeType(enum.IntEnum):
+	# The utterance upload markers keep their values, so the assembler handles both framings the same way
+	UtteranceStart = UploadMarker.Start
+	UtteranceChunk = UploadMarker.Chunk
+	UtteranceEnd = UploadMarker.End
+	# A complete recording (client to server) or a chunk of synthesized speech (server to client)
+	Audio = 4
+	# A typed JSON message carried in the metadata, without payload
+	Message = 5
+
+
+class EnvelopeFlags(enum.IntFlag):
+	Final = 1
+
+
+class Envelope:
+	# Frame layout (network byte order):
+	#   type: u8 | flags: u8 | seq: u32 | metadata length: u16 | metadata (JSON) | payload
+	header = struct.Struct("!BBIH")
+	__slots__ = ("type", "flags", "seq", "meta", "payload")
+
+	def __init__(self, envelope_type: int, flags: int, seq: int, meta: memoryview, payload: memoryview):
+		self.type = envelope_type
+		self.flags = flags
+		self.seq = seq
+		self.meta = meta
+		self.payload = payload
+
+	@staticmethod
+	def parse(frame: Union[bytes, bytearray]) -> "Envelope":
+		# meta and payload are views into the frame, so audio is never copied while parsing
+		if len(frame) < Envelope.header.size:
+			raise AppException(f"Envelope frame too short: {len(frame)} bytes")
+
+		envelope_type, flags, seq, meta_length = Envelope.header.unpack_from(frame)
+		meta_end = Envelope.header.size + meta_length
+		if meta_end > len(frame):
+			raise AppException(f"Envelope metadata length {meta_length} exceeds the frame")
+
+		view = memoryview(frame)
+		return Envelope(envelope_type, flags, seq, view[Envelope.header.size:meta_end], view[meta_end:])
+
+	@staticmethod
+	def encode(envelope_type: int, payload: Union[bytes, bytearray, memoryview] = b"", seq: int = 0, flags: int = 0, meta: Any = None) -> bytes:
+		if meta is None:
+			meta_bytes = b""
+		elif isinstance(meta, (bytes, bytearray, memoryview)):
+			meta_bytes = meta
+		else:
+			meta_bytes = orjson.dumps(meta)
+
+		if len(meta_bytes) > 0xFFFF:
+			raise AppException(f"Envelope metadata exceeds 65535 bytes: {len(meta_bytes)}")
+
+		return b"".join((Envelope.header.pack(envelope_type, flags, seq & 0xFFFFFFFF, len(meta_bytes)), meta_bytes, payload))
+
+	def metadata(self) -> dict:
+		return orjson.loads(self.meta) if len(self.meta) else {}
@@ -1,10 +1,26 @@
-import io
+import asyncio
+from functools import partial
 import json
 import os
+import time
 import traceback
+from typing import Optional
 from fastapi import WebSocket
-from services.base_websocket_worker import BaseWebsocketWorker, DataMode, WebsocketDataBase
-from openai import AsyncOpenAI
+from services.base_websocket_worker import BaseWebsocketWorker, ConnectionManager, DataMode, WebsocketDataBase
+from services.binary_envelope import EnvelopeType
+from services.ai_providers import AiProvider
+from services.ai_scheduler import AiCallScheduler, SchedulerRejected
+from services.conversation_memory import ConversationMemory
+from services.inbound_queue import InboundLimits
+from services.message_lanes import LaneMode, MessageLane
+from services.outbound_writer import OutboundLimits, SendPriority
+from services.replay_buffer import ReplayLimits
+from services.speech_feedback import SpeechFeedback, SpeechFeedbackEngine
+from services.tts_cache import TtsCache
+from services.turn_manager import TurnManager
+from services.utterance_assembler import UploadLimits
+from services.voice_activity import VoiceActivityDetector
+from services.voice_pipeline import VoicePipeline
 
 
 class AudioData(WebsocketDataBase):
@@ -15,75 +31,187 @@ class TestData(WebsocketDataBase):
 	type: str = "test_data"
 	data: str
 
+class SpeechEnd(WebsocketDataBase):
+	type: str = "speech_end"
+	turn: Optional[int] = None
+
+class SpeechCancelled(WebsocketDataBase):
+	type: str = "speech_cancelled"
+	turn: Optional[int] = None
+
+class FeedbackEvent(WebsocketDataBase):
+	type: str = "feedback"
+	words_per_minute: Optional[float]
+	syllables_per_second: float
+	pause_ratio: float
+	mean_pause_seconds: float
+	pause_count: int
+	pitch_variability_semitones: Optional[float]
+	speech_seconds: float
+
 class VoiceChatWorker(BaseWebsocketWorker):
-	def __init__(self):
+	def __init__(
+		self,
+		user_id: str = None,
+		streaming: bool = True,
+		upload_limits: UploadLimits = UploadLimits(),
+		vad: bool = True,
+		memory_token_budget: int = 2000,
+		turn_deadline_seconds: float = 30.0,
+		feedback: bool = True,
+		inbound_limits: InboundLimits = InboundLimits(),
+		outbound_limits: OutboundLimits = OutboundLimits(),
+		binary_envelope: bool = False,
+		replay_limits: ReplayLimits = None,
+	):
 		data_models = [
 			AudioData,
 			TestData,
 		]
 
-		super().__init__(data_models, data_mode=DataMode.Binary)
+		data_mode = DataMode.Envelope if binary_envelope else DataMode.Binary
+		super().__init__(data_models, data_mode=data_mode, upload_limits=upload_limits, inbound_limits=inbound_limits, outbound_limits=outbound_limits, replay_limits=replay_limits)
+
+		# Control messages are answered right away, even while an audio turn is running in the default lane:
+		self.add_lane(MessageLane("control", LaneMode.Concurrent, concurrency=4), [TestData])
+		self.user_id = user_id
+		self.streaming = streaming
+		self.turn_deadline_seconds = turn_deadline_seconds
+		self.pipeline = VoicePipeline(
+			AiProvider.get(),
+			vad=VoiceActivityDetector() if vad else None,
+			tts_cache=TtsCache.instance,
+			memory=ConversationMemory(token_budget=memory_token_budget),
+			scheduler=AiCallScheduler.instance,
+			user_id=user_id,
+			feedback=SpeechFeedbackEngine() if feedback else None,
+		)
+		self.turns = TurnManager()
+		self.warm_up_task = None
 	
 	async def on_connected(self):
 		print("WebSocket: VoiceChatWorker connected")
 
+		# Open the upstream connection while the learner is still recording:
+		self.warm_up_task = asyncio.create_task(self.pipeline.backend.warm_up())
+
 	async def on_disconnected(self):
 		print("WebSocket: VoiceChatWorker disconnected")
+		self.pipeline.memory.close()
 
 	async def on_json_data(self, data: WebsocketDataBase):
 		print(f"WebSocket: VoiceChatWorker data: {data}")
 		await self.send_json(data)
 	
+	async def on_utterance_started(self):
+		# Barge-in: the learner started talking again, so the reply that is still being produced is dropped
+		turn = self.turns.current_turn
+		if self.turns.cancel_current():
+			# Audio of the cancelled reply that has not been written yet is not sent anymore. What earlier turns
+			# queued (like the end of the previous reply) still goes out.
+			self.writer.discard(SendPriority.Bulk, turn)
+			await self.send_json(SpeechCancelled(turn=turn))
+
 	async def on_binary_data(self, data: bytes):
+		await self.turns.run(partial(self.respond, data))
+
+	async def send_audio(self, data: bytes, turn: int = None):
+		if self.data_mode == DataMode.Envelope:
+			return await self.send_envelope(EnvelopeType.Audio, data, turn=turn)
+		return await self.send_binary(data, turn=turn)
+
+	async def send_feedback(self, feedback: SpeechFeedback):
+		await self.send_json(FeedbackEvent(**feedback.to_dict()))
+
+	async def respond(self, data: bytes, turn: int = None):
 		print(f"WebSocket: VoiceChatWorker binary data.")
+		deadline = time.monotonic() + self.turn_deadline_seconds
+		send_audio = partial(self.send_audio, turn=turn)
 
 		try:
-			buffer = io.BytesIO(data)
-			buffer.name = "audio.m4a"
-
-			client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-			transcription = await client.audio.transcriptions.create(
-				model="whisper-1",
-				file=buffer,
-				response_format="text"
-			)
-
-			print(f"Transcription: {transcription}")
-
-			response = await client.chat.completions.create(
-				model="gpt-4o",
-				messages=[
-					{"role": "system", "content": "You are a helpful assistant."},
-					{"role": "user", "content": transcription},
-				],
-				max_tokens=1000,
-			)
-
-			gpt_response = response.choices[0].message.content
-			print(f"GPT Response: {gpt_response}")
-
-			response = await client.audio.speech.create(
-				model="tts-1",
-				voice="alloy",
-				input=gpt_response,
-				response_format="mp3"
-			)
-
-			# Convert the response to binary data
-			speech = response.content
-
-			print(f"Sending speech data: {len(speech)} bytes")
-			await self.send_binary(speech)
-			print("Speech data sent")
+			if self.streaming:
+				# Each sentence is sent as its own MP3 chunk as soon as it has been synthesized:
+				await self.pipeline.respond_streaming(data, send_audio, deadline, self.send_feedback)
+				# Queued with the audio, so it cannot overtake the last chunks:
+				await self.send_json(SpeechEnd(turn=turn), SendPriority.Bulk, turn)
+				print("Speech stream sent")
+			else:
+				speech = await self.pipeline.respond_buffered(data, deadline, self.send_feedback)
+				if not speech:
+					return
+
+				print(f"Sending speech data: {len(speech)} bytes")
+				await send_audio(speech)
+				print("Speech data sent")
+
+		except SchedulerRejected as e:
+			print(f"Turn rejected: {e}")
+			await self.send_error(e)
 
 		except Exception as e:
 			traceback.print_exc()
 		
-			await self.send_binary(data)
+			await send_audio(data)
+
+
+class VoiceChatConnectionManager(ConnectionManager):
+	def create_connection(self, client_id: str, websocket: WebSocket, **kwargs) -> VoiceChatWorker:
+		return VoiceChatWorker(user_id=client_id, **kwargs)
 
 
 class ChatService:
-	async def start_voice_chat(self, websocket: WebSocket):
-		worker = VoiceChatWorker()
-		await worker.begin(websocket)
+	connections = VoiceChatConnectionManager("voice_chat")
+
+	async def start_voice_chat(self, websocket: WebSocket, user_id: str, resume_token: str = None, last_seq: int = None):
+		streaming = os.getenv("VOICE_CHAT_STREAMING", "true").lower() == "true"
+		upload_limits = UploadLimits(
+			max_chunk_bytes=int(os.getenv("CHAT_UPLOAD_MAX_CHUNK_BYTES", 64 * 1024)),
+			max_utterance_bytes=int(os.getenv("CHAT_UPLOAD_MAX_UTTERANCE_BYTES", 10 * 1024 * 1024)),
+			end_of_utterance_silence_ms=int(os.getenv("CHAT_AUTO_ENDPOINT_SILENCE_MS")) if os.getenv("CHAT_AUTO_ENDPOINT_SILENCE_MS") else None,
+		)
+		vad = os.getenv("CHAT_VAD", "true").lower() == "true"
+		memory_token_budget = int(os.getenv("CHAT_MEMORY_TOKEN_BUDGET", 2000))
+		turn_deadline_seconds = float(os.getenv("CHAT_TURN_DEADLINE_SECONDS", 30))
+		feedback = os.getenv("CHAT_FEEDBACK", "true").lower() == "true"
+		# Per connection, shared by its message lanes
+		inbound_limits = InboundLimits(
+			max_messages=int(os.getenv("CHAT_INBOUND_MAX_MESSAGES", 16)),
+			max_bytes=int(os.getenv("CHAT_INBOUND_MAX_BYTES", 24 * 1024 * 1024)),
+			policy=os.getenv("CHAT_INBOUND_POLICY", "block"),
+		)
+		binary_envelope = os.getenv("CHAT_BINARY_ENVELOPE", "false").lower() == "true"
+		outbound_limits = OutboundLimits(
+			max_messages=int(os.getenv("CHAT_SEND_MAX_MESSAGES", 1024)),
+			max_bytes=int(os.getenv("CHAT_SEND_MAX_BYTES", 8 * 1024 * 1024)),
+			flush_window_ms=float(os.getenv("CHAT_SEND_FLUSH_WINDOW_MS", 0)),
+			slow_consumer_seconds=float(os.getenv("CHAT_SLOW_CONSUMER_SECONDS", 10)),
+			policy=os.getenv("CHAT_SEND_POLICY", "close"),
+		)
+		# Sessions can be resumed after a dropped connection for CHAT_RESUME_TTL_SECONDS. Off by default:
+		# resumable sessions are one per user, so a second tab takes the session over from the first
+		resume_ttl_seconds = float(os.getenv("CHAT_RESUME_TTL_SECONDS", 0))
+		replay_limits = ReplayLimits(
+			max_messages=int(os.getenv("CHAT_REPLAY_MAX_MESSAGES", 512)),
+			max_bytes=int(os.getenv("CHAT_REPLAY_MAX_BYTES", 4 * 1024 * 1024)),
+			ttl_seconds=resume_ttl_seconds,
+		) if resume_ttl_seconds > 0 else None
+		options = dict(
+			streaming=streaming,
+			upload_limits=upload_limits,
+			vad=vad,
+			memory_token_budget=memory_token_budget,
+			turn_deadline_seconds=turn_deadline_seconds,
+			feedback=feedback,
+			inbound_limits=inbound_limits,
+			outbound_limits=outbound_limits,
+			binary_envelope=binary_envelope,
+			replay_limits=replay_limits,
+		)
+
+		if replay_limits is None:
+			worker = VoiceChatWorker(user_id=user_id, **options)
+			await worker.begin(websocket)
+		else:
+			# One session per user, so a reconnecting client finds the session it dropped
+			await ChatService.connections.begin_unique(websocket, user_id, resume_token, last_seq, **options)
 	
\ No newline at end of file
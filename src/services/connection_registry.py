@@ -0,0 +1,418 @@
+import asyncio
+from collections import deque
+import fcntl
+import os
+import time
+from typing import TYPE_CHECKING, Optional
+import orjson
+
+from services.exceptions import AppException
+from services.outbound_writer import SendPriority
+
+if TYPE_CHECKING:
+	from services.base_websocket_worker import ConnectionManager
+
+
+class ConnectionRegistry:
+	# Tracks which worker process owns the connection of each client_id, so ConnectionManager.begin_unique can
+	# replace a connection that lives in another worker, and send_to can reach a client in any worker.
+	instance: "ConnectionRegistry" = None
+
+	def __init__(self):
+		self.worker_id = f"worker-{os.getpid()}"
+		self.managers: dict[str, "ConnectionManager"] = {}
+		self.lookups = 0
+		self.lookup_seconds_total = 0.0
+		self.lookup_seconds_max = 0.0
+		self.recent_lookup_seconds: deque[float] = deque(maxlen=1024)
+
+	@staticmethod
+	def configure(backend: str = "local", **kwargs):
+		if backend == "local":
+			ConnectionRegistry.instance = LocalConnectionRegistry()
+		elif backend == "unix":
+			ConnectionRegistry.instance = UnixSocketConnectionRegistry(**kwargs)
+		else:
+			raise AppException(f"Unknown connection registry backend: {backend}")
+
+	@staticmethod
+	def get() -> "ConnectionRegistry":
+		if ConnectionRegistry.instance is None:
+			ConnectionRegistry.instance = LocalConnectionRegistry()
+		return ConnectionRegistry.instance
+
+	def attach(self, manager: "ConnectionManager"):
+		self.managers[manager.connection_type] = manager
+
+	async def start(self):
+		pass
+
+	async def close(self):
+		pass
+
+	async def claim(self, connection_type: str, client_id: str, token: str):
+		raise NotImplementedError()
+
+	async def release(self, connection_type: str, client_id: str, token: str):
+		raise NotImplementedError()
+
+	async def find_owner(self, connection_type: str, client_id: str) -> Optional[str]:
+		raise NotImplementedError()
+
+	async def forward(self, connection_type: str, client_id: str, payload: str) -> bool:
+		raise NotImplementedError()
+
+	async def publish(self, connection_type: str, topic: str, payload: str, priority: int):
+		# Forwards a topic message to the other workers; local subscribers are served by the caller
+		pass
+
+	async def owner(self, connection_type: str, client_id: str) -> Optional[str]:
+		started = time.perf_counter()
+		try:
+			return await self.find_owner(connection_type, client_id)
+		finally:
+			self.record_lookup(time.perf_counter() - started)
+
+	async def deliver(self, connection_type: str, client_id: str, payload: str) -> bool:
+		# Routes an already encoded message to whichever worker owns the client's connection
+		started = time.perf_counter()
+		try:
+			return await self.forward(connection_type, client_id, payload)
+		finally:
+			self.record_lookup(time.perf_counter() - started)
+
+	async def kick_local(self, connection_type: str, client_id: str, token: str):
+		manager = self.managers.get(connection_type)
+		if manager is not None:
+			await manager.kick(client_id, token)
+
+	async def deliver_local(self, connection_type: str, client_id: str, payload: str) -> bool:
+		manager = self.managers.get(connection_type)
+		return manager is not None and await manager.deliver_local(client_id, payload)
+
+	async def publish_local(self, connection_type: str, topic: str, payload: str, priority: int):
+		manager = self.managers.get(connection_type)
+		if manager is not None:
+			await manager.fanout.publish(topic, payload, SendPriority(priority))
+
+	def record_lookup(self, seconds: float):
+		self.lookups += 1
+		self.lookup_seconds_total += seconds
+		self.lookup_seconds_max = max(self.lookup_seconds_max, seconds)
+		self.recent_lookup_seconds.append(seconds)
+
+	def stats(self) -> dict:
+		recent = sorted(self.recent_lookup_seconds)
+		return {
+			"worker_id": self.worker_id,
+			"lookups": self.lookups,
+			"average_lookup_seconds": self.lookup_seconds_total / self.lookups if self.lookups else 0.0,
+			"p50_lookup_seconds": recent[len(recent) // 2] if recent else 0.0,
+			"p99_lookup_seconds": recent[int(len(recent) * 0.99)] if recent else 0.0,
+			"max_lookup_seconds": self.lookup_seconds_max,
+		}
+
+
+class LocalConnectionRegistry(ConnectionRegistry):
+	# Single process: the ConnectionManagers already know every connection
+
+	async def claim(self, connection_type: str, client_id: str, token: str):
+		pass
+
+	async def release(self, connection_type: str, client_id: str, token: str):
+		pass
+
+	async def find_owner(self, connection_type: str, client_id: str) -> Optional[str]:
+		manager = self.managers.get(connection_type)
+		if manager is not None and client_id in manager.connections:
+			return self.worker_id
+		return None
+
+	async def forward(self, connection_type: str, client_id: str, payload: str) -> bool:
+		return await self.deliver_local(connection_type, client_id, payload)
+
+
+def encode_frame(message: dict) -> bytes:
+	data = orjson.dumps(message)
+	return len(data).to_bytes(4, "big") + data
+
+
+async def read_frame(reader: asyncio.StreamReader) -> dict:
+	header = await reader.readexactly(4)
+	return orjson.loads(await reader.readexactly(int.from_bytes(header, "big")))
+
+
+class WorkerLink:
+	# The coordinator's side of one worker's connection. Frames for the worker are queued and written by a task of
+	# its own, so a slow or dead worker never holds up the requests of the others. A worker that does not keep up
+	# (its queue outgrows max_queued_bytes, or a drain takes longer than drain_timeout) is dropped.
+	def __init__(self, coordinator: "RegistryCoordinator", worker_id: str, writer: asyncio.StreamWriter):
+		self.coordinator = coordinator
+		self.worker_id = worker_id
+		self.writer = writer
+		self.queue: deque[bytes] = deque()
+		self.bytes = 0
+		self.ready = asyncio.Event()
+		self.closed = False
+		self.task = asyncio.create_task(self.run())
+
+	def send(self, frame: bytes):
+		if self.closed:
+			return
+		if self.bytes + len(frame) > self.coordinator.max_queued_bytes:
+			self.fail(f"{self.bytes} bytes queued")
+			return
+		self.queue.append(frame)
+		self.bytes += len(frame)
+		self.ready.set()
+
+	async def run(self):
+		try:
+			while True:
+				await self.ready.wait()
+				self.ready.clear()
+				frames = b"".join(self.queue)
+				self.queue.clear()
+				self.bytes = 0
+				self.writer.write(frames)
+				await asyncio.wait_for(self.writer.drain(), self.coordinator.drain_timeout)
+
+		except asyncio.TimeoutError:
+			self.fail(f"not reading for {self.coordinator.drain_timeout} seconds")
+
+		except (ConnectionError, OSError) as e:
+			self.fail(str(e) or type(e).__name__)
+
+	def fail(self, reason: str):
+		if self.closed:
+			return
+		print(f"Connection registry: dropping {self.worker_id} ({reason})")
+		self.close()
+		self.coordinator.drop(self)
+
+	def close(self):
+		self.closed = True
+		if self.task is not asyncio.current_task():
+			self.task.cancel()
+		self.writer.close()
+
+
+class RegistryCoordinator:
+	# Runs in exactly one worker (the one holding the lock file) and serves the Unix socket for all workers
+	def __init__(self, max_queued_bytes: int = 4 * 1024 * 1024, drain_timeout: float = 2.0):
+		self.max_queued_bytes = max_queued_bytes
+		self.drain_timeout = drain_timeout
+		self.owners: dict[tuple[str, str], tuple[str, str]] = {}
+		self.workers: dict[str, WorkerLink] = {}
+
+	def send(self, worker_id: str, message: dict):
+		# Never waits; a worker that cannot take the message is dropped, not the one that caused it
+		link = self.workers.get(worker_id)
+		if link is not None:
+			link.send(encode_frame(message))
+
+	def drop(self, link: WorkerLink):
+		# The worker is gone, and so are its connections:
+		if self.workers.get(link.worker_id) is not link:
+			return
+		del self.workers[link.worker_id]
+		for key in [key for key, owner in self.owners.items() if owner[0] == link.worker_id]:
+			del self.owners[key]
+
+	def close(self):
+		# Ends every worker's connection, so the workers notice and one of them takes over
+		for link in list(self.workers.values()):
+			link.close()
+			self.drop(link)
+
+	async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+		worker_id = None
+		link: WorkerLink = None
+		try:
+			while True:
+				message = await read_frame(reader)
+				op = message["op"]
+
+				if op == "hello":
+					worker_id = message["worker"]
+					link = WorkerLink(self, worker_id, writer)
+					self.workers[worker_id] = link
+					continue
+
+				if op == "publish":
+					for other in list(self.workers):
+						if other != worker_id:
+							self.send(other, message)
+					continue
+
+				key = (message["type"], message["client_id"])
+				if op == "claim":
+					previous = self.owners.get(key)
+					self.owners[key] = (worker_id, message["token"])
+					if previous is not None and previous[0] != worker_id:
+						self.send(previous[0], {"op": "kick", "type": key[0], "client_id": key[1], "token": previous[1]})
+
+				elif op == "release":
+					if self.owners.get(key) == (worker_id, message["token"]):
+						del self.owners[key]
+
+				elif op == "lookup":
+					owner = self.owners.get(key)
+					self.send(worker_id, {"op": "reply", "id": message["id"], "result": owner[0] if owner else None})
+
+				elif op == "deliver":
+					owner = self.owners.get(key)
+					if owner is not None:
+						self.send(owner[0], {"op": "deliver", "type": key[0], "client_id": key[1], "payload": message["payload"]})
+					self.send(worker_id, {"op": "reply", "id": message["id"], "result": owner is not None})
+
+		except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+			pass
+
+		finally:
+			if link is not None:
+				link.close()
+				self.drop(link)
+			else:
+				writer.close()
+
+
+class UnixSocketConnectionRegistry(ConnectionRegistry):
+	# Cross-process registry for several workers on one host. The first worker to take the lock file runs the
+	# coordinator on the Unix socket; every worker (including that one) talks to it as a client. If the
+	# coordinator's worker exits, another worker takes the lock over and the others re-send their claims.
+	def __init__(self, socket_path: str = "/tmp/lingomate-connections.sock", request_timeout: float = 2.0, reconnect_seconds: float = 0.2):
+		super().__init__()
+		self.socket_path = socket_path
+		self.request_timeout = request_timeout
+		self.reconnect_seconds = reconnect_seconds
+
+		self.claims: dict[tuple[str, str], str] = {}
+		self.pending: dict[int, asyncio.Future] = {}
+		self.next_id = 0
+		self.writer: asyncio.StreamWriter = None
+		self.connected = asyncio.Event()
+		self.task: asyncio.Task = None
+
+		self.lock_file = None
+		self.coordinator: RegistryCoordinator = None
+		self.server: asyncio.AbstractServer = None
+
+	async def start(self):
+		self.task = asyncio.create_task(self.run())
+		try:
+			await asyncio.wait_for(self.connected.wait(), self.request_timeout * 5)
+		except asyncio.TimeoutError:
+			print(f"Connection registry: coordinator at {self.socket_path} not reachable yet")
+
+	async def close(self):
+		if self.task is not None:
+			self.task.cancel()
+		if self.writer is not None:
+			self.writer.close()
+		if self.server is not None:
+			self.server.close()
+			self.coordinator.close()
+			if os.path.exists(self.socket_path):
+				os.unlink(self.socket_path)
+		if self.lock_file is not None:
+			self.lock_file.close()
+
+	async def try_coordinate(self):
+		if self.server is not None:
+			return
+
+		lock_file = open(self.socket_path + ".lock", "w")
+		try:
+			fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+		except BlockingIOError:
+			lock_file.close()
+			return
+
+		# The lock is released by the OS when the process exits, so a socket file left behind is stale:
+		if os.path.exists(self.socket_path):
+			os.unlink(self.socket_path)
+
+		self.lock_file = lock_file
+		self.coordinator = RegistryCoordinator()
+		self.server = await asyncio.start_unix_server(self.coordinator.handle, self.socket_path)
+		print(f"Connection registry: {self.worker_id} coordinates {self.socket_path}")
+
+	async def run(self):
+		while True:
+			try:
+				await self.try_coordinate()
+				reader, self.writer = await asyncio.open_unix_connection(self.socket_path)
+				await self.session(reader)
+
+			except (OSError, asyncio.IncompleteReadError):
+				pass
+
+			finally:
+				self.connected.clear()
+				self.writer = None
+				for future in self.pending.values():
+					if not future.done():
+						future.set_result(None)
+				self.pending.clear()
+
+			await asyncio.sleep(self.reconnect_seconds)
+
+	async def session(self, reader: asyncio.StreamReader):
+		self.write({"op": "hello", "worker": self.worker_id})
+		for (connection_type, client_id), token in self.claims.items():
+			self.write({"op": "claim", "type": connection_type, "client_id": client_id, "token": token})
+		self.connected.set()
+
+		while True:
+			message = await read_frame(reader)
+			op = message["op"]
+			if op == "reply":
+				future = self.pending.pop(message["id"], None)
+				if future is not None and not future.done():
+					future.set_result(message["result"])
+			elif op == "kick":
+				asyncio.create_task(self.kick_local(message["type"], message["client_id"], message["token"]))
+			elif op == "deliver":
+				asyncio.create_task(self.deliver_local(message["type"], message["client_id"], message["payload"]))
+			elif op == "publish":
+				asyncio.create_task(self.publish_local(message["type"], message["topic"], message["payload"], message["priority"]))
+
+	def write(self, message: dict) -> bool:
+		if self.writer is None:
+			return False
+		self.writer.write(encode_frame(message))
+		return True
+
+	async def request(self, message: dict):
+		if not self.connected.is_set():
+			return None
+
+		self.next_id += 1
+		message["id"] = self.next_id
+		future = asyncio.get_running_loop().create_future()
+		self.pending[message["id"]] = future
+		self.write(message)
+		try:
+			return await asyncio.wait_for(future, self.request_timeout)
+		except asyncio.TimeoutError:
+			self.pending.pop(message["id"], None)
+			return None
+
+	async def claim(self, connection_type: str, client_id: str, token: str):
+		self.claims[(connection_type, client_id)] = token
+		self.write({"op": "claim", "type": connection_type, "client_id": client_id, "token": token})
+
+	async def release(self, connection_type: str, client_id: str, token: str):
+		if self.claims.get((connection_type, client_id)) == token:
+			del self.claims[(connection_type, client_id)]
+		self.write({"op": "release", "type": connection_type, "client_id": client_id, "token": token})
+
+	async def publish(self, connection_type: str, topic: str, payload: str, priority: int):
+		self.write({"op": "publish", "type": connection_type, "topic": topic, "payload": payload, "priority": int(priority)})
+
+	async def find_owner(self, connection_type: str, client_id: str) -> Optional[str]:
+		return await self.request({"op": "lookup", "type": connection_type, "client_id": client_id})
+
+	async def forward(self, connection_type: str, client_id: str, payload: str) -> bool:
+		return bool(await self.request({"op": "deliver", "type": connection_type, "client_id": client_id, "payload": payload}))
@@ -0,0 +1,77 @@
+import asyncio
+from collections import deque
+import traceback
+from typing import Awaitable, Callable
+
+
+class ConversationMemory:
+	def __init__(
+		self,
+		token_budget: int = 2000,
+		max_messages: int = 64,
+		summary_token_budget: int = 300,
+		summarizer: Callable[[str, list[dict], int], Awaitable[str]] = None,
+	):
+		self.token_budget = token_budget
+		self.max_messages = max_messages
+		self.summary_token_budget = summary_token_budget
+		self.summarizer = summarizer
+
+		# Ring buffer of (role, content, estimated tokens). The token total is kept up to date on every append and
+		# eviction, so the history never has to be re-tokenized:
+		self.history: deque[tuple[str, str, int]] = deque()
+		self.tokens = 0
+
+		self.summary = ""
+		self.summary_tokens = 0
+		self.evicted: list[dict] = []
+		self.summary_task: asyncio.Task = None
+
+	@staticmethod
+	def estimate_tokens(text: str) -> int:
+		# Roughly 4 characters per token for English and Norwegian, plus the per-message overhead of the chat format:
+		return len(text) // 4 + 4
+
+	def add(self, role: str, content: str):
+		tokens = ConversationMemory.estimate_tokens(content)
+		self.history.append((role, content, tokens))
+		self.tokens += tokens
+
+		# The newest message is always kept, even if it alone exceeds the budget:
+		while len(self.history) > 1 and (self.tokens + self.summary_tokens > self.token_budget or len(self.history) > self.max_messages):
+			evicted_role, evicted_content, evicted_tokens = self.history.popleft()
+			self.tokens -= evicted_tokens
+			self.evicted.append({"role": evicted_role, "content": evicted_content})
+
+		if self.evicted and self.summarizer is not None and (self.summary_task is None or self.summary_task.done()):
+			self.summary_task = asyncio.create_task(self.summarize_evicted())
+		elif self.summarizer is None:
+			self.evicted.clear()
+
+	def messages(self, system_prompt: str) -> list[dict]:
+		messages = [{"role": "system", "content": system_prompt}]
+		if self.summary:
+			messages.append({"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"})
+
+		messages += [{"role": role, "content": content} for role, content, _ in self.history]
+		return messages
+
+	async def summarize_evicted(self):
+		# Runs in the background, so the turn that caused the eviction is not delayed by the summary request:
+		while self.evicted:
+			evicted = self.evicted
+			self.evicted = []
+
+			try:
+				# The length is asked of the model, so the summary is not cut off in the middle of a sentence:
+				summary = await self.summarizer(self.summary, evicted, self.summary_token_budget - 4)
+			except Exception:
+				traceback.print_exc()
+				return
+
+			self.summary = summary.strip()
+			self.summary_tokens = ConversationMemory.estimate_tokens(self.summary)
+
+	def close(self):
+		if self.summary_task is not None:
+			self.summary_task.cancel()
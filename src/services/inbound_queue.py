@@ -0,0 +1,120 @@
+import asyncio
+from collections import deque
+import enum
+from typing import Any
+
+from services.exceptions import AppException
+
+
+class OverflowPolicy(str, enum.Enum):
+	Block = "block"
+	DropOldest = "drop_oldest"
+	Close = "close"
+
+
+class QueueOverflow(AppException):
+	pass
+
+
+class InboundLimits:
+	def __init__(self, max_messages: int = 256, max_bytes: int = 16 * 1024 * 1024, policy: OverflowPolicy = OverflowPolicy.Block):
+		self.max_messages = max_messages
+		self.max_bytes = max_bytes
+		self.policy = OverflowPolicy(policy)
+
+
+class InboundBudget:
+	# The message and byte limits shared by all queues of one connection, so the connection buffers at most
+	# max_messages messages and max_bytes bytes in total, however many lanes it has
+	def __init__(self, limits: InboundLimits):
+		self.limits = limits
+		self.messages = 0
+		self.bytes = 0
+		# Set whenever any of the queues gives back space
+		self.has_space = asyncio.Event()
+		self.has_space.set()
+
+	def full(self, size: int) -> bool:
+		return self.messages >= self.limits.max_messages or (self.messages > 0 and self.bytes + size > self.limits.max_bytes)
+
+	def add(self, size: int):
+		self.messages += 1
+		self.bytes += size
+
+	def remove(self, size: int):
+		self.messages -= 1
+		self.bytes -= size
+		self.has_space.set()
+
+
+class InboundQueue:
+	# A queue fed by the receive loop and drained by the lane worker tasks, bounded by both message count and bytes. With the Block policy the producer stops receiving while the queue is full, so
+	# the ASGI server stops reading the socket and the backpressure reaches the client through TCP.
+	# The queues of one connection share a budget: a queue is also full while the connection's budget is used up.
+	def __init__(self, limits: InboundLimits = InboundLimits(), budget: InboundBudget = None):
+		self.limits = limits
+		self.budget = budget or InboundBudget(limits)
+		self.items: deque[tuple[Any, int]] = deque()
+		self.bytes = 0
+		self.not_empty = asyncio.Event()
+		self.has_space = self.budget.has_space
+
+		self.max_depth = 0
+		self.max_queued_bytes = 0
+		self.dropped = 0
+		self.blocked = 0
+
+	def qsize(self) -> int:
+		return len(self.items)
+
+	def full(self, size: int) -> bool:
+		# A single message larger than max_bytes is still accepted while the connection buffers nothing else, so it
+		# cannot block forever:
+		return len(self.items) >= self.limits.max_messages or (self.items and self.bytes + size > self.limits.max_bytes) or self.budget.full(size)
+
+	async def put(self, item: Any, size: int = 0):
+		while self.full(size):
+			if self.limits.policy == OverflowPolicy.Block:
+				self.blocked += 1
+				self.has_space.clear()
+				await self.has_space.wait()
+
+			elif self.limits.policy == OverflowPolicy.DropOldest:
+				if not self.items:
+					# The connection's other queues hold the budget; the new message is the oldest one this queue can drop
+					self.dropped += 1
+					return
+				_, dropped_size = self.items.popleft()
+				self.bytes -= dropped_size
+				self.budget.remove(dropped_size)
+				self.dropped += 1
+
+			else:
+				raise QueueOverflow(f"Inbound queue is full ({len(self.items)} messages, {self.bytes} bytes; connection {self.budget.messages} messages, {self.budget.bytes} bytes)")
+
+		self.items.append((item, size))
+		self.bytes += size
+		self.budget.add(size)
+		self.max_depth = max(self.max_depth, len(self.items))
+		self.max_queued_bytes = max(self.max_queued_bytes, self.bytes)
+		self.not_empty.set()
+
+	async def get(self) -> Any:
+		while not self.items:
+			self.not_empty.clear()
+			await self.not_empty.wait()
+
+		item, size = self.items.popleft()
+		self.bytes -= size
+		self.budget.remove(size)
+		return item
+
+	def stats(self) -> dict:
+		return {
+			"depth": len(self.items),
+			"bytes": self.bytes,
+			"max_depth": self.max_depth,
+			"max_bytes": self.max_queued_bytes,
+			"dropped": self.dropped,
+			"blocked": self.blocked,
+		}
@@ -0,0 +1,104 @@
+from collections import OrderedDict
+import math
+import time
+
+from services.exceptions import AppException
+
+
+class LoginThrottled(AppException):
+	def __init__(self, message: str, retry_after: int):
+		super().__init__(message)
+		self.retry_after = retry_after
+
+
+class BucketLimit:
+	# A token bucket: up to attempts at once, refilled evenly over window_seconds
+	def __init__(self, attempts: int, window_seconds: float, max_keys: int):
+		self.attempts = attempts
+		self.refill_per_second = attempts / window_seconds
+		self.max_keys = max_keys
+		# key -> [tokens, updated], least recently used first
+		self.buckets: OrderedDict[str, list[float]] = OrderedDict()
+
+	def wait_seconds(self, key: str, now: float) -> float:
+		# 0 when an attempt is allowed now, otherwise the time until it is
+		bucket = self.buckets.get(key)
+		if bucket is None:
+			return 0.0
+		tokens = min(self.attempts, bucket[0] + (now - bucket[1]) * self.refill_per_second)
+		return 0.0 if tokens >= 1 else (1 - tokens) / self.refill_per_second
+
+	def take(self, key: str, now: float):
+		bucket = self.buckets.get(key)
+		if bucket is None:
+			bucket = self.buckets[key] = [self.attempts, now]
+			# The oldest buckets have refilled the most; forgetting them is the same as refilling them
+			while len(self.buckets) > self.max_keys:
+				self.buckets.popitem(last=False)
+		else:
+			self.buckets.move_to_end(key)
+		bucket[0] = min(self.attempts, bucket[0] + (now - bucket[1]) * self.refill_per_second) - 1
+		bucket[1] = now
+
+	def reset(self, key: str):
+		self.buckets.pop(key, None)
+
+
+class LoginThrottle:
+	# Limits login attempts per client IP and per account before any database or bcrypt work is done for them
+	instance: "LoginThrottle" = None
+
+	def __init__(self, ip_attempts: int = 20, account_attempts: int = 5, window_seconds: float = 60.0, max_keys: int = 100000):
+		self.ip = BucketLimit(ip_attempts, window_seconds, max_keys)
+		self.account = BucketLimit(account_attempts, window_seconds, max_keys)
+
+		self.allowed = 0
+		self.throttled_ip = 0
+		self.throttled_account = 0
+
+	@staticmethod
+	def configure(**kwargs):
+		LoginThrottle.instance = LoginThrottle(**kwargs)
+
+	@staticmethod
+	def get() -> "LoginThrottle":
+		if LoginThrottle.instance is None:
+			LoginThrottle.instance = LoginThrottle()
+		return LoginThrottle.instance
+
+	@staticmethod
+	def account_key(username: str) -> str:
+		return username.strip().lower()
+
+	def check(self, username: str, client_ip: str):
+		# Both limits are checked before either is charged, so an attempt rejected for one does not use up the other
+		now = time.monotonic()
+		account = self.account_key(username)
+
+		ip_wait = self.ip.wait_seconds(client_ip, now) if client_ip else 0.0
+		if ip_wait > 0:
+			self.throttled_ip += 1
+			raise LoginThrottled("Too many login attempts from this address, please try again later", math.ceil(ip_wait))
+
+		account_wait = self.account.wait_seconds(account, now)
+		if account_wait > 0:
+			self.throttled_account += 1
+			raise LoginThrottled("Too many login attempts for this account, please try again later", math.ceil(account_wait))
+
+		if client_ip:
+			self.ip.take(client_ip, now)
+		self.account.take(account, now)
+		self.allowed += 1
+
+	def succeeded(self, username: str):
+		# A correct password ends the throttling of the account; the IP keeps its budget
+		self.account.reset(self.account_key(username))
+
+	def stats(self) -> dict:
+		return {
+			"allowed": self.allowed,
+			"throttled_ip": self.throttled_ip,
+			"throttled_account": self.throttled_account,
+			"ip_keys": len(self.ip.buckets),
+			"account_keys": len(self.account.buckets),
+		}
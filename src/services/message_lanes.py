@@ -0,0 +1,91 @@
+import asyncio
+import enum
+import time
+import traceback
+from typing import Any, Awaitable, Callable
+
+from services.inbound_queue import InboundBudget, InboundLimits, InboundQueue, OverflowPolicy
+from services.metrics import metrics
+
+
+queue_depth = metrics.gauge("websocket_inbound_queue_depth", "Messages waiting in websocket inbound lanes", ["connection_type", "lane"])
+processing_seconds = metrics.histogram("websocket_message_processing_seconds", "Time spent handling a websocket message", ["connection_type", "message_type"])
+
+
+class LaneMode(str, enum.Enum):
+	# One message at a time, in arrival order
+	Serial = "serial"
+	# Up to `concurrency` messages at a time, started in arrival order
+	Concurrent = "concurrent"
+	# One message at a time; a newer message replaces the one still waiting
+	LatestWins = "latest_wins"
+
+
+class MessageLane:
+	def __init__(self, name: str, mode: LaneMode = LaneMode.Serial, concurrency: int = 1, limits: InboundLimits = None):
+		self.name = name
+		self.mode = LaneMode(mode)
+		self.concurrency = concurrency if self.mode == LaneMode.Concurrent else 1
+		self.limits = limits
+		self.queue: InboundQueue = None
+		self.tasks: list[asyncio.Task] = []
+		self.processed = 0
+		self.failed = 0
+		self.connection_type = ""
+		self.depth_gauge = None
+		self.reported_depth = 0
+
+	def start(self, default_limits: InboundLimits, connection_type: str = "", budget: InboundBudget = None):
+		# The budget is shared by the lanes of a connection; a lane's own limits can only be tighter
+		limits = self.limits or default_limits
+		if self.mode == LaneMode.LatestWins:
+			limits = InboundLimits(max_messages=1, max_bytes=limits.max_bytes, policy=OverflowPolicy.DropOldest)
+
+		self.queue = InboundQueue(limits, budget)
+		self.connection_type = connection_type
+		self.depth_gauge = queue_depth.labels(connection_type, self.name)
+		self.tasks = [asyncio.create_task(self.process()) for _ in range(self.concurrency)]
+
+	def stop(self):
+		for task in self.tasks:
+			task.cancel()
+		self.tasks = []
+		if self.depth_gauge is not None:
+			self.depth_gauge.dec(self.reported_depth)
+			self.reported_depth = 0
+
+	def report_depth(self):
+		# The shared gauge is moved by this lane's changes only, since dropped messages never pass through get()
+		depth = self.queue.qsize()
+		self.depth_gauge.inc(depth - self.reported_depth)
+		self.reported_depth = depth
+
+	async def put(self, task_creator: Callable[[], Awaitable[Any]], size: int = 0, message_type: str = ""):
+		await self.queue.put((task_creator, message_type), size)
+		if self.tasks:
+			self.report_depth()
+
+	async def process(self):
+		while True:
+			coro_func, message_type = await self.queue.get()
+			self.report_depth()
+			started = time.perf_counter()
+			try:
+				await coro_func()
+				self.processed += 1
+
+			except asyncio.CancelledError:
+				raise
+
+			except Exception:
+				# A failing handler must not stop the lane for the rest of the connection
+				self.failed += 1
+				traceback.print_exc()
+
+			finally:
+				processing_seconds.labels(self.connection_type, message_type).observe(time.perf_counter() - started)
+
+	def stats(self) -> dict:
+		stats = self.queue.stats() if self.queue is not None else {}
+		stats.update({"mode": self.mode.value, "processed": self.processed, "failed": self.failed})
+		return stats
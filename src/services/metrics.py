@@ -0,0 +1,241 @@
+from bisect import bisect_left
+import time
+from typing import Callable, Iterable, Optional
+
+
+def escape_label(value: str) -> str:
+	return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+	labels = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+	if extra:
+		labels.append(extra)
+	return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def format_value(value: float) -> str:
+	if value == float("inf"):
+		return "+Inf"
+	return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class CounterChild:
+	__slots__ = ("value",)
+
+	def __init__(self):
+		self.value = 0
+
+	def inc(self, amount: float = 1):
+		self.value += amount
+
+
+class GaugeChild:
+	__slots__ = ("value",)
+
+	def __init__(self):
+		self.value = 0
+
+	def set(self, value: float):
+		self.value = value
+
+	def inc(self, amount: float = 1):
+		self.value += amount
+
+	def dec(self, amount: float = 1):
+		self.value -= amount
+
+
+class HistogramTimer:
+	__slots__ = ("child", "started")
+
+	def __init__(self, child: "HistogramChild"):
+		self.child = child
+
+	def __enter__(self):
+		self.started = time.perf_counter()
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.child.observe(time.perf_counter() - self.started)
+
+
+class HistogramChild:
+	__slots__ = ("bounds", "counts", "sum", "count")
+
+	def __init__(self, bounds: tuple[float, ...]):
+		self.bounds = bounds
+		# One count per bucket plus the +Inf bucket; made cumulative only when rendered
+		self.counts = [0] * (len(bounds) + 1)
+		self.sum = 0.0
+		self.count = 0
+
+	def observe(self, value: float):
+		self.counts[bisect_left(self.bounds, value)] += 1
+		self.sum += value
+		self.count += 1
+
+	def time(self) -> HistogramTimer:
+		return HistogramTimer(self)
+
+
+class Metric:
+	kind = "untyped"
+
+	def __init__(self, name: str, description: str, labelnames: Iterable[str] = ()):
+		self.name = name
+		self.description = description
+		self.labelnames = tuple(labelnames)
+		self.children: dict[tuple, object] = {}
+
+	def create_child(self):
+		raise NotImplementedError()
+
+	def labels(self, *values):
+		# Hot paths should keep the returned child instead of looking it up for every observation
+		child = self.children.get(values)
+		if child is None:
+			if len(values) != len(self.labelnames):
+				raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+			child = self.children[values] = self.create_child()
+		return child
+
+	def render_samples(self) -> list[str]:
+		return [f"{self.name}{format_labels(self.labelnames, values)} {format_value(child.value)}" for values, child in self.children.items()]
+
+	def render(self) -> str:
+		lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+		lines.extend(self.render_samples())
+		return "\n".join(lines)
+
+
+class Counter(Metric):
+	kind = "counter"
+
+	def create_child(self):
+		return CounterChild()
+
+
+class Gauge(Metric):
+	kind = "gauge"
+
+	def create_child(self):
+		return GaugeChild()
+
+
+class Histogram(Metric):
+	kind = "histogram"
+	default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+	def __init__(self, name: str, description: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = default_buckets):
+		super().__init__(name, description, labelnames)
+		self.bounds = tuple(sorted(buckets))
+
+	def create_child(self):
+		return HistogramChild(self.bounds)
+
+	def render_samples(self) -> list[str]:
+		lines = []
+		for values, child in self.children.items():
+			cumulative = 0
+			for bound, count in zip(self.bounds + (float("inf"),), child.counts):
+				cumulative += count
+				le = 'le="' + format_value(float(bound)) + '"'
+				lines.append(f"{self.name}_bucket{format_labels(self.labelnames, values, le)} {cumulative}")
+			lines.append(f"{self.name}_sum{format_labels(self.labelnames, values)} {format_value(child.sum)}")
+			lines.append(f"{self.name}_count{format_labels(self.labelnames, values)} {child.count}")
+		return lines
+
+
+class MetricsRegistry:
+	instance: "MetricsRegistry" = None
+
+	def __init__(self):
+		self.metrics: dict[str, Metric] = {}
+		# Called before rendering, to copy stats that are kept elsewhere (caches, schedulers, ...) into gauges
+		self.collectors: list[Callable[[], None]] = []
+
+	@staticmethod
+	def get() -> "MetricsRegistry":
+		if MetricsRegistry.instance is None:
+			MetricsRegistry.instance = MetricsRegistry()
+		return MetricsRegistry.instance
+
+	def register(self, metric: Metric) -> Metric:
+		existing = self.metrics.get(metric.name)
+		if existing is not None:
+			return existing
+		self.metrics[metric.name] = metric
+		return metric
+
+	def counter(self, name: str, description: str, labelnames: Iterable[str] = ()) -> Counter:
+		return self.register(Counter(name, description, labelnames))
+
+	def gauge(self, name: str, description: str, labelnames: Iterable[str] = ()) -> Gauge:
+		return self.register(Gauge(name, description, labelnames))
+
+	def histogram(self, name: str, description: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = Histogram.default_buckets) -> Histogram:
+		return self.register(Histogram(name, description, labelnames, buckets))
+
+	def add_collector(self, collector: Callable[[], None]):
+		self.collectors.append(collector)
+
+	def add_stats(self, prefix: str, description: str, stats: Callable[[], Optional[dict]], labelnames: Iterable[str] = ()):
+		# Exposes every numeric value of a stats() dict as the gauge <prefix>_<key>. Nested dicts (e.g. one per
+		# scheduler lane) are flattened into the given label.
+		labelnames = tuple(labelnames)
+
+		def collect():
+			values = stats()
+			if values is None:
+				return
+			rows = values.items() if labelnames else [((), values)]
+			for label, row in rows:
+				label_values = (label,) if labelnames else ()
+				for key, value in row.items():
+					if isinstance(value, bool) or not isinstance(value, (int, float)):
+						continue
+					self.gauge(f"{prefix}_{key}", f"{description}: {key}", labelnames).labels(*label_values).set(value)
+
+		self.add_collector(collect)
+
+	def render(self) -> str:
+		for collector in self.collectors:
+			try:
+				collector()
+			except Exception as e:
+				print(f"Metrics collector failed: {e}")
+
+		return "\n".join(metric.render() for metric in self.metrics.values() if metric.children) + "\n"
+
+
+metrics = MetricsRegistry.get()
+
+
+class MetricsMiddleware:
+	# Plain ASGI middleware, so it adds no task or response wrapping per request. The route template
+	# (e.g. "/users/{id}") is used as label; requests that match no route share the "unmatched" label.
+	def __init__(self, app):
+		self.app = app
+		self.latency = metrics.histogram("http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"])
+
+	async def __call__(self, scope, receive, send):
+		if scope["type"] != "http":
+			return await self.app(scope, receive, send)
+
+		status = 500
+		started = time.perf_counter()
+
+		async def send_with_status(message):
+			nonlocal status
+			if message["type"] == "http.response.start":
+				status = message["status"]
+			await send(message)
+
+		try:
+			await self.app(scope, receive, send_with_status)
+		finally:
+			# The router stores the matched route in the (shared) scope
+			route = scope.get("route")
+			path = getattr(route, "path", "unmatched")
+			self.latency.labels(scope["method"], path, str(status)).observe(time.perf_counter() - started)
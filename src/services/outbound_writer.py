@@ -0,0 +1,275 @@
+import asyncio
+from collections import deque
+import enum
+import time
+from typing import Awaitable, Callable, Optional, Union
+from fastapi import WebSocket, WebSocketDisconnect
+from websockets import ConnectionClosed
+
+from services.inbound_queue import OverflowPolicy
+from services.metrics import metrics
+from services.replay_buffer import ReplayBuffer
+from timing_wheel import TimingWheel, WheelTimer
+
+
+sent_bytes = metrics.counter("websocket_sent_bytes_total", "Bytes sent over websockets", ["connection_type"])
+
+
+class SendPriority(enum.IntEnum):
+	# Small events (errors, feedback, state changes) are written before any queued bulk data
+	Control = 0
+	# Audio and everything that has to stay in order with it
+	Bulk = 1
+
+
+class OutboundLimits:
+	def __init__(
+		self,
+		max_messages: int = 1024,
+		max_bytes: int = 8 * 1024 * 1024,
+		flush_window_ms: float = 0,
+		max_batch: int = 32,
+		slow_consumer_seconds: float = 10.0,
+		policy: OverflowPolicy = OverflowPolicy.Close,
+		close_drain_seconds: float = 1.0,
+	):
+		self.max_messages = max_messages
+		self.max_bytes = max_bytes
+		# With a flush window, control JSON events written within the window are sent as one "batch" frame.
+		# 0 disables coalescing, so clients that do not understand batch frames keep working.
+		self.flush_window_ms = flush_window_ms
+		self.max_batch = max_batch
+		self.slow_consumer_seconds = slow_consumer_seconds
+		self.policy = OverflowPolicy(policy)
+		self.close_drain_seconds = close_drain_seconds
+
+		if self.policy == OverflowPolicy.Block:
+			raise ValueError("Outbound buffers cannot block; use drop_oldest or close")
+
+
+class OutboundWriter:
+	def __init__(self, websocket: WebSocket, limits: OutboundLimits, on_slow_consumer: Callable[[str], Awaitable[None]], connection_type: str = "", replay: ReplayBuffer = None):
+		self.websocket = websocket
+		self.limits = limits
+		self.on_slow_consumer = on_slow_consumer
+		# Entries are (payload, turn): the turn that produced the payload, if any, so a cancelled turn's data can be
+		# discarded without touching what other turns queued
+		self.queues: dict[SendPriority, deque[tuple[Union[str, bytes], Optional[int]]]] = {priority: deque() for priority in SendPriority}
+		self.depth = 0
+		self.bytes = 0
+		self.ready = asyncio.Event()
+		self.idle = asyncio.Event()
+		self.idle.set()
+		self.slow_reason: str = None
+		self.task: asyncio.Task = None
+		self.closed = False
+
+		# With a replay buffer, every written frame is numbered and kept, and a resumed session first writes
+		# the frames the client missed (from `replaying`) before the queued ones.
+		self.replay = replay
+		self.replaying: deque[Union[str, bytes]] = deque()
+		self.write_started: float = None
+		# Armed when a send starts and left armed while sends follow each other, so a stuck send is noticed even
+		# when nothing else is queued, without a timer per send
+		self.watchdog: WheelTimer = None
+		self.closing: asyncio.Task = None
+		self.sent_bytes_counter = sent_bytes.labels(connection_type)
+
+		self.sent_messages = 0
+		self.sent_bytes = 0
+		self.batches = 0
+		self.dropped = 0
+		self.max_depth = 0
+		self.max_queued_bytes = 0
+		self.max_send_seconds = 0.0
+
+	def start(self):
+		self.task = asyncio.create_task(self.run())
+
+	def stop(self):
+		self.closed = True
+		self.detach()
+
+	def detach(self):
+		# The socket is gone, but the session may be resumed: queued data is kept and more can be queued
+		if self.task is not None:
+			self.task.cancel()
+			self.task = None
+		self.write_started = None
+		if self.watchdog is not None:
+			TimingWheel.get().cancel(self.watchdog)
+			self.watchdog = None
+
+	def attach(self, websocket: WebSocket, last_seq: int):
+		self.detach()
+		self.websocket = websocket
+		self.replaying = deque(self.replay.since(last_seq))
+		if self.replaying:
+			self.idle.clear()
+		self.start()
+
+	def enqueue(self, payload: Union[str, bytes], priority: SendPriority, turn: int = None) -> bool:
+		# Never waits: the payload is either queued, or the buffer overflows and the oldest data is dropped
+		# or the connection is marked as a slow consumer.
+		if self.slow_reason is not None or self.closed:
+			return False
+
+		size = len(payload)
+		while self.depth >= self.limits.max_messages or (self.depth and self.bytes + size > self.limits.max_bytes):
+			if self.limits.policy == OverflowPolicy.Close:
+				self.mark_slow(f"send buffer full ({self.depth} messages, {self.bytes} bytes)")
+				return False
+
+			# Bulk data is dropped before control events:
+			queue = self.queues[SendPriority.Bulk] or self.queues[SendPriority.Control]
+			self.remove(queue.popleft()[0])
+			self.dropped += 1
+
+		self.queues[priority].append((payload, turn))
+		self.depth += 1
+		self.bytes += size
+		self.max_depth = max(self.max_depth, self.depth)
+		self.max_queued_bytes = max(self.max_queued_bytes, self.bytes)
+		self.idle.clear()
+		self.ready.set()
+		return True
+
+	def discard(self, priority: SendPriority, turn: int = None) -> int:
+		# Everything of the priority, or only what the given turn queued. In place, since the writer task may hold
+		# the queue while it waits for the flush window.
+		queue = self.queues[priority]
+		discarded = 0
+		for _ in range(len(queue)):
+			entry = queue.popleft()
+			if turn is None or entry[1] == turn:
+				self.remove(entry[0])
+				discarded += 1
+			else:
+				queue.append(entry)
+		return discarded
+
+	def remove(self, payload: Union[str, bytes]):
+		self.depth -= 1
+		self.bytes -= len(payload)
+
+	def mark_slow(self, reason: str):
+		if self.slow_reason is not None:
+			return
+		self.slow_reason = reason
+		if self.write_started is not None:
+			# The writer task is waiting on the socket and cannot handle this itself. It is not cancelled, which could
+			# cut a frame in half; closing the socket ends the send, and the connection's cleanup stops the writer.
+			self.closing = asyncio.create_task(self.on_slow_consumer(reason))
+		else:
+			self.ready.set()
+
+	def check_send(self):
+		self.watchdog = None
+		if self.write_started is None or self.task is None:
+			# Idle: the next send arms the watchdog again
+			return
+
+		elapsed = time.monotonic() - self.write_started
+		if elapsed >= self.limits.slow_consumer_seconds:
+			self.mark_slow(f"a send took longer than {self.limits.slow_consumer_seconds} seconds")
+		else:
+			self.watchdog = TimingWheel.get().schedule(self.limits.slow_consumer_seconds - elapsed, self.check_send)
+
+	async def drain(self, timeout: float):
+		try:
+			await asyncio.wait_for(self.idle.wait(), timeout)
+		except asyncio.TimeoutError:
+			pass
+
+	async def next_payload(self) -> Optional[Union[str, bytes]]:
+		control = self.queues[SendPriority.Control]
+		if control and isinstance(control[0][0], str) and self.limits.flush_window_ms > 0:
+			# Waits before taking the event, so nothing is lost when the writer is cancelled meanwhile
+			await asyncio.sleep(self.limits.flush_window_ms / 1000)
+
+		if control:
+			payload = control.popleft()[0]
+			self.remove(payload)
+
+			if isinstance(payload, str) and self.limits.flush_window_ms > 0:
+				events = [payload]
+				while control and isinstance(control[0][0], str) and len(events) < self.limits.max_batch:
+					events.append(control.popleft()[0])
+					self.remove(events[-1])
+
+				if len(events) > 1:
+					# The events are already encoded, so the batch is assembled without decoding them again:
+					self.batches += 1
+					self.sent_messages += len(events) - 1
+					return '{"type":"batch","events":[' + ",".join(events) + "]}"
+
+			return payload
+
+		bulk = self.queues[SendPriority.Bulk]
+		if not bulk:
+			# Everything was discarded while waiting for the flush window
+			return None
+		payload = bulk.popleft()[0]
+		self.remove(payload)
+		return payload
+
+	async def write(self, payload: Union[str, bytes]):
+		if isinstance(payload, str):
+			await self.websocket.send_text(payload)
+		else:
+			await self.websocket.send_bytes(payload)
+
+	async def run(self):
+		try:
+			while True:
+				while self.depth == 0 and not self.replaying and self.slow_reason is None:
+					self.idle.set()
+					self.ready.clear()
+					await self.ready.wait()
+
+				if self.slow_reason is not None:
+					await self.on_slow_consumer(self.slow_reason)
+					return
+
+				if self.replaying:
+					payload = self.replaying.popleft()
+				else:
+					payload = await self.next_payload()
+					if payload is None:
+						continue
+					if self.replay is not None:
+						# Numbered before the write: if the socket fails meanwhile, the client gets it again on resume
+						self.replay.record(payload)
+
+				self.write_started = time.monotonic()
+				if self.watchdog is None:
+					self.watchdog = TimingWheel.get().schedule(self.limits.slow_consumer_seconds, self.check_send)
+				await self.write(payload)
+
+				send_seconds = time.monotonic() - self.write_started
+				self.write_started = None
+				self.max_send_seconds = max(self.max_send_seconds, send_seconds)
+				self.sent_messages += 1
+				self.sent_bytes += len(payload)
+				self.sent_bytes_counter.inc(len(payload))
+
+		except (ConnectionClosed, WebSocketDisconnect, RuntimeError):
+			# The connection is gone; the receive loop will notice and clean up
+			pass
+
+		finally:
+			self.idle.set()
+
+	def stats(self) -> dict:
+		return {
+			"depth": self.depth,
+			"bytes": self.bytes,
+			"max_depth": self.max_depth,
+			"max_bytes": self.max_queued_bytes,
+			"sent_messages": self.sent_messages,
+			"sent_bytes": self.sent_bytes,
+			"batches": self.batches,
+			"dropped": self.dropped,
+			"max_send_seconds": self.max_send_seconds,
+			"slow_consumer": self.slow_reason,
+		}
@@ -0,0 +1,85 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+from typing import Callable, TypeVar
+
+import bcrypt
+
+from services.exceptions import AppException
+
+
+T = TypeVar("T")
+
+
+class PasswordHasherBusy(AppException):
+	pass
+
+
+class PasswordHasher:
+	# bcrypt takes hundreds of milliseconds per call. It releases the GIL, so a small thread pool keeps it off the
+	# event loop; calls beyond the workers wait in the pool's queue, and calls beyond max_queue are rejected.
+	instance: "PasswordHasher" = None
+
+	def __init__(self, workers: int = None, max_queue: int = 32):
+		self.workers = workers or min(4, os.cpu_count() or 1)
+		self.max_queue = max_queue
+		self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+		self.pending = 0
+
+		self.calls = 0
+		self.rejected = 0
+		self.max_pending = 0
+		self.wait_seconds_max = 0.0
+		self.service_seconds_total = 0.0
+
+	@staticmethod
+	def configure(**kwargs):
+		PasswordHasher.instance = PasswordHasher(**kwargs)
+
+	@staticmethod
+	def get() -> "PasswordHasher":
+		if PasswordHasher.instance is None:
+			PasswordHasher.instance = PasswordHasher()
+		return PasswordHasher.instance
+
+	async def run(self, func: Callable[..., T], *args) -> T:
+		if self.pending >= self.workers + self.max_queue:
+			self.rejected += 1
+			raise PasswordHasherBusy("Too many login attempts are being processed, please try again")
+
+		self.pending += 1
+		self.max_pending = max(self.max_pending, self.pending)
+		submitted_at = time.monotonic()
+
+		def timed():
+			started_at = time.monotonic()
+			try:
+				return func(*args)
+			finally:
+				self.wait_seconds_max = max(self.wait_seconds_max, started_at - submitted_at)
+				self.service_seconds_total += time.monotonic() - started_at
+
+		try:
+			return await asyncio.get_running_loop().run_in_executor(self.executor, timed)
+		finally:
+			self.pending -= 1
+			self.calls += 1
+
+	async def hash(self, password: str) -> str:
+		hashed = await self.run(bcrypt.hashpw, password.encode("utf-8"), bcrypt.gensalt())
+		return hashed.decode("utf-8")
+
+	async def verify(self, password: str, hashed_password: str) -> bool:
+		return await self.run(bcrypt.checkpw, password.encode("utf-8"), hashed_password.encode("utf-8"))
+
+	def stats(self) -> dict:
+		return {
+			"workers": self.workers,
+			"pending": self.pending,
+			"max_pending": self.max_pending,
+			"calls": self.calls,
+			"rejected": self.rejected,
+			"max_wait_seconds": self.wait_seconds_max,
+			"average_service_seconds": self.service_seconds_total / self.calls if self.calls else 0.0,
+		}
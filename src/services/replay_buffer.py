@@ -0,0 +1,64 @@
+from collections import deque
+from itertools import islice
+import time
+from typing import Union
+
+
+class ReplayLimits:
+	def __init__(self, max_messages: int = 512, max_bytes: int = 4 * 1024 * 1024, ttl_seconds: float = 60.0):
+		self.max_messages = max_messages
+		self.max_bytes = max_bytes
+		# Frames older than this are not replayed anymore, and a session without a socket ends after this long
+		self.ttl_seconds = ttl_seconds
+
+
+class ReplayBuffer:
+	# The frames a session has written, numbered 1, 2, 3, ... in the order they went out on the socket(s).
+	# A client that resumes the session reports the last number it received and gets the frames after it again.
+	def __init__(self, limits: ReplayLimits = ReplayLimits()):
+		self.limits = limits
+		self.frames: deque[tuple[int, float, Union[str, bytes]]] = deque()
+		self.seq = 0
+		self.bytes = 0
+
+		self.evicted = 0
+		self.replayed = 0
+
+	def record(self, payload: Union[str, bytes]) -> int:
+		self.seq += 1
+		now = time.monotonic()
+		self.frames.append((self.seq, now, payload))
+		self.bytes += len(payload)
+		self.trim(now)
+		return self.seq
+
+	def trim(self, now: float):
+		frames = self.frames
+		while frames and (len(frames) > self.limits.max_messages or self.bytes > self.limits.max_bytes or now - frames[0][1] > self.limits.ttl_seconds):
+			self.bytes -= len(frames.popleft()[2])
+			self.evicted += 1
+
+	@property
+	def first_seq(self) -> int:
+		return self.frames[0][0] if self.frames else self.seq + 1
+
+	def covers(self, last_seq: int) -> bool:
+		# True when every frame after last_seq is still buffered
+		self.trim(time.monotonic())
+		return self.first_seq - 1 <= last_seq <= self.seq
+
+	def since(self, last_seq: int) -> list[Union[str, bytes]]:
+		# Frames are numbered without gaps, so the first missed frame is found by its position
+		start = max(last_seq - self.first_seq + 1, 0)
+		frames = [payload for _, _, payload in islice(self.frames, start, None)]
+		self.replayed += len(frames)
+		return frames
+
+	def stats(self) -> dict:
+		return {
+			"seq": self.seq,
+			"frames": len(self.frames),
+			"bytes": self.bytes,
+			"evicted": self.evicted,
+			"replayed": self.replayed,
+		}
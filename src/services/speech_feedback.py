@@ -0,0 +1,144 @@
+from typing import Optional
+import numpy as np
+from services.voice_activity import PcmAudio, VoiceActivityDetector
+
+
+class SpeechFeedback:
+	def __init__(
+		self,
+		speech_seconds: float,
+		pause_ratio: float,
+		mean_pause_seconds: float,
+		pause_count: int,
+		syllables_per_second: float,
+		pitch_variability_semitones: Optional[float],
+	):
+		self.speech_seconds = speech_seconds
+		self.pause_ratio = pause_ratio
+		self.mean_pause_seconds = mean_pause_seconds
+		self.pause_count = pause_count
+		self.syllables_per_second = syllables_per_second
+		self.pitch_variability_semitones = pitch_variability_semitones
+		self.words_per_minute: Optional[float] = None
+
+	def add_transcription(self, transcription: str):
+		words = len(transcription.split())
+		if self.speech_seconds > 0:
+			self.words_per_minute = words / self.speech_seconds * 60
+
+	def to_dict(self) -> dict:
+		return {
+			"words_per_minute": self.words_per_minute,
+			"syllables_per_second": self.syllables_per_second,
+			"pause_ratio": self.pause_ratio,
+			"mean_pause_seconds": self.mean_pause_seconds,
+			"pause_count": self.pause_count,
+			"pitch_variability_semitones": self.pitch_variability_semitones,
+			"speech_seconds": self.speech_seconds,
+		}
+
+
+class SpeechFeedbackEngine:
+	def __init__(
+		self,
+		detector: VoiceActivityDetector = None,
+		min_pause_ms: int = 250,
+		pitch_frame_ms: int = 40,
+		min_pitch_hz: float = 75.0,
+		max_pitch_hz: float = 400.0,
+		voicing_threshold: float = 0.45,
+	):
+		# No hangover, so pauses are measured from where the energy actually drops:
+		self.detector = detector or VoiceActivityDetector(hangover_ms=20)
+		self.min_pause_ms = min_pause_ms
+		self.pitch_frame_ms = pitch_frame_ms
+		self.min_pitch_hz = min_pitch_hz
+		self.max_pitch_hz = max_pitch_hz
+		self.voicing_threshold = voicing_threshold
+
+	def analyze(self, audio: PcmAudio) -> SpeechFeedback:
+		frame_seconds = self.detector.frame_ms / 1000
+		frames = self.detector.frames(audio.samples, audio.sample_rate)
+		speech = self.detector.speech_mask(frames)
+
+		if not speech.any():
+			return SpeechFeedback(0.0, 0.0, 0.0, 0, 0.0, None)
+
+		# Only the span from the first to the last speech frame counts; leading/trailing silence is not a pause:
+		speech_frames = np.flatnonzero(speech)
+		span = speech[speech_frames[0]:speech_frames[-1] + 1]
+		span_seconds = len(span) * frame_seconds
+
+		pauses = self.silence_runs(span) * frame_seconds
+		pauses = pauses[pauses * 1000 >= self.min_pause_ms]
+		pause_seconds = float(pauses.sum())
+
+		speech_seconds = span_seconds - pause_seconds
+		span_frames = frames[speech_frames[0]:speech_frames[-1] + 1]
+		energy_db, _ = self.detector.frame_features(span_frames)
+
+		return SpeechFeedback(
+			speech_seconds=speech_seconds,
+			pause_ratio=pause_seconds / span_seconds,
+			mean_pause_seconds=float(pauses.mean()) if len(pauses) else 0.0,
+			pause_count=len(pauses),
+			syllables_per_second=self.count_syllables(energy_db) / speech_seconds if speech_seconds > 0 else 0.0,
+			pitch_variability_semitones=self.pitch_variability(audio, speech_frames[0], speech_frames[-1] + 1),
+		)
+
+	@staticmethod
+	def silence_runs(speech: np.ndarray) -> np.ndarray:
+		# Lengths (in frames) of the runs of non-speech frames
+		padded = np.concatenate(([True], speech, [True])).astype(np.int8)
+		edges = np.diff(padded)
+		starts = np.flatnonzero(edges == -1)
+		ends = np.flatnonzero(edges == 1)
+		return ends - starts
+
+	@staticmethod
+	def count_syllables(energy_db: np.ndarray, prominence_db: float = 4.0) -> int:
+		# Syllable nuclei are local maxima of the (smoothed) energy envelope that stand out from the valleys around them
+		if len(energy_db) < 3:
+			return 0
+
+		envelope = np.convolve(energy_db, np.ones(3) / 3, mode="same")
+		peaks = np.flatnonzero((envelope[1:-1] > envelope[:-2]) & (envelope[1:-1] >= envelope[2:])) + 1
+		if len(peaks) == 0:
+			return 0
+
+		# The valley before each peak is the minimum of the envelope since the previous peak:
+		valleys = np.minimum.reduceat(envelope, np.concatenate(([0], peaks)))[:len(peaks)]
+		return int(np.count_nonzero(envelope[peaks] - valleys > prominence_db))
+
+	def pitch_track(self, audio: PcmAudio, start_frame: int, end_frame: int) -> np.ndarray:
+		# Batched autocorrelation pitch estimate: all frames are windowed and transformed in one FFT call.
+		sample_rate = audio.sample_rate
+		frame_length = sample_rate * self.pitch_frame_ms // 1000
+		hop = self.detector.frame_length(sample_rate)
+		samples = audio.samples[start_frame * hop:end_frame * hop].astype(np.float32)
+		if len(samples) < frame_length:
+			return np.zeros(0)
+
+		frames = np.lib.stride_tricks.sliding_window_view(samples, frame_length)[::hop]
+		frames = (frames - frames.mean(axis=1, keepdims=True)) * np.hanning(frame_length).astype(np.float32)
+
+		spectrum = np.fft.rfft(frames, n=2 * frame_length, axis=1)
+		autocorrelation = np.fft.irfft(spectrum.real ** 2 + spectrum.imag ** 2, axis=1)[:, :frame_length]
+
+		min_lag = int(sample_rate / self.max_pitch_hz)
+		max_lag = min(int(sample_rate / self.min_pitch_hz), frame_length - 1)
+		candidates = autocorrelation[:, min_lag:max_lag]
+		lags = np.argmax(candidates, axis=1) + min_lag
+
+		energy = autocorrelation[:, 0]
+		strength = candidates[np.arange(len(lags)), lags - min_lag] / np.maximum(energy, 1e-9)
+		voiced = (strength > self.voicing_threshold) & (energy > 0)
+		return sample_rate / lags[voiced]
+
+	def pitch_variability(self, audio: PcmAudio, start_frame: int, end_frame: int) -> Optional[float]:
+		pitch = self.pitch_track(audio, start_frame, end_frame)
+		if len(pitch) < 5:
+			return None
+
+		semitones = 12 * np.log2(pitch / np.median(pitch))
+		return float(np.std(semitones))
@@ -0,0 +1,336 @@
+import asyncio
+from collections import OrderedDict, deque
+import enum
+import time
+from typing import Any, Iterable, Optional, Union
+from starlette.types import Send
+
+from services.websocket_codec import WebsocketCodec
+from timing_wheel import TimingWheel, WheelTimer
+
+
+HEARTBEAT = b":\n\n"
+
+
+class SseBufferPolicy(str, enum.Enum):
+	Block = "block"
+	DropOldest = "drop_oldest"
+	# An event pushed with a key replaces the queued event with the same key, so a slow client only gets the latest state
+	Coalesce = "coalesce"
+
+
+class SseBufferLimits:
+	def __init__(self, max_events: int = 256, max_bytes: int = 1024 * 1024, policy: SseBufferPolicy = SseBufferPolicy.DropOldest):
+		self.max_events = max_events
+		self.max_bytes = max_bytes
+		self.policy = SseBufferPolicy(policy)
+
+
+class SseChannel:
+	def __init__(self, name: str, history_size: int):
+		self.name = name
+		# The most recent encoded events as (id, chunk, key), for clients that reconnect with a Last-Event-ID
+		self.history: deque[tuple[int, bytes, Optional[str]]] = deque(maxlen=history_size)
+		self.streams: set["SseStream"] = set()
+
+
+class SseStream:
+	# One SSE client. Events are queued in a bounded buffer and the client's request task writes them, so a client
+	# that reads slowly only holds up its own task. When the buffer is full, the Block policy makes put() wait and the
+	# other policies drop the oldest event.
+	def __init__(self, send: Send, limits: SseBufferLimits = None, name: str = ""):
+		self.send = send
+		self.limits = limits or SseBufferLimits()
+		self.name = name
+		# Queued chunks in writing order. With the Coalesce policy an event with a key is queued under that key, every
+		# other event under a number of its own.
+		self.pending: OrderedDict[Union[int, str], bytes] = OrderedDict()
+		self.next_number = 0
+		self.bytes = 0
+		# A bare future instead of an asyncio.Event: waking the writer is the main cost of a fanout
+		self.waiter: asyncio.Future = None
+		self.has_space = asyncio.Event()
+		self.has_space.set()
+		self.closed = False
+		self.finishing = False
+		self.channels: set[str] = set()
+		self.wrote_since_heartbeat = False
+
+		self.max_depth = 0
+		self.max_queued_bytes = 0
+		self.dropped = 0
+		self.coalesced = 0
+		self.blocked = 0
+		self.sent_events = 0
+		self.sent_bytes = 0
+
+	def push(self, chunk: bytes, key: str = None) -> bool:
+		# Never waits. Returns False when the event was not queued: the stream is closed, or it is full and blocks.
+		if self.closed:
+			return False
+
+		limits = self.limits
+		pending = self.pending
+		if key is not None and limits.policy == SseBufferPolicy.Coalesce:
+			replaced = pending.pop(key, None)
+			if replaced is not None:
+				# The new event goes to the tail rather than into the old one's place: it has a higher id than the
+				# events queued after the old one, and ids must reach the client in increasing order
+				self.bytes -= len(replaced)
+				self.coalesced += 1
+		else:
+			key = self.next_number
+			self.next_number += 1
+
+		while pending and (len(pending) >= limits.max_events or self.bytes + len(chunk) > limits.max_bytes):
+			if limits.policy == SseBufferPolicy.Block:
+				return False
+			self.drop_oldest()
+
+		pending[key] = chunk
+		self.bytes += len(chunk)
+		if len(pending) > self.max_depth:
+			self.max_depth = len(pending)
+		if self.bytes > self.max_queued_bytes:
+			self.max_queued_bytes = self.bytes
+
+		self.wake()
+		return True
+
+	async def put(self, chunk: bytes, key: str = None) -> bool:
+		# For producers that may wait: with the Block policy this returns once the client has read enough.
+		# Returns False when the stream is closed.
+		while not self.push(chunk, key):
+			if self.closed:
+				return False
+			self.blocked += 1
+			self.has_space.clear()
+			await self.has_space.wait()
+		return True
+
+	def drop_oldest(self):
+		_, chunk = self.pending.popitem(last=False)
+		self.bytes -= len(chunk)
+		self.dropped += 1
+
+	def wake(self):
+		waiter = self.waiter
+		if waiter is not None and not waiter.done():
+			waiter.set_result(None)
+
+	def close(self):
+		self.closed = True
+		self.has_space.set()
+		self.wake()
+
+	def finish(self):
+		# Ends the stream once the queued events are written
+		self.finishing = True
+		self.wake()
+
+	async def run(self):
+		loop = asyncio.get_running_loop()
+		pending = self.pending
+		while not self.closed:
+			if not pending:
+				if self.finishing:
+					break
+				self.waiter = loop.create_future()
+				await self.waiter
+				self.waiter = None
+				continue
+
+			# Everything that queued up meanwhile goes out in one body chunk
+			count = len(pending)
+			body = pending.popitem()[1] if count == 1 else b"".join(pending.values())
+			pending.clear()
+			self.bytes = 0
+			self.has_space.set()
+
+			await self.send({"type": "http.response.body", "body": body, "more_body": True})
+			if body is not HEARTBEAT:
+				self.wrote_since_heartbeat = True
+			self.sent_events += count
+			self.sent_bytes += len(body)
+
+	def stats(self) -> dict:
+		return {
+			"policy": self.limits.policy.value,
+			"depth": len(self.pending),
+			"bytes": self.bytes,
+			"max_depth": self.max_depth,
+			"max_bytes": self.max_queued_bytes,
+			"dropped": self.dropped,
+			"coalesced": self.coalesced,
+			"blocked": self.blocked,
+			"sent_events": self.sent_events,
+			"sent_bytes": self.sent_bytes,
+		}
+
+
+class SseHub:
+	# Channels of server-sent events shared by all SSE clients of this process. Each event is encoded once and
+	# the same bytes are queued for every subscriber. Event ids are "<epoch>-<n>", so an id from another process
+	# (or from before a restart) is recognized and not used for replay.
+	instance: "SseHub" = None
+
+	def __init__(self, history_size: int = 256, heartbeat_seconds: float = 15.0, limits: SseBufferLimits = None, history_seconds: float = 300.0, max_channels: int = 10000):
+		self.history_size = history_size
+		self.heartbeat_seconds = heartbeat_seconds
+		# A channel without streams is kept for history_seconds after its last event or stream, so clients can still
+		# reconnect and replay; then it is removed. Beyond max_channels the longest idle channels are removed early.
+		self.history_seconds = history_seconds
+		self.max_channels = max_channels
+		# The buffer limits of the streams that do not bring their own
+		self.limits = self.check_limits(limits or SseBufferLimits())
+		self.epoch = format(time.time_ns() // 1000000, "x")
+		self.last_id = 0
+		self.channels: dict[str, SseChannel] = {}
+		# Channels without streams -> when they expire, the soonest first
+		self.idle_channels: OrderedDict[str, float] = OrderedDict()
+		self.streams: set[SseStream] = set()
+		self.heartbeat_timer: WheelTimer = None
+
+		self.published = 0
+		self.replayed = 0
+		self.heartbeats = 0
+		self.expired_channels = 0
+		# Of the streams that are gone; the streams that are still subscribed are added in stats()
+		self.dropped = 0
+		self.coalesced = 0
+
+	@staticmethod
+	def configure(**kwargs):
+		SseHub.instance = SseHub(**kwargs)
+
+	@staticmethod
+	def get() -> "SseHub":
+		if SseHub.instance is None:
+			SseHub.instance = SseHub()
+		return SseHub.instance
+
+	def check_limits(self, limits: SseBufferLimits) -> SseBufferLimits:
+		if limits.policy == SseBufferPolicy.Block:
+			raise ValueError("Hub streams cannot block the publisher; use drop_oldest or coalesce")
+		return limits
+
+	def channel(self, name: str) -> SseChannel:
+		channel = self.channels.get(name)
+		if channel is None:
+			channel = self.channels[name] = SseChannel(name, self.history_size)
+			self.set_idle(channel)
+		return channel
+
+	def set_idle(self, channel: SseChannel):
+		# Expiries only grow, so moving the channel to the end keeps the soonest first
+		self.idle_channels[channel.name] = time.monotonic() + self.history_seconds
+		self.idle_channels.move_to_end(channel.name)
+
+	def expire_channels(self):
+		# Runs on every publish and unsubscribe, so idle channels cannot pile up between them
+		now = time.monotonic()
+		while self.idle_channels:
+			name, expires = next(iter(self.idle_channels.items()))
+			if expires > now and len(self.channels) <= self.max_channels:
+				break
+			del self.idle_channels[name]
+			del self.channels[name]
+			self.expired_channels += 1
+
+	def encode(self, event_id: int, data: Any, event: Optional[str]) -> bytes:
+		payload = data if isinstance(data, bytes) else WebsocketCodec.encode(data)
+		prefix = f"id: {self.epoch}-{event_id}\n" if event is None else f"id: {self.epoch}-{event_id}\nevent: {event}\n"
+		return b"".join((prefix.encode(), b"data: ", payload, b"\n\n"))
+
+	def publish(self, channel_name: str, data: Any, event: str = None, key: str = None) -> int:
+		# Never waits: the event is queued for every subscriber and written by their own tasks. Streams with the
+		# Coalesce policy replace a still queued event that has the same key.
+		self.last_id += 1
+		chunk = self.encode(self.last_id, data, event)
+		channel = self.channel(channel_name)
+		channel.history.append((self.last_id, chunk, key))
+		self.published += 1
+
+		if channel.streams:
+			for stream in channel.streams:
+				stream.push(chunk, key)
+		else:
+			self.set_idle(channel)
+		self.expire_channels()
+		return self.last_id
+
+	def parse_event_id(self, last_event_id: Optional[str]) -> Optional[int]:
+		if not last_event_id:
+			return None
+		epoch, _, number = last_event_id.strip().partition("-")
+		if epoch != self.epoch or not number.isdigit():
+			return None
+		return int(number)
+
+	def subscribe(self, stream: SseStream, channel_names: Iterable[str], last_event_id: str = None):
+		self.check_limits(stream.limits)
+		missed: list[tuple[int, bytes, Optional[str]]] = []
+		last_id = self.parse_event_id(last_event_id)
+
+		for name in channel_names:
+			channel = self.channel(name)
+			channel.streams.add(stream)
+			self.idle_channels.pop(name, None)
+			stream.channels.add(name)
+			if last_id is not None:
+				missed.extend(entry for entry in channel.history if entry[0] > last_id)
+
+		# Ids are global to the hub, so the missed events of several channels are replayed in publishing order
+		missed.sort(key=lambda entry: entry[0])
+		for _, chunk, key in missed:
+			stream.push(chunk, key)
+		self.replayed += len(missed)
+
+		self.streams.add(stream)
+		if self.heartbeat_timer is None:
+			self.heartbeat_timer = TimingWheel.get().schedule(self.heartbeat_seconds, self.heartbeat)
+
+	def unsubscribe(self, stream: SseStream):
+		for name in stream.channels:
+			channel = self.channels.get(name)
+			if channel is not None:
+				channel.streams.discard(stream)
+				if not channel.streams:
+					self.set_idle(channel)
+		stream.channels.clear()
+		self.expire_channels()
+		if stream in self.streams:
+			self.streams.remove(stream)
+			self.dropped += stream.dropped
+			self.coalesced += stream.coalesced
+
+	def heartbeat(self):
+		# One timer for all clients: only the streams that were idle since the last beat get a comment line
+		self.heartbeat_timer = None
+		for stream in self.streams:
+			if stream.wrote_since_heartbeat:
+				stream.wrote_since_heartbeat = False
+			elif not stream.pending:
+				stream.push(HEARTBEAT)
+				self.heartbeats += 1
+
+		if self.streams:
+			self.heartbeat_timer = TimingWheel.get().schedule(self.heartbeat_seconds, self.heartbeat)
+
+	def stats(self) -> dict:
+		return {
+			"channels": len(self.channels),
+			"idle_channels": len(self.idle_channels),
+			"expired_channels": self.expired_channels,
+			"streams": len(self.streams),
+			"published": self.published,
+			"replayed": self.replayed,
+			"heartbeats": self.heartbeats,
+			"dropped": self.dropped + sum(stream.dropped for stream in self.streams),
+			"coalesced": self.coalesced + sum(stream.coalesced for stream in self.streams),
+			"max_depth": max((stream.max_depth for stream in self.streams), default=0),
+		}
+
+	def stream_stats(self) -> dict[str, dict]:
+		# Per stream occupancy and drops, by stream name
+		return {stream.name or str(id(stream)): stream.stats() for stream in self.streams}
@@ -0,0 +1,144 @@
+from collections import OrderedDict
+import hashlib
+import heapq
+import threading
+import time
+from typing import Any, Callable, TypeVar
+
+
+T = TypeVar("T")
+
+
+class VerifiedTokenCache:
+	# Tokens whose signature and claims were verified, keyed by a digest of the token (the token itself is not kept).
+	# An entry is used until the token's exp and no longer, so an expired token fails verification as before.
+	# FastAPI runs the sync auth dependencies on its threadpool, so all state is guarded by one lock; the signature
+	# check of a miss runs outside of it.
+	instance: "VerifiedTokenCache" = None
+
+	def __init__(self, max_entries: int = 10000):
+		self.max_entries = max_entries
+		# digest -> (verified claims, exp, sub), least recently used first
+		self.entries: OrderedDict[bytes, tuple[Any, float, str]] = OrderedDict()
+		# (exp, digest), so expired entries are evicted before the least recently used ones
+		self.expiries: list[tuple[float, bytes]] = []
+		self.subjects: dict[str, set[bytes]] = {}
+		self.lock = threading.Lock()
+
+		self.hits = 0
+		self.misses = 0
+		self.expired = 0
+		self.evictions = 0
+		self.purged = 0
+
+	@staticmethod
+	def configure(**kwargs):
+		VerifiedTokenCache.instance = VerifiedTokenCache(**kwargs)
+
+	@staticmethod
+	def get() -> "VerifiedTokenCache":
+		if VerifiedTokenCache.instance is None:
+			VerifiedTokenCache.instance = VerifiedTokenCache()
+		return VerifiedTokenCache.instance
+
+	@staticmethod
+	def key(kind: str, token: str) -> bytes:
+		# The kind keeps an access token and a refresh token apart even though they are verified the same way
+		return hashlib.blake2b(token.encode(), digest_size=16, person=kind.encode()[:16]).digest()
+
+	def verify(self, kind: str, token: str, verify: Callable[[str], T]) -> T:
+		# verify must raise for an invalid token and return claims with sub and exp; failures are not cached
+		key = self.key(kind, token)
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is not None:
+				if time.time() < entry[1]:
+					self.entries.move_to_end(key)
+					self.hits += 1
+					return entry[0]
+				self.remove(key)
+				self.expired += 1
+			self.misses += 1
+
+		claims = verify(token)
+		with self.lock:
+			self.add(key, claims)
+		return claims
+
+	def add(self, key: bytes, claims: Any):
+		exp = float(claims.exp)
+		if exp <= time.time():
+			return
+
+		if key in self.entries:
+			# Verified by another thread meanwhile
+			return
+
+		while self.entries and len(self.entries) >= self.max_entries:
+			self.evict()
+
+		self.entries[key] = (claims, exp, claims.sub)
+		heapq.heappush(self.expiries, (exp, key))
+		self.subjects.setdefault(claims.sub, set()).add(key)
+
+		# Entries that were removed early (purged, expired on use, evicted) leave their expiry behind, and evict skips
+		# those; rebuild before the heap outgrows the cache
+		if len(self.expiries) > 2 * self.max_entries:
+			self.expiries = [(entry[1], key) for key, entry in self.entries.items()]
+			heapq.heapify(self.expiries)
+
+	def evict(self):
+		# The entry that expires first, if it has expired; otherwise the least recently used one
+		now = time.time()
+		while self.expiries and self.expiries[0][0] <= now:
+			exp, key = heapq.heappop(self.expiries)
+			entry = self.entries.get(key)
+			if entry is not None and entry[1] == exp:
+				self.remove(key)
+				self.expired += 1
+				return
+
+		key = next(iter(self.entries))
+		self.remove(key)
+		self.evictions += 1
+
+	def remove(self, key: bytes):
+		entry = self.entries.pop(key, None)
+		if entry is None:
+			return
+		sub = entry[2]
+		keys = self.subjects.get(sub)
+		if keys is not None:
+			keys.discard(key)
+			if not keys:
+				del self.subjects[sub]
+
+	def purge(self, kind: str, token: str) -> bool:
+		# Only drops the cache entry, the token is not revoked: while it is valid it is verified (and cached) again on
+		# its next use
+		key = self.key(kind, token)
+		with self.lock:
+			if key not in self.entries:
+				return False
+			self.remove(key)
+			self.purged += 1
+			return True
+
+	def purge_subject(self, sub: str) -> int:
+		with self.lock:
+			keys = list(self.subjects.get(str(sub), ()))
+			for key in keys:
+				self.remove(key)
+			self.purged += len(keys)
+			return len(keys)
+
+	def stats(self) -> dict:
+		with self.lock:
+			return {
+				"entries": len(self.entries),
+				"hits": self.hits,
+				"misses": self.misses,
+				"expired": self.expired,
+				"evictions": self.evictions,
+				"purged": self.purged,
+			}
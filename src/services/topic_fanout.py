@@ -0,0 +1,89 @@
+import asyncio
+import enum
+from typing import TYPE_CHECKING, Union
+
+from services.outbound_writer import SendPriority
+
+if TYPE_CHECKING:
+	from services.base_websocket_worker import BaseWebsocketWorker
+
+
+class SlowSubscriberPolicy(str, enum.Enum):
+	# The subscriber misses the message, but stays connected
+	Drop = "drop"
+	# The subscriber is disconnected as a slow consumer
+	Disconnect = "disconnect"
+
+
+class TopicFanout:
+	def __init__(self, max_pending_messages: int = 256, policy: SlowSubscriberPolicy = SlowSubscriberPolicy.Drop, yield_every: int = 1000):
+		# A subscriber counts as slow when its send buffer already holds max_pending_messages messages
+		self.max_pending_messages = max_pending_messages
+		self.policy = SlowSubscriberPolicy(policy)
+		# Large fanouts give the event loop a chance to run other tasks every yield_every subscribers
+		self.yield_every = yield_every
+		self.topics: dict[str, set["BaseWebsocketWorker"]] = {}
+
+		self.published = 0
+		self.delivered = 0
+		self.dropped = 0
+		self.disconnected = 0
+
+	def subscribe(self, topic: str, subscriber: "BaseWebsocketWorker"):
+		self.topics.setdefault(topic, set()).add(subscriber)
+		subscriber.topics.add(topic)
+
+	def unsubscribe(self, topic: str, subscriber: "BaseWebsocketWorker"):
+		subscribers = self.topics.get(topic)
+		if subscribers is not None:
+			subscribers.discard(subscriber)
+			if not subscribers:
+				del self.topics[topic]
+		subscriber.topics.discard(topic)
+
+	def unsubscribe_all(self, subscriber: "BaseWebsocketWorker"):
+		for topic in list(subscriber.topics):
+			self.unsubscribe(topic, subscriber)
+
+	async def publish(self, topic: str, payload: Union[str, bytes], priority: SendPriority = SendPriority.Control) -> int:
+		# The payload is encoded by the caller once; each subscriber's writer task sends it on its own,
+		# so one slow socket does not hold up delivery to the others.
+		subscribers = self.topics.get(topic)
+		if not subscribers:
+			return 0
+
+		self.published += 1
+		delivered = 0
+		for index, subscriber in enumerate(tuple(subscribers)):
+			if index and index % self.yield_every == 0:
+				await asyncio.sleep(0)
+
+			writer = subscriber.writer
+			if writer is None or writer.slow_reason is not None:
+				continue
+
+			if writer.depth >= self.max_pending_messages:
+				if self.policy == SlowSubscriberPolicy.Disconnect:
+					writer.mark_slow(f"{writer.depth} messages pending for topic {topic}")
+					self.disconnected += 1
+				else:
+					self.dropped += 1
+
+			elif writer.enqueue(payload, priority):
+				delivered += 1
+
+			else:
+				self.dropped += 1
+
+		self.delivered += delivered
+		return delivered
+
+	def stats(self) -> dict:
+		return {
+			"topics": len(self.topics),
+			"subscriptions": sum(len(subscribers) for subscribers in self.topics.values()),
+			"published": self.published,
+			"delivered": self.delivered,
+			"dropped": self.dropped,
+			"disconnected": self.disconnected,
+		}
@@ -0,0 +1,200 @@
+import asyncio
+from collections import OrderedDict
+import hashlib
+import os
+import re
+import unicodedata
+from typing import Awaitable, Callable
+
+
+class TtsCache:
+	instance: "TtsCache" = None
+
+	whitespace = re.compile(r"\s+")
+
+	def __init__(self, memory_max_bytes: int = 64 * 1024 * 1024, disk_path: str = None, disk_max_bytes: int = 1024 * 1024 * 1024):
+		self.memory_max_bytes = memory_max_bytes
+		self.memory: OrderedDict[str, bytes] = OrderedDict()
+		self.memory_bytes = 0
+
+		self.disk_path = disk_path
+		self.disk_max_bytes = disk_max_bytes
+		self.disk_index: OrderedDict[str, int] = OrderedDict()
+		self.disk_bytes = 0
+
+		# Concurrent misses for the same key share one upstream call:
+		self.in_flight: dict[str, asyncio.Future] = {}
+
+		self.memory_hits = 0
+		self.disk_hits = 0
+		self.shared_hits = 0
+		self.misses = 0
+		self.memory_evictions = 0
+		self.disk_evictions = 0
+
+		if disk_path is not None:
+			self.load_disk_index()
+
+	@staticmethod
+	def configure(**kwargs):
+		TtsCache.instance = TtsCache(**kwargs)
+
+	@staticmethod
+	def key(model: str, voice: str, audio_format: str, text: str) -> str:
+		normalized = TtsCache.whitespace.sub(" ", unicodedata.normalize("NFC", text)).strip()
+		return hashlib.sha256(f"{model}\0{voice}\0{audio_format}\0{normalized}".encode("utf-8")).hexdigest()
+
+	def stats(self) -> dict:
+		return {
+			"memory_hits": self.memory_hits,
+			"disk_hits": self.disk_hits,
+			"shared_hits": self.shared_hits,
+			"misses": self.misses,
+			"memory_evictions": self.memory_evictions,
+			"disk_evictions": self.disk_evictions,
+			"memory_entries": len(self.memory),
+			"memory_bytes": self.memory_bytes,
+			"disk_entries": len(self.disk_index),
+			"disk_bytes": self.disk_bytes,
+		}
+
+	async def get_or_synthesize(self, model: str, voice: str, audio_format: str, text: str, synthesize: Callable[[], Awaitable[bytes]]) -> bytes:
+		key = TtsCache.key(model, voice, audio_format, text)
+
+		audio = self.memory.get(key)
+		if audio is not None:
+			self.memory.move_to_end(key)
+			self.memory_hits += 1
+			return audio
+
+		while (in_flight := self.in_flight.get(key)) is not None:
+			try:
+				audio = await asyncio.shield(in_flight)
+				self.shared_hits += 1
+				return audio
+			except asyncio.CancelledError:
+				# Only give up if this caller was cancelled. If the caller that owned the request was, take over from it:
+				if not in_flight.cancelled():
+					raise
+
+		future = asyncio.get_running_loop().create_future()
+		self.in_flight[key] = future
+
+		try:
+			audio = await self.get_from_disk(key)
+			if audio is not None:
+				self.disk_hits += 1
+				self.put_in_memory(key, audio)
+				future.set_result(audio)
+				return audio
+
+			self.misses += 1
+			audio = await synthesize()
+			self.put_in_memory(key, audio)
+
+			# Waiters do not need to wait for the disk write:
+			future.set_result(audio)
+			await self.put_on_disk(key, audio)
+			return audio
+
+		except asyncio.CancelledError:
+			if not future.done():
+				future.cancel()
+			raise
+
+		except Exception as e:
+			if future.done():
+				raise
+			future.set_exception(e)
+			# Waiters get the exception; retrieve it here so an unawaited future does not log a warning:
+			future.exception()
+			raise
+
+		finally:
+			del self.in_flight[key]
+
+	def put_in_memory(self, key: str, audio: bytes):
+		if len(audio) > self.memory_max_bytes:
+			return
+
+		self.memory[key] = audio
+		self.memory_bytes += len(audio)
+
+		while self.memory_bytes > self.memory_max_bytes:
+			_, evicted = self.memory.popitem(last=False)
+			self.memory_bytes -= len(evicted)
+			self.memory_evictions += 1
+
+	def disk_file(self, key: str) -> str:
+		return os.path.join(self.disk_path, key + ".audio")
+
+	def load_disk_index(self):
+		os.makedirs(self.disk_path, exist_ok=True)
+
+		# Least recently written files are evicted first after a restart:
+		entries = []
+		with os.scandir(self.disk_path) as files:
+			for file in files:
+				if file.is_file() and file.name.endswith(".audio"):
+					stat = file.stat()
+					if stat.st_size == 0:
+						# Left behind by a crash; never a valid entry
+						continue
+					entries.append((stat.st_mtime, file.name[:-len(".audio")], stat.st_size))
+
+		for _, key, size in sorted(entries):
+			self.disk_index[key] = size
+			self.disk_bytes += size
+
+	async def get_from_disk(self, key: str) -> bytes:
+		if key not in self.disk_index:
+			return None
+
+		self.disk_index.move_to_end(key)
+		try:
+			audio = await asyncio.to_thread(self.read_file, self.disk_file(key))
+		except OSError:
+			audio = None
+
+		if not audio:
+			self.disk_bytes -= self.disk_index.pop(key, 0)
+			return None
+		return audio
+
+	async def put_on_disk(self, key: str, audio: bytes):
+		if self.disk_path is None or len(audio) > self.disk_max_bytes or len(audio) == 0:
+			return
+
+		evicted = []
+		self.disk_index[key] = len(audio)
+		self.disk_bytes += len(audio)
+		while self.disk_bytes > self.disk_max_bytes:
+			evicted_key, size = self.disk_index.popitem(last=False)
+			self.disk_bytes -= size
+			self.disk_evictions += 1
+			evicted.append(self.disk_file(evicted_key))
+
+		try:
+			await asyncio.to_thread(self.write_file, self.disk_file(key), audio, evicted)
+		except OSError as e:
+			print(f"TTS cache: failed to write {key}: {e}")
+			self.disk_bytes -= self.disk_index.pop(key, 0)
+
+	@staticmethod
+	def read_file(path: str) -> bytes:
+		with open(path, "rb") as file:
+			return file.read()
+
+	@staticmethod
+	def write_file(path: str, audio: bytes, evicted: list[str]):
+		for evicted_path in evicted:
+			try:
+				os.remove(evicted_path)
+			except FileNotFoundError:
+				pass
+
+		# Write to a temporary file first, so a concurrent reader never sees a partial file:
+		temporary_path = f"{path}.{os.getpid()}.tmp"
+		with open(temporary_path, "wb") as file:
+			file.write(audio)
+		os.replace(temporary_path, path)
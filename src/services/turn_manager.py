@@ -0,0 +1,72 @@
+import asyncio
+import time
+from typing import Any, Callable, Coroutine
+
+
+class TurnManager:
+	# Totals for the whole process:
+	total_cancellations = 0
+	total_seconds_saved = 0.0
+
+	def __init__(self, smoothing: float = 0.2):
+		self.smoothing = smoothing
+		self.current: asyncio.Task = None
+		self.current_started = 0.0
+		# Turns are numbered 1, 2, 3, ...; current_turn is the number of the latest one
+		self.current_turn: int = None
+		self.turns = 0
+		self.average_turn_seconds = None
+		self.completed = 0
+		self.cancellations = 0
+		self.seconds_saved = 0.0
+
+	@property
+	def running(self) -> bool:
+		return self.current is not None and not self.current.done()
+
+	def cancel_current(self) -> bool:
+		if not self.running:
+			return False
+
+		self.current.cancel()
+
+		# The time saved is what the rest of the cancelled turn would have taken, judging by the average turn:
+		elapsed = time.monotonic() - self.current_started
+		saved = max((self.average_turn_seconds or 0.0) - elapsed, 0.0)
+		self.cancellations += 1
+		self.seconds_saved += saved
+		TurnManager.total_cancellations += 1
+		TurnManager.total_seconds_saved += saved
+
+		print(f"Turn cancelled after {elapsed:.2f}s (saved ~{saved:.2f}s, {self.cancellations} cancellations)")
+		return True
+
+	async def run(self, turn: Callable[[int], Coroutine]) -> Any:
+		# Starts a new turn, cancelling the one that is still running. The turn is called with its number, so it can
+		# tag what it sends. Returns None if this turn gets cancelled.
+		self.cancel_current()
+
+		started = time.monotonic()
+		self.turns += 1
+		self.current_turn = self.turns
+		task = asyncio.create_task(turn(self.current_turn))
+		self.current = task
+		self.current_started = started
+
+		try:
+			result = await task
+
+		except asyncio.CancelledError:
+			# Cancellation of the caller (e.g. the connection closing) is propagated, barge-in is not:
+			if asyncio.current_task().cancelling() > 0:
+				raise
+			return None
+
+		duration = time.monotonic() - started
+		if self.average_turn_seconds is None:
+			self.average_turn_seconds = duration
+		else:
+			self.average_turn_seconds += self.smoothing * (duration - self.average_turn_seconds)
+		self.completed += 1
+
+		return result
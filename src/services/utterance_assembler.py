@@ -0,0 +1,117 @@
+import enum
+from typing import Optional
+
+from services.exceptions import AppException
+from services.voice_activity import Endpointer, VoiceActivityDetector
+
+
+class UploadMarker(enum.IntEnum):
+	Start = 1
+	Chunk = 2
+	End = 3
+
+upload_markers = set(UploadMarker)
+
+
+class UploadLimits:
+	def __init__(
+		self,
+		max_chunk_bytes: int = 64 * 1024,
+		max_utterance_bytes: int = 10 * 1024 * 1024,
+		allow_unframed: bool = True,
+		end_of_utterance_silence_ms: int = None,
+	):
+		self.max_chunk_bytes = max_chunk_bytes
+		self.max_utterance_bytes = max_utterance_bytes
+
+		# When set, PCM uploads end automatically after this much silence following speech (auto-endpointing):
+		self.end_of_utterance_silence_ms = end_of_utterance_silence_ms
+
+		# Clients that do not use the framed protocol send a whole recording per message. Audio containers never
+		# start with one of the marker bytes (m4a starts with 0x00, wav with "R", ogg with "O", webm with 0x1A):
+		self.allow_unframed = allow_unframed
+
+
+class UtteranceAssembler:
+	def __init__(self, limits: UploadLimits = UploadLimits()):
+		self.limits = limits
+		self.buffer = bytearray()
+		self.in_progress = False
+		self.endpointed = False
+		self.endpointer = None
+		if limits.end_of_utterance_silence_ms is not None:
+			self.endpointer = Endpointer(VoiceActivityDetector(), end_silence_ms=limits.end_of_utterance_silence_ms)
+
+	def reset(self):
+		self.buffer = bytearray()
+		self.in_progress = False
+		if self.endpointer is not None:
+			self.endpointer.reset()
+
+	def starts_utterance(self, frame: bytes) -> bool:
+		if len(frame) == 0:
+			return False
+		if frame[0] == UploadMarker.Start:
+			return True
+		return frame[0] not in upload_markers and self.limits.allow_unframed and not self.in_progress
+
+	def check_utterance(self, utterance: bytes):
+		# For audio that arrives as one whole utterance instead of in chunks
+		if len(utterance) > self.limits.max_utterance_bytes:
+			raise AppException(f"Utterance exceeds {self.limits.max_utterance_bytes} bytes")
+
+	def feed(self, frame: bytes) -> Optional[bytearray]:
+		# Each frame is a one byte marker followed by (possibly empty) audio data.
+		# Returns the assembled utterance when the end marker arrives, otherwise None.
+		if len(frame) == 0:
+			raise AppException("Empty upload frame")
+
+		marker = frame[0]
+		if marker not in upload_markers:
+			if self.limits.allow_unframed and not self.in_progress:
+				self.check_utterance(frame)
+				return frame
+
+			self.reset()
+			raise AppException(f"Invalid upload marker: {marker}")
+
+		return self.feed_chunk(marker, memoryview(frame)[1:])
+
+	def feed_chunk(self, marker: int, payload: memoryview) -> Optional[bytearray]:
+		if len(payload) > self.limits.max_chunk_bytes:
+			self.reset()
+			raise AppException(f"Upload chunk exceeds {self.limits.max_chunk_bytes} bytes")
+
+		if marker == UploadMarker.Start:
+			# A new start marker discards an unfinished utterance:
+			self.reset()
+			self.in_progress = True
+			self.endpointed = False
+
+		elif self.endpointed:
+			# The utterance was already ended by the endpointer; the rest of it is trailing silence:
+			if marker == UploadMarker.End:
+				self.endpointed = False
+			return None
+
+		elif not self.in_progress:
+			raise AppException(f"Upload frame {UploadMarker(marker).name} received before {UploadMarker.Start.name}")
+
+		if len(self.buffer) + len(payload) > self.limits.max_utterance_bytes:
+			self.reset()
+			raise AppException(f"Utterance exceeds {self.limits.max_utterance_bytes} bytes")
+
+		self.buffer += payload
+
+		if marker != UploadMarker.End and self.endpointer is not None and self.endpointer.feed(payload):
+			print(f"Endpointer: end of utterance detected after {len(self.buffer)} bytes")
+			self.endpointed = True
+			marker = UploadMarker.End
+
+		if marker == UploadMarker.End:
+			# Hand the buffer over without copying it, and start a fresh one for the next utterance:
+			utterance = self.buffer
+			self.reset()
+			return utterance
+
+		return None
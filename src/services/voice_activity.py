@@ -0,0 +1,239 @@
+import io
+import wave
+from typing import Optional
+import numpy as np
+
+
+class PcmAudio:
+	def __init__(self, samples: np.ndarray, sample_rate: int):
+		self.samples = samples
+		self.sample_rate = sample_rate
+
+	@property
+	def seconds(self) -> float:
+		return len(self.samples) / self.sample_rate
+
+	@staticmethod
+	def from_wav(data: bytes) -> Optional["PcmAudio"]:
+		# Only uncompressed 16-bit WAV can be analyzed without a decoder. Other formats (m4a, ogg, webm) return None.
+		if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+			return None
+
+		try:
+			with wave.open(io.BytesIO(data), "rb") as wav:
+				if wav.getsampwidth() != 2:
+					return None
+				channels = wav.getnchannels()
+				sample_rate = wav.getframerate()
+				frames = wav.readframes(wav.getnframes())
+		except (wave.Error, EOFError):
+			return None
+
+		samples = np.frombuffer(frames, dtype="<i2")
+		if channels > 1:
+			samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1).astype(np.int16)
+
+		return PcmAudio(samples, sample_rate)
+
+	def to_wav(self) -> bytes:
+		buffer = io.BytesIO()
+		with wave.open(buffer, "wb") as wav:
+			wav.setnchannels(1)
+			wav.setsampwidth(2)
+			wav.setframerate(self.sample_rate)
+			wav.writeframes(self.samples.astype("<i2", copy=False).tobytes())
+		return buffer.getvalue()
+
+
+class VadStats:
+	def __init__(self, total_seconds: float = 0.0, kept_seconds: float = 0.0, speech_seconds: float = 0.0):
+		self.total_seconds = total_seconds
+		self.kept_seconds = kept_seconds
+		self.speech_seconds = speech_seconds
+
+	@property
+	def removed_seconds(self) -> float:
+		return self.total_seconds - self.kept_seconds
+
+	@property
+	def has_speech(self) -> bool:
+		return self.speech_seconds > 0
+
+	def __str__(self):
+		return f"total={self.total_seconds:.2f}s, speech={self.speech_seconds:.2f}s, removed={self.removed_seconds:.2f}s"
+
+
+class VoiceActivityDetector:
+	# Totals for the whole process, to see how much audio is kept away from the STT provider:
+	total_seconds = 0.0
+	removed_seconds = 0.0
+
+	def __init__(
+		self,
+		frame_ms: int = 20,
+		threshold_db: float = 12.0,
+		min_energy_db: float = -55.0,
+		max_noise_floor_db: float = -45.0,
+		zcr_threshold: float = 0.25,
+		hangover_ms: int = 200,
+		padding_ms: int = 150,
+		max_pause_ms: int = 600,
+	):
+		self.frame_ms = frame_ms
+		self.threshold_db = threshold_db
+		self.min_energy_db = min_energy_db
+		self.max_noise_floor_db = max_noise_floor_db
+		self.zcr_threshold = zcr_threshold
+		self.hangover_ms = hangover_ms
+		self.padding_ms = padding_ms
+		self.max_pause_ms = max_pause_ms
+
+	def frame_length(self, sample_rate: int) -> int:
+		return sample_rate * self.frame_ms // 1000
+
+	def frames(self, samples: np.ndarray, sample_rate: int) -> np.ndarray:
+		# A (frame count, frame length) view of the samples. The incomplete last frame is left out.
+		frame_length = self.frame_length(sample_rate)
+		frame_count = len(samples) // frame_length
+		return samples[:frame_count * frame_length].reshape(frame_count, frame_length)
+
+	def frame_features(self, frames: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+		normalized = frames.astype(np.float32) / 32768.0
+		energy_db = 10.0 * np.log10(np.einsum("ij,ij->i", normalized, normalized) / frames.shape[1] + 1e-12)
+		signs = np.signbit(frames)
+		zero_crossings = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / frames.shape[1]
+		return energy_db, zero_crossings
+
+	def speech_threshold_db(self, energy_db: np.ndarray, noise_floor_db: float = None) -> float:
+		if noise_floor_db is None:
+			noise_floor_db = np.percentile(energy_db, 10) if len(energy_db) else self.min_energy_db
+		# The quietest frames are only background noise when they are actually quiet. A clip cropped tightly around
+		# speech (or a calibration the learner talked through) has no such frames, and its floor would be speech
+		# itself; capping the floor keeps ordinary speech above the threshold, so it is never dropped as silence.
+		noise_floor_db = min(noise_floor_db, self.max_noise_floor_db)
+		return max(noise_floor_db + self.threshold_db, self.min_energy_db)
+
+	def speech_mask(self, frames: np.ndarray, noise_floor_db: float = None) -> np.ndarray:
+		if len(frames) == 0:
+			return np.zeros(0, dtype=bool)
+
+		energy_db, zero_crossings = self.frame_features(frames)
+		threshold_db = self.speech_threshold_db(energy_db, noise_floor_db)
+
+		# Voiced speech is loud, unvoiced consonants ("s", "f") are quieter but cross zero often:
+		speech = (energy_db > threshold_db) | ((energy_db > threshold_db - 6.0) & (zero_crossings > self.zcr_threshold))
+
+		# Keep speech "on" for a short while after it ends, so word endings are not cut off:
+		hangover = max(self.hangover_ms // self.frame_ms, 1)
+		return np.convolve(speech.astype(np.int8), np.ones(hangover + 1, dtype=np.int8))[:len(speech)] > 0
+
+	def keep_mask(self, speech: np.ndarray) -> np.ndarray:
+		frame_count = len(speech)
+		if not speech.any():
+			return np.zeros(frame_count, dtype=bool)
+
+		# Run-length encode the silence, and measure for every silent frame the distance to the surrounding speech:
+		index = np.arange(frame_count)
+		changes = np.flatnonzero(speech[1:] != speech[:-1]) + 1
+		run_ids = np.zeros(frame_count, dtype=np.intp)
+		run_ids[changes] = 1
+		run_ids = np.cumsum(run_ids)
+		run_starts = np.concatenate(([0], changes))[run_ids]
+		run_ends = np.concatenate((changes, [frame_count]))[run_ids]
+		since_start = index - run_starts
+		until_end = run_ends - 1 - index
+
+		padding = self.padding_ms // self.frame_ms
+		half_pause = self.max_pause_ms // self.frame_ms // 2
+
+		first_speech = np.argmax(speech)
+		last_speech = frame_count - 1 - np.argmax(speech[::-1])
+		leading = index < first_speech
+		trailing = index > last_speech
+		interior = ~speech & ~leading & ~trailing
+
+		# Leading/trailing silence keeps only some padding; long pauses inside the utterance are shortened:
+		keep = speech.copy()
+		keep |= leading & (until_end < padding)
+		keep |= trailing & (since_start < padding)
+		keep |= interior & ((since_start < half_pause) | (until_end < half_pause))
+		return keep
+
+	def trim(self, audio: PcmAudio) -> tuple[PcmAudio, VadStats]:
+		frames = self.frames(audio.samples, audio.sample_rate)
+		speech = self.speech_mask(frames)
+		keep = self.keep_mask(speech)
+
+		frame_seconds = self.frame_ms / 1000
+		trimmed = PcmAudio(frames[keep].reshape(-1), audio.sample_rate)
+		stats = VadStats(
+			total_seconds=audio.seconds,
+			kept_seconds=trimmed.seconds,
+			speech_seconds=np.count_nonzero(speech) * frame_seconds,
+		)
+
+		VoiceActivityDetector.total_seconds += stats.total_seconds
+		VoiceActivityDetector.removed_seconds += stats.removed_seconds
+		return trimmed, stats
+
+
+class Endpointer:
+	# Detects the end of an utterance in PCM that arrives in chunks, from the trailing silence after speech.
+	def __init__(self, detector: VoiceActivityDetector, end_silence_ms: int = 800, sample_rate: int = 16000, calibration_ms: int = 200):
+		self.detector = detector
+		self.end_silence_frames = end_silence_ms // detector.frame_ms
+		self.calibration_frames = max(calibration_ms // detector.frame_ms, 1)
+		self.sample_rate = sample_rate
+		self.reset()
+
+	def reset(self):
+		self.pending = b""
+		self.header_checked = False
+		self.noise_floor_db = None
+		self.calibration: list[np.ndarray] = []
+		self.speech_seen = False
+		self.trailing_silence = 0
+
+	def skip_wav_header(self, data: bytes) -> bytes:
+		# The first chunk of a WAV upload starts with the RIFF header. The samples start after the "data" chunk header.
+		if data[:4] != b"RIFF":
+			return data
+
+		if data[12:16] == b"fmt ":
+			self.sample_rate = int.from_bytes(data[24:28], "little")
+		data_offset = data.find(b"data", 12)
+		return data[data_offset + 8:] if data_offset >= 0 else b""
+
+	def feed(self, chunk: bytes) -> bool:
+		if not self.header_checked:
+			self.header_checked = True
+			chunk = self.skip_wav_header(bytes(chunk))
+
+		data = self.pending + bytes(chunk)
+		frame_bytes = self.detector.frame_length(self.sample_rate) * 2
+		usable = len(data) - len(data) % frame_bytes
+		self.pending = data[usable:]
+		if usable == 0:
+			return False
+
+		frames = np.frombuffer(data[:usable], dtype="<i2").reshape(-1, frame_bytes // 2)
+
+		# The noise floor is estimated from the first frames of the recording, before the learner starts talking:
+		if self.noise_floor_db is None:
+			self.calibration.append(frames)
+			calibration = np.concatenate(self.calibration)
+			if len(calibration) < self.calibration_frames:
+				return False
+			energy_db, _ = self.detector.frame_features(calibration)
+			self.noise_floor_db = float(np.median(energy_db))
+			self.calibration = []
+			frames = calibration
+
+		speech = self.detector.speech_mask(frames, self.noise_floor_db)
+		if speech.any():
+			self.speech_seen = True
+			self.trailing_silence = len(speech) - 1 - int(np.flatnonzero(speech)[-1])
+		else:
+			self.trailing_silence += len(speech)
+
+		return self.speech_seen and self.trailing_silence >= self.end_silence_frames
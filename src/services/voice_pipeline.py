@@ -0,0 +1,287 @@
+import asyncio
+from contextlib import aclosing, nullcontext
+import re
+import time
+import traceback
+from typing import AsyncIterator, Awaitable, Callable
+from services.ai_providers import AiBackend
+from services.ai_scheduler import AiCallScheduler
+from services.conversation_memory import ConversationMemory
+from services.metrics import metrics
+from services.speech_feedback import SpeechFeedback, SpeechFeedbackEngine
+from services.tts_cache import TtsCache
+from services.voice_activity import PcmAudio, VoiceActivityDetector
+
+
+ai_call_seconds = metrics.histogram("ai_call_seconds", "Latency of upstream AI calls, without the time waiting for a scheduler slot", ["stage"])
+stt_seconds = ai_call_seconds.labels("stt")
+llm_seconds = ai_call_seconds.labels("llm")
+llm_first_token_seconds = ai_call_seconds.labels("llm_first_token")
+tts_seconds = ai_call_seconds.labels("tts")
+summary_seconds = ai_call_seconds.labels("summary")
+
+
+class SentenceChunker:
+	# A sentence ends at terminal punctuation (optionally followed by closing quotes/brackets) and whitespace.
+	# Requiring the whitespace keeps numbers like "3.5" in one piece while the completion is still streaming.
+	sentence_end = re.compile(r"[.!?…]+[\"')\]]*\s+")
+
+	def __init__(self, min_length: int = 24):
+		self.min_length = min_length
+		self.buffer = ""
+
+	def feed(self, text: str) -> list[str]:
+		self.buffer += text
+		chunks = []
+		start = 0
+
+		for match in self.sentence_end.finditer(self.buffer):
+			# Merge very short sentences ("Yes.", "Great!") with the next one, so TTS is not called for a single word:
+			if match.end() - start < self.min_length:
+				continue
+
+			chunk = self.buffer[start:match.end()].strip()
+			if chunk:
+				chunks.append(chunk)
+			start = match.end()
+
+		self.buffer = self.buffer[start:]
+		return chunks
+
+	def flush(self) -> list[str]:
+		chunk = self.buffer.strip()
+		self.buffer = ""
+		return [chunk] if chunk else []
+
+
+class VoicePipeline:
+	def __init__(
+		self,
+		backend: AiBackend,
+		system_prompt: str = "You are a helpful assistant.",
+		stt_model: str = "whisper-1",
+		llm_model: str = "gpt-4o",
+		tts_model: str = "tts-1",
+		voice: str = "alloy",
+		audio_format: str = "mp3",
+		max_tokens: int = 1000,
+		tts_concurrency: int = 3,
+		vad: VoiceActivityDetector = None,
+		tts_cache: TtsCache = None,
+		memory: ConversationMemory = None,
+		summary_model: str = "gpt-4o-mini",
+		scheduler: AiCallScheduler = None,
+		user_id: str = None,
+		feedback: SpeechFeedbackEngine = None,
+	):
+		self.backend = backend
+		self.system_prompt = system_prompt
+		self.stt_model = stt_model
+		self.llm_model = llm_model
+		self.tts_model = tts_model
+		self.voice = voice
+		self.audio_format = audio_format
+		self.max_tokens = max_tokens
+		self.tts_concurrency = tts_concurrency
+		self.vad = vad
+		self.tts_cache = tts_cache
+		self.memory = memory
+		self.summary_model = summary_model
+		self.scheduler = scheduler
+		self.user_id = user_id
+		self.feedback = feedback
+		if memory is not None and memory.summarizer is None:
+			memory.summarizer = self.summarize
+
+	def slot(self, kind: str, deadline: float = None):
+		if self.scheduler is None:
+			return nullcontext()
+		return self.scheduler.slot(kind, self.user_id, deadline)
+
+	async def transcribe(self, audio: bytes, deadline: float = None, pcm: PcmAudio = None) -> str:
+		filename = "audio.m4a"
+
+		# Silence is trimmed before upload when the audio is PCM. Compressed recordings are sent as they are.
+		if pcm is None and self.vad is not None:
+			pcm = PcmAudio.from_wav(audio)
+
+		if pcm is not None and self.vad is None:
+			filename = "audio.wav"
+
+		elif pcm is not None:
+			trimmed, stats = await asyncio.to_thread(self.vad.trim, pcm)
+			print(f"VAD: {stats}")
+			if not stats.has_speech:
+				return ""
+
+			audio = trimmed.to_wav()
+			filename = "audio.wav"
+
+		async with self.slot("stt", deadline):
+			with stt_seconds.time():
+				transcription = await self.backend.transcribe(audio, filename, self.stt_model)
+		print(f"Transcription: {transcription}")
+		return transcription
+
+	async def transcribe_with_feedback(self, audio: bytes, deadline: float, send_feedback: Callable[[SpeechFeedback], Awaitable]) -> tuple[str, asyncio.Task]:
+		# The acoustic analysis runs in a thread alongside the transcription, and its feedback event is sent while
+		# the LLM call is running. The returned task must be awaited (or cancelled) at the end of the turn.
+		pcm = PcmAudio.from_wav(audio) if self.vad is not None or self.feedback is not None else None
+
+		analysis = None
+		if self.feedback is not None and pcm is not None and send_feedback is not None:
+			analysis = asyncio.create_task(asyncio.to_thread(self.feedback.analyze, pcm))
+
+		try:
+			transcription = await self.transcribe(audio, deadline, pcm)
+		except BaseException:
+			if analysis is not None:
+				analysis.cancel()
+			raise
+
+		if analysis is None:
+			return transcription, None
+
+		if not transcription:
+			analysis.cancel()
+			return transcription, None
+
+		return transcription, asyncio.create_task(self.send_feedback_when_ready(analysis, transcription, send_feedback))
+
+	async def send_feedback_when_ready(self, analysis: asyncio.Task, transcription: str, send_feedback: Callable[[SpeechFeedback], Awaitable]):
+		try:
+			feedback: SpeechFeedback = await analysis
+			feedback.add_transcription(transcription)
+			await send_feedback(feedback)
+		except Exception:
+			traceback.print_exc()
+
+	def build_messages(self, transcription: str) -> list[dict]:
+		if self.memory is None:
+			return [
+				{"role": "system", "content": self.system_prompt},
+				{"role": "user", "content": transcription},
+			]
+
+		self.memory.add("user", transcription)
+		return self.memory.messages(self.system_prompt)
+
+	def remember_reply(self, reply: str):
+		if self.memory is not None and reply:
+			self.memory.add("assistant", reply)
+
+	async def summarize(self, summary: str, messages: list[dict], max_tokens: int) -> str:
+		conversation = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+		# Roughly 3 words per 4 tokens
+		max_words = max(max_tokens * 3 // 4, 10)
+		prompt = [
+			{"role": "system", "content": f"Summarize this language practice conversation in a few sentences, at most {max_words} words. Keep the topics, the learner's mistakes and what was practiced."},
+			{"role": "user", "content": f"Earlier summary: {summary}\n\nNew messages:\n{conversation}"},
+		]
+		async with self.slot("llm"):
+			with summary_seconds.time():
+				return await self.backend.complete(prompt, self.summary_model, max_tokens)
+
+	async def complete(self, messages: list[dict], deadline: float = None) -> str:
+		async with self.slot("llm", deadline):
+			with llm_seconds.time():
+				gpt_response = await self.backend.complete(messages, self.llm_model, self.max_tokens)
+		print(f"GPT Response: {gpt_response}")
+		return gpt_response
+
+	async def stream_sentences(self, messages: list[dict], deadline: float = None) -> AsyncIterator[str]:
+		chunker = SentenceChunker()
+		async with self.slot("llm", deadline):
+			started = time.perf_counter()
+			first_token = True
+			async for delta in self.backend.stream_completion(messages, self.llm_model, self.max_tokens):
+				if first_token:
+					llm_first_token_seconds.observe(time.perf_counter() - started)
+					first_token = False
+				for sentence in chunker.feed(delta):
+					yield sentence
+			llm_seconds.observe(time.perf_counter() - started)
+
+		for sentence in chunker.flush():
+			yield sentence
+
+	async def synthesize(self, text: str, deadline: float = None) -> bytes:
+		async def synthesize_upstream():
+			async with self.slot("tts", deadline):
+				with tts_seconds.time():
+					return await self.backend.synthesize(text, self.tts_model, self.voice, self.audio_format)
+
+		if self.tts_cache is None:
+			return await synthesize_upstream()
+
+		return await self.tts_cache.get_or_synthesize(self.tts_model, self.voice, self.audio_format, text, synthesize_upstream)
+
+	async def respond_buffered(self, audio: bytes, deadline: float = None, send_feedback: Callable[[SpeechFeedback], Awaitable] = None) -> bytes:
+		transcription, feedback_task = await self.transcribe_with_feedback(audio, deadline, send_feedback)
+		if not transcription:
+			return b""
+
+		try:
+			gpt_response = await self.complete(self.build_messages(transcription), deadline)
+			self.remember_reply(gpt_response)
+			speech = await self.synthesize(gpt_response, deadline)
+
+			if feedback_task is not None:
+				await feedback_task
+			return speech
+
+		finally:
+			if feedback_task is not None:
+				feedback_task.cancel()
+
+	async def respond_streaming(self, audio: bytes, send_audio: Callable[[bytes], Awaitable], deadline: float = None, send_feedback: Callable[[SpeechFeedback], Awaitable] = None):
+		transcription, feedback_task = await self.transcribe_with_feedback(audio, deadline, send_feedback)
+		if not transcription:
+			return
+
+		# TTS requests run concurrently (bounded by the semaphore), while the sender awaits them in sentence order:
+		semaphore = asyncio.Semaphore(self.tts_concurrency)
+		pending: asyncio.Queue[asyncio.Task] = asyncio.Queue()
+		tts_tasks: list[asyncio.Task] = []
+
+		async def synthesize_limited(text: str):
+			async with semaphore:
+				return await self.synthesize(text, deadline)
+
+		async def send_in_order():
+			while True:
+				task = await pending.get()
+				if task is None:
+					return
+				await send_audio(await task)
+
+		sender_task = asyncio.create_task(send_in_order())
+		sentences = []
+
+		try:
+			async with aclosing(self.stream_sentences(self.build_messages(transcription), deadline)) as stream:
+				async for sentence in stream:
+					print(f"GPT Sentence: {sentence}")
+					sentences.append(sentence)
+					task = asyncio.create_task(synthesize_limited(sentence))
+					tts_tasks.append(task)
+					pending.put_nowait(task)
+
+					# Stop early if sending failed, instead of streaming the rest of the completion for nothing:
+					if sender_task.done():
+						break
+
+			pending.put_nowait(None)
+			await sender_task
+
+			if feedback_task is not None:
+				await feedback_task
+
+		finally:
+			# Whatever part of the reply was generated is what the learner is going to hear:
+			self.remember_reply(" ".join(sentences))
+			sender_task.cancel()
+			if feedback_task is not None:
+				feedback_task.cancel()
+			for task in tts_tasks:
+				task.cancel()
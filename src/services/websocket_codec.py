@@ -0,0 +1,61 @@
+from typing import Annotated, Any, Union
+import orjson
+from pydantic import BaseModel, Discriminator, Tag, TypeAdapter, ValidationError
+
+from services.exceptions import AppException
+
+
+def message_type(value: Any):
+	if isinstance(value, dict):
+		return value.get("type")
+	return getattr(value, "type", None)
+
+
+class WebsocketCodec:
+	def __init__(self, models: list[type[BaseModel]] = []):
+		self.models: dict[str, type[BaseModel]] = {model.model_fields["type"].default: model for model in models}
+		self.adapter: TypeAdapter = None
+		self.build()
+
+	def register(self, models: dict[str, type[BaseModel]]):
+		self.models.update(models)
+		self.build()
+
+	def build(self):
+		# JSON parsing, the "type" lookup and validation all happen in one pass inside pydantic-core
+		if len(self.models) == 0:
+			self.adapter = None
+		elif len(self.models) == 1:
+			# A discriminated union needs at least two members; the type is checked after validation instead.
+			self.adapter = TypeAdapter(next(iter(self.models.values())))
+		else:
+			tagged = tuple(Annotated[model, Tag(type_name)] for type_name, model in self.models.items())
+			self.adapter = TypeAdapter(Annotated[Union[tagged], Discriminator(message_type)])
+
+	def decode(self, data: Union[str, bytes]) -> BaseModel:
+		if self.adapter is None:
+			raise AppException(f"No data models registered for message: {data}")
+
+		try:
+			message = self.adapter.validate_json(data)
+		except ValidationError as e:
+			# The validation error is summarized in the AppException; the chained traceback would only add noise
+			error = e.errors()[0]
+			if error["type"] == "union_tag_not_found":
+				raise AppException(f"No type field in message: {data}") from None
+			if error["type"] == "union_tag_invalid":
+				raise AppException(f"Invalid data model in message: {data}") from None
+			if error["type"] == "json_invalid":
+				raise AppException(f"Invalid JSON in message: {error['msg']}") from None
+			raise AppException(f"Invalid message: {e}") from None
+
+		if len(self.models) == 1 and message.type not in self.models:
+			raise AppException(f"Invalid data model in message: {data}")
+
+		return message
+
+	@staticmethod
+	def encode(data: Any) -> bytes:
+		if isinstance(data, BaseModel):
+			return data.__pydantic_serializer__.to_json(data)
+		return orjson.dumps(data)
@@ -0,0 +1,31 @@
+import asyncio
+import os
+import sys
+import pytest
+
+# The modules import each other from the src directory (e.g. "from services.x import Y")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def sqlite_databases(tmp_path, monkeypatch):
+	# SQLite files stand in for the MySQL servers, one file per host. Returns a runner for an async test that closes
+	# the pools afterwards, in the test's event loop.
+	from services.base_database_service import BaseDatabaseService
+
+	monkeypatch.setattr(BaseDatabaseService, "url_factory", lambda database, host, port: f"sqlite+aiosqlite:///{tmp_path}/{database}-{host}.sqlite")
+	monkeypatch.setattr(BaseDatabaseService, "host", "primary", raising=False)
+	monkeypatch.setattr(BaseDatabaseService, "port", "3306", raising=False)
+	for name in ("DATABASE_POOL_SIZE", "DATABASE_POOL_MAX_OVERFLOW", "DATABASE_POOL_TIMEOUT_SECONDS", "DATABASE_POOL_PRE_PING_IDLE_SECONDS", "DATABASE_POOL_WARM_UP"):
+		monkeypatch.delenv(name, raising=False)
+
+	def run(test):
+		async def run_and_dispose():
+			try:
+				await test()
+			finally:
+				await BaseDatabaseService.dispose()
+
+		asyncio.run(run_and_dispose())
+
+	return run
@@ -0,0 +1,42 @@
+import asyncio
+from fastapi.websockets import WebSocketState
+from services.ai_providers import AiProvider, FakeAiBackend
+from services.chat_service import SpeechCancelled, SpeechEnd, VoiceChatWorker
+from services.outbound_writer import OutboundWriter, SendPriority
+from websocket_fakes import FakeWebSocket
+
+
+def test_barge_in_discards_only_the_cancelled_turns_audio(monkeypatch):
+	monkeypatch.setattr(AiProvider, "backend", FakeAiBackend())
+
+	async def run():
+		worker = VoiceChatWorker(user_id="user-1", vad=False, feedback=False)
+		worker.websocket = FakeWebSocket(WebSocketState.CONNECTED)
+		# Not started, so everything stays queued as if the client were reading slowly
+		worker.writer = OutboundWriter(worker.websocket, worker.outbound_limits, worker.on_slow_consumer)
+
+		async def first_turn(turn: int):
+			await worker.send_audio(b"first reply, last chunk", turn)
+			await worker.send_json(SpeechEnd(turn=turn), SendPriority.Bulk, turn)
+
+		started = asyncio.Event()
+
+		async def second_turn(turn: int):
+			await worker.send_audio(b"second reply, first chunk", turn)
+			started.set()
+			await asyncio.sleep(10)
+
+		await worker.turns.run(first_turn)
+		second = asyncio.create_task(worker.turns.run(second_turn))
+		await started.wait()
+
+		await worker.on_utterance_started()
+		assert await second is None
+
+		bulk = [payload for payload, _ in worker.writer.queues[SendPriority.Bulk]]
+		control = [payload for payload, _ in worker.writer.queues[SendPriority.Control]]
+		assert bulk == [b"first reply, last chunk", worker.codec.encode(SpeechEnd(turn=1)).decode()]
+		assert control == [worker.codec.encode(SpeechCancelled(turn=2)).decode()]
+		assert worker.writer.depth == 3
+
+	asyncio.run(run())
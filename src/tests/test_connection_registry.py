@@ -0,0 +1,175 @@
+import asyncio
+import fcntl
+import pytest
+from services.connection_registry import RegistryCoordinator, UnixSocketConnectionRegistry, encode_frame
+
+
+class FakeFanout:
+	def __init__(self):
+		self.published = []
+
+	async def publish(self, topic: str, payload: str, priority):
+		self.published.append((topic, payload))
+
+
+class FakeManager:
+	def __init__(self, connection_type: str = "chat"):
+		self.connection_type = connection_type
+		self.fanout = FakeFanout()
+		self.kicked = []
+		self.delivered = []
+
+	async def kick(self, client_id: str, token: str):
+		self.kicked.append((client_id, token))
+
+	async def deliver_local(self, client_id: str, payload: str) -> bool:
+		self.delivered.append((client_id, payload))
+		return True
+
+
+async def start_worker(socket_path: str, name: str) -> UnixSocketConnectionRegistry:
+	registry = UnixSocketConnectionRegistry(socket_path, request_timeout=0.5, reconnect_seconds=0.05)
+	registry.worker_id = name
+	registry.manager = FakeManager()
+	registry.attach(registry.manager)
+	await registry.start()
+	return registry
+
+
+async def eventually(condition, timeout: float = 2.0):
+	deadline = asyncio.get_running_loop().time() + timeout
+	while not condition():
+		if asyncio.get_running_loop().time() > deadline:
+			raise AssertionError("condition not met in time")
+		await asyncio.sleep(0.01)
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+	return str(tmp_path / "registry.sock")
+
+
+def test_claim_kicks_the_previous_owner(socket_path):
+	async def run():
+		first = await start_worker(socket_path, "worker-a")
+		second = await start_worker(socket_path, "worker-b")
+		assert first.coordinator is not None and second.coordinator is None
+
+		await first.claim("chat", "user-1", "token-a")
+		await asyncio.sleep(0.05)
+		await second.claim("chat", "user-1", "token-b")
+		await eventually(lambda: first.manager.kicked == [("user-1", "token-a")])
+		assert await first.owner("chat", "user-1") == "worker-b"
+
+		await second.close()
+		await first.close()
+
+	asyncio.run(run())
+
+
+def test_lookup_and_deliver_reach_the_owner(socket_path):
+	async def run():
+		first = await start_worker(socket_path, "worker-a")
+		second = await start_worker(socket_path, "worker-b")
+
+		await first.claim("chat", "user-1", "token-a")
+		assert await second.owner("chat", "user-1") == "worker-a"
+		assert await second.deliver("chat", "user-1", '{"type":"hello"}')
+		await eventually(lambda: first.manager.delivered == [("user-1", '{"type":"hello"}')])
+
+		assert await second.owner("chat", "nobody") is None
+		assert not await second.deliver("chat", "nobody", "{}")
+
+		await first.release("chat", "user-1", "token-a")
+		assert await second.owner("chat", "user-1") is None
+
+		await second.close()
+		await first.close()
+
+	asyncio.run(run())
+
+
+def test_a_stuck_peer_is_dropped_without_affecting_the_others(socket_path):
+	async def run():
+		# The coordinator runs here, with small limits; the workers find the lock taken and connect to it
+		lock_file = open(socket_path + ".lock", "w")
+		fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+		coordinator = RegistryCoordinator(max_queued_bytes=1024 * 1024, drain_timeout=0.2)
+		server = await asyncio.start_unix_server(coordinator.handle, socket_path)
+
+		first = await start_worker(socket_path, "worker-a")
+		second = await start_worker(socket_path, "worker-b")
+		await first.claim("chat", "user-1", "token-a")
+
+		# A worker that hangs: it claims a client and then never reads again
+		_, stuck = await asyncio.open_unix_connection(socket_path)
+		stuck.write(encode_frame({"op": "hello", "worker": "worker-stuck"}))
+		stuck.write(encode_frame({"op": "claim", "type": "chat", "client_id": "user-2", "token": "token-s"}))
+		await eventually(lambda: ("chat", "user-2") in coordinator.owners)
+
+		payload = "x" * 32 * 1024
+		for _ in range(64):
+			await second.publish("chat", "topic", payload, 1)
+			await asyncio.sleep(0.005)
+		await eventually(lambda: "worker-stuck" not in coordinator.workers)
+
+		# Only the stuck worker and its clients are gone; the publisher is still served
+		assert ("chat", "user-2") not in coordinator.owners
+		assert await second.owner("chat", "user-1") == "worker-a"
+		await eventually(lambda: len(first.manager.fanout.published) == 64)
+
+		stuck.close()
+		await second.close()
+		await first.close()
+		coordinator.close()
+		server.close()
+		lock_file.close()
+
+	asyncio.run(run())
+
+
+def test_a_dead_peer_does_not_end_the_publishers_session(socket_path):
+	async def run():
+		first = await start_worker(socket_path, "worker-a")
+		second = await start_worker(socket_path, "worker-b")
+		coordinator = first.coordinator
+
+		_, dead = await asyncio.open_unix_connection(socket_path)
+		dead.write(encode_frame({"op": "hello", "worker": "worker-dead"}))
+		await second.claim("chat", "user-2", "token-b")
+		await eventually(lambda: "worker-dead" in coordinator.workers)
+
+		dead.transport.abort()
+		for index in range(10):
+			await second.publish("chat", "topic", f"message {index}", 1)
+		await eventually(lambda: "worker-dead" not in coordinator.workers)
+
+		assert "worker-b" in coordinator.workers
+		assert await first.owner("chat", "user-2") == "worker-b"
+		await eventually(lambda: len(first.manager.fanout.published) == 10)
+
+		await second.close()
+		await first.close()
+
+	asyncio.run(run())
+
+
+def test_another_worker_takes_over_when_the_coordinator_exits(socket_path):
+	async def run():
+		first = await start_worker(socket_path, "worker-a")
+		second = await start_worker(socket_path, "worker-b")
+		await second.claim("chat", "user-2", "token-b")
+		assert await first.owner("chat", "user-2") == "worker-b"
+
+		await first.close()
+		await eventually(lambda: second.coordinator is not None)
+		await eventually(lambda: second.connected.is_set())
+
+		# The claims were sent again to the new coordinator
+		third = await start_worker(socket_path, "worker-c")
+		assert await third.owner("chat", "user-2") == "worker-b"
+
+		await third.close()
+		await second.close()
+
+	asyncio.run(run())
@@ -0,0 +1,34 @@
+import asyncio
+from services.conversation_memory import ConversationMemory
+from services.voice_pipeline import VoicePipeline
+
+
+class RecordingBackend:
+	def __init__(self, reply: str):
+		self.reply = reply
+		self.calls = []
+
+	async def complete(self, messages: list[dict], model: str, max_tokens: int) -> str:
+		self.calls.append((messages, model, max_tokens))
+		return self.reply
+
+
+def test_summary_is_requested_within_its_budget():
+	async def run():
+		reply = "The learner practiced ordering coffee. They mixed up en and et. " * 3
+		backend = RecordingBackend(reply)
+		memory = ConversationMemory(token_budget=60, summary_token_budget=104)
+		VoicePipeline(backend, memory=memory, max_tokens=1000)
+
+		for index in range(6):
+			memory.add("user", f"Message number {index} " + "x" * 60)
+		await memory.summary_task
+
+		_, model, max_tokens = backend.calls[0]
+		assert model == "gpt-4o-mini"
+		assert max_tokens == 100
+		assert "at most 75 words" in backend.calls[0][0][0]["content"]
+		# The model's summary is used as it is, not cut off in the middle of a sentence
+		assert memory.summary == reply.strip()
+
+	asyncio.run(run())
@@ -0,0 +1,75 @@
+import asyncio
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from services.base_database_service import BaseDatabaseService
+
+pytest.importorskip("aiosqlite")
+
+database = "test-db"
+
+
+async def query(database: str, hold_seconds: float = 0):
+	async with BaseDatabaseService.get_session_maker(database)() as session:
+		await session.execute(text("select 1"))
+		await asyncio.sleep(hold_seconds)
+
+
+def test_warm_up_opens_the_pool(sqlite_databases, monkeypatch):
+	monkeypatch.setenv("DATABASE_POOL_SIZE__TEST_DB", "3")
+
+	async def test():
+		await BaseDatabaseService.warm_up(database)
+		stats = BaseDatabaseService.pool_stats()[database]
+		assert (stats["connections"], stats["checked_out"], stats["connects"]) == (3, 0, 3)
+
+		# Requests after startup reuse the warm connections
+		await asyncio.gather(*(query(database) for _ in range(3)))
+		assert BaseDatabaseService.pool_stats()[database]["connects"] == 3
+
+	sqlite_databases(test)
+
+
+def test_overflow_and_checkout_timeout(sqlite_databases, monkeypatch):
+	monkeypatch.setenv("DATABASE_POOL_SIZE", "2")
+	monkeypatch.setenv("DATABASE_POOL_MAX_OVERFLOW", "1")
+	monkeypatch.setenv("DATABASE_POOL_TIMEOUT_SECONDS", "0.2")
+
+	async def test():
+		results = await asyncio.gather(*(query(database, 0.5) for _ in range(4)), return_exceptions=True)
+		assert [type(result) for result in results].count(PoolTimeoutError) == 1
+
+		stats = BaseDatabaseService.pool_stats()[database]
+		assert stats["max_checked_out"] == 3
+		assert stats["timeouts"] == 1
+		assert stats["max_wait_seconds"] >= 0.2
+		# The overflow connection is closed when it is returned
+		assert stats["connections"] == 2
+
+	sqlite_databases(test)
+
+
+def test_dead_idle_connection_is_replaced(sqlite_databases, monkeypatch):
+	monkeypatch.setenv("DATABASE_POOL_SIZE", "1")
+	monkeypatch.setenv("DATABASE_POOL_PRE_PING_IDLE_SECONDS", "0.2")
+
+	async def test():
+		engine = BaseDatabaseService.get_engine(database)
+		async with engine.connect() as connection:
+			raw = await connection.get_raw_connection()
+			driver_connection = raw.driver_connection
+
+		# The server drops the connection while it sits in the pool
+		await driver_connection.close()
+		await asyncio.sleep(0.3)
+
+		await query(database)
+		stats = BaseDatabaseService.pool_stats()[database]
+		assert (stats["pings"], stats["ping_failures"]) == (1, 1)
+		assert stats["connects"] == 2 and stats["invalidations"] >= 1
+
+		# A connection that was idle only briefly is not pinged
+		await query(database)
+		assert BaseDatabaseService.pool_stats()[database]["pings"] == 1
+
+	sqlite_databases(test)
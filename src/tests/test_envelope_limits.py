@@ -0,0 +1,40 @@
+import asyncio
+from services.base_websocket_worker import BaseWebsocketWorker, DataMode
+from services.binary_envelope import Envelope, EnvelopeType
+from services.utterance_assembler import UploadLimits
+from websocket_fakes import FakeWebSocket
+
+
+class RecordingWorker(BaseWebsocketWorker):
+	def __init__(self):
+		super().__init__(data_mode=DataMode.Envelope, upload_limits=UploadLimits(max_chunk_bytes=64, max_utterance_bytes=100))
+		self.utterances = []
+		self.barge_ins = 0
+
+	async def on_binary_data(self, data: bytes):
+		self.utterances.append(bytes(data))
+
+	async def on_utterance_started(self):
+		self.barge_ins += 1
+
+
+def test_whole_utterance_envelopes_are_limited_like_assembled_ones():
+	async def run():
+		worker = RecordingWorker()
+		websocket = FakeWebSocket()
+		session = asyncio.create_task(worker.begin(websocket))
+		await asyncio.sleep(0.01)
+
+		websocket.received.put_nowait({"type": "websocket.receive", "bytes": Envelope.encode(EnvelopeType.Audio, b"x" * 101)})
+		websocket.received.put_nowait({"type": "websocket.receive", "bytes": Envelope.encode(EnvelopeType.Audio, b"y" * 100)})
+		await asyncio.sleep(0.05)
+
+		assert worker.utterances == [b"y" * 100]
+		# The rejected audio did not interrupt the reply in progress
+		assert worker.barge_ins == 1
+		assert any("Utterance exceeds 100 bytes" in message for message in websocket.sent if isinstance(message, str))
+
+		websocket.drop(1000)
+		await asyncio.wait_for(session, 2)
+
+	asyncio.run(run())
@@ -0,0 +1,72 @@
+import asyncio
+import pytest
+from services.inbound_queue import InboundBudget, InboundLimits, InboundQueue, OverflowPolicy, QueueOverflow
+from services.message_lanes import LaneMode, MessageLane
+
+
+def test_lanes_share_the_connection_budget():
+	async def run():
+		limits = InboundLimits(max_messages=4, max_bytes=1000, policy=OverflowPolicy.Block)
+		budget = InboundBudget(limits)
+		lanes = [InboundQueue(limits, budget) for _ in range(3)]
+
+		for index in range(4):
+			await lanes[index % 3].put(index, 100)
+		assert (budget.messages, budget.bytes) == (4, 400)
+
+		# Every lane is below its own limits, but the connection is full
+		blocked = asyncio.create_task(lanes[2].put("late", 100))
+		await asyncio.sleep(0.01)
+		assert not blocked.done()
+
+		assert await lanes[0].get() == 0
+		await asyncio.wait_for(blocked, 1)
+		assert (budget.messages, budget.bytes) == (4, 400)
+
+	asyncio.run(run())
+
+
+def test_byte_budget_spans_lanes():
+	async def run():
+		limits = InboundLimits(max_messages=100, max_bytes=1000, policy=OverflowPolicy.Close)
+		budget = InboundBudget(limits)
+		first, second = InboundQueue(limits, budget), InboundQueue(limits, budget)
+
+		await first.put("audio", 900)
+		with pytest.raises(QueueOverflow):
+			await second.put("audio", 200)
+
+	asyncio.run(run())
+
+
+def test_drop_oldest_drops_the_new_message_when_other_lanes_hold_the_budget():
+	async def run():
+		limits = InboundLimits(max_messages=2, policy=OverflowPolicy.DropOldest)
+		budget = InboundBudget(limits)
+		first, second = InboundQueue(limits, budget), InboundQueue(limits, budget)
+
+		await first.put("a")
+		await first.put("b")
+		await second.put("c")
+
+		assert second.qsize() == 0 and second.dropped == 1
+		await first.put("d")
+		assert [first.items[0][0], first.items[1][0]] == ["b", "d"]
+		assert budget.messages == 2
+
+	asyncio.run(run())
+
+
+def test_latest_wins_lane_stays_within_the_budget():
+	async def run():
+		limits = InboundLimits(max_messages=3, policy=OverflowPolicy.Block)
+		budget = InboundBudget(limits)
+		lane = MessageLane("latest", LaneMode.LatestWins)
+		lane.start(limits, "test", budget)
+		lane.stop()
+
+		for index in range(5):
+			await lane.put(lambda: asyncio.sleep(0), 10)
+		assert lane.queue.qsize() == 1 and budget.messages == 1 and budget.bytes == 10
+
+	asyncio.run(run())
@@ -0,0 +1,86 @@
+import asyncio
+from services.outbound_writer import OutboundLimits, OutboundWriter, SendPriority
+
+
+class StuckWebSocket:
+	# The peer stopped reading: every send waits until the socket is closed
+	def __init__(self):
+		self.sent = []
+		self.closed = asyncio.Event()
+
+	async def send_text(self, data: str):
+		await self.closed.wait()
+		raise RuntimeError("closed")
+
+	async def send_bytes(self, data: bytes):
+		await self.send_text(data)
+
+	async def close(self, code: int = 1000):
+		self.closed.set()
+
+
+class SlowWebSocket(StuckWebSocket):
+	async def send_text(self, data: str):
+		await asyncio.sleep(0.03)
+		self.sent.append(data)
+
+
+def test_idle_stuck_send_is_detected():
+	async def run():
+		websocket = StuckWebSocket()
+		reasons = []
+
+		async def on_slow_consumer(reason: str):
+			reasons.append(reason)
+			await websocket.close(1008)
+
+		writer = OutboundWriter(websocket, OutboundLimits(slow_consumer_seconds=0.05), on_slow_consumer)
+		writer.start()
+		assert writer.enqueue("hello", SendPriority.Control)
+
+		# Nothing else is queued, the watchdog alone has to notice the send
+		await asyncio.wait_for(websocket.closed.wait(), 1)
+		assert len(reasons) == 1 and "send took longer" in reasons[0]
+
+		# Closing the socket ended the send, the writer was not cancelled in the middle of it
+		await asyncio.wait_for(writer.task, 1)
+		assert not writer.task.cancelled()
+		assert not writer.enqueue("late", SendPriority.Control)
+		writer.stop()
+
+	asyncio.run(run())
+
+
+def test_steady_slow_sends_are_not_flagged():
+	async def run():
+		websocket = SlowWebSocket()
+		reasons = []
+
+		async def on_slow_consumer(reason: str):
+			reasons.append(reason)
+
+		writer = OutboundWriter(websocket, OutboundLimits(slow_consumer_seconds=0.05), on_slow_consumer)
+		writer.start()
+		for index in range(6):
+			writer.enqueue(str(index), SendPriority.Bulk)
+
+		# Together the sends take longer than the limit, but none of them does on its own
+		await writer.drain(1)
+		assert websocket.sent == [str(index) for index in range(6)]
+		assert reasons == []
+		writer.stop()
+
+	asyncio.run(run())
+
+
+def test_discard_by_turn_keeps_other_turns():
+	writer = OutboundWriter(StuckWebSocket(), OutboundLimits(), None)
+	writer.enqueue("untagged", SendPriority.Bulk)
+	writer.enqueue("turn 1", SendPriority.Bulk, 1)
+	writer.enqueue("turn 2", SendPriority.Bulk, 2)
+	writer.enqueue("control", SendPriority.Control, 2)
+
+	writer.discard(SendPriority.Bulk, 2)
+	assert [payload for payload, _ in writer.queues[SendPriority.Bulk]] == ["untagged", "turn 1"]
+	assert [payload for payload, _ in writer.queues[SendPriority.Control]] == ["control"]
+	assert writer.depth == 3
@@ -0,0 +1,94 @@
+import datetime
+import pytest
+from sqlalchemy import delete, select
+from data.models import Base, User
+from services.base_database_service import BaseDatabaseService
+from services.user_service import UserRepository
+
+pytest.importorskip("aiosqlite")
+
+database = "test-db"
+
+
+async def set_up_replicas(selection: str = "round_robin"):
+	# The user is only on the primary, as if the replicas had not caught up yet
+	for host in ("primary", "replica-1", "replica-2"):
+		async with BaseDatabaseService.get_engine(database, None if host == "primary" else host, "3306").begin() as connection:
+			await connection.run_sync(Base.metadata.create_all)
+
+	replicas = BaseDatabaseService.configure_replicas(database, ["replica-1", "replica-2:3306"], selection)
+	async with BaseDatabaseService.get_session_maker(database)() as session:
+		session.add(user("u1"))
+		await session.commit()
+	return replicas
+
+
+def user(id: str) -> User:
+	return User(id=id, email_address=f"{id}@example.com", password="x", created_at=datetime.datetime.now())
+
+
+def test_select_helpers_read_from_a_replica(sqlite_databases):
+	async def test():
+		replicas = await set_up_replicas()
+		async with BaseDatabaseService.get_session_maker(database)() as session:
+			assert await UserRepository(session).get_user("u1") is None
+			assert session.info["replica"] == 0
+
+			# Statements that do not go through the select helpers stay on the primary
+			assert (await session.scalars(select(User))).first().id == "u1"
+
+		async with BaseDatabaseService.get_session_maker(database)() as session:
+			BaseDatabaseService.use_primary(session)
+			assert (await UserRepository(session).get_user("u1")).id == "u1"
+
+		assert replicas.stats()[database]["sticky_reads"] == 1
+
+	sqlite_databases(test)
+
+
+def test_reads_stick_to_the_primary_after_autoflush(sqlite_databases):
+	async def test():
+		replicas = await set_up_replicas()
+		async with BaseDatabaseService.get_session_maker(database)() as session:
+			repository = UserRepository(session)
+			session.add(user("u2"))
+
+			# The pending user is flushed to the primary before the read, so the read must see it
+			assert (await repository.get_user("u2")).id == "u2"
+			assert (await repository.get_user("u1")).id == "u1"
+			assert session.info["primary"] and "replica" not in session.info
+			await session.rollback()
+
+		assert replicas.stats()[database]["sticky_reads"] == 2
+
+	sqlite_databases(test)
+
+
+def test_reads_stick_to_the_primary_after_a_delete(sqlite_databases):
+	async def test():
+		await set_up_replicas()
+		async with BaseDatabaseService.get_session_maker(database)() as session:
+			repository = UserRepository(session)
+			assert await repository.get_user("u1") is None
+
+			await repository.delete(delete(User).where(User.id == "nobody"))
+			assert (await repository.get_user("u1")).id == "u1"
+
+	sqlite_databases(test)
+
+
+def test_round_robin_spreads_sessions(sqlite_databases):
+	async def test():
+		replicas = await set_up_replicas("round_robin")
+		for _ in range(4):
+			async with BaseDatabaseService.get_session_maker(database)() as session:
+				repository = UserRepository(session)
+				await repository.select_all(select(User))
+				await repository.get_user_by_email("u1@example.com")
+
+		stats = replicas.stats()
+		assert [stats[name]["sessions"] for name in replicas.names] == [2, 2]
+		# Every read of a session goes to the replica chosen for it
+		assert [stats[name]["reads"] for name in replicas.names] == [4, 4]
+
+	sqlite_databases(test)
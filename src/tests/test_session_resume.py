@@ -0,0 +1,81 @@
+import asyncio
+from fastapi.websockets import WebSocketState
+from services.base_websocket_worker import BaseWebsocketWorker, ConnectionManager
+from services.connection_registry import LocalConnectionRegistry
+from services.replay_buffer import ReplayLimits
+from websocket_fakes import FakeWebSocket
+
+
+class ResumableManager(ConnectionManager):
+	def create_connection(self, client_id: str, websocket) -> BaseWebsocketWorker:
+		return BaseWebsocketWorker(replay_limits=ReplayLimits(ttl_seconds=5))
+
+
+def test_failed_resume_keeps_the_waiting_session():
+	async def run():
+		manager = ResumableManager("test", LocalConnectionRegistry())
+		first = FakeWebSocket()
+		session_task = asyncio.create_task(manager.begin_unique(first, "client"))
+		await asyncio.sleep(0.01)
+		session = manager.connections["client"]
+		token = manager.tokens["client"]
+
+		# The network drops; the session waits for a resume
+		first.drop(1006)
+		await asyncio.sleep(0.01)
+
+		# A resume on a socket that is already gone must not take the session away from the waiting one
+		await manager.begin_unique(FakeWebSocket(WebSocketState.DISCONNECTED), "client", session.resume_token, 0)
+		assert manager.connections["client"] is session and manager.tokens["client"] == token
+		assert not session_task.done()
+
+		# A real resume still finds the session, and closing it normally ends it
+		second = FakeWebSocket()
+		resume_task = asyncio.create_task(manager.begin_unique(second, "client", session.resume_token, 0))
+		await asyncio.sleep(0.01)
+		assert session.websocket is second and '"resumed":true' in second.sent[0]
+
+		second.drop(1000)
+		await asyncio.wait_for(resume_task, 1)
+		await asyncio.wait_for(session_task, 1)
+		assert manager.connections == {} and manager.tokens == {}
+
+	asyncio.run(run())
+
+
+def test_non_ascii_resume_token_is_rejected():
+	async def run():
+		manager = ResumableManager("test", LocalConnectionRegistry())
+		first = FakeWebSocket()
+		session_task = asyncio.create_task(manager.begin_unique(first, "client"))
+		await asyncio.sleep(0.01)
+		session = manager.connections["client"]
+
+		assert not session.can_resume("tökén", 0)
+		assert session.can_resume(session.resume_token, 0)
+
+		first.drop(1000)
+		await asyncio.wait_for(session_task, 1)
+
+	asyncio.run(run())
+
+
+def test_resuming_is_opt_in(monkeypatch):
+	from services.ai_providers import AiProvider, FakeAiBackend
+	from services.chat_service import ChatService, VoiceChatWorker
+
+	monkeypatch.setattr(AiProvider, "backend", FakeAiBackend())
+	monkeypatch.delenv("CHAT_RESUME_TTL_SECONDS", raising=False)
+	started = []
+
+	async def begin(worker, websocket):
+		started.append(worker)
+
+	async def begin_unique(*args, **kwargs):
+		raise AssertionError("a plain connection must not take over the user's other sessions")
+
+	monkeypatch.setattr(VoiceChatWorker, "begin", begin)
+	monkeypatch.setattr(ChatService.connections, "begin_unique", begin_unique)
+
+	asyncio.run(ChatService().start_voice_chat(FakeWebSocket(), "user-1"))
+	assert len(started) == 1 and started[0].resume_token is None
@@ -0,0 +1,80 @@
+import asyncio
+import re
+from services.sse_hub import SseBufferLimits, SseBufferPolicy, SseHub, SseStream
+
+
+def subscribed(hub: SseHub, *channels: str, last_event_id: str = None) -> SseStream:
+	stream = SseStream(None)
+	hub.subscribe(stream, channels, last_event_id)
+	return stream
+
+
+def test_idle_channels_expire_after_their_history():
+	async def run():
+		hub = SseHub(history_seconds=0.05)
+		hub.publish("nobody-listens", {"n": 1})
+		stream = subscribed(hub, "lesson")
+		hub.publish("lesson", {"n": 2})
+		hub.unsubscribe(stream)
+		assert set(hub.channels) == {"nobody-listens", "lesson"}
+
+		await asyncio.sleep(0.1)
+		hub.publish("other", {"n": 3})
+		assert set(hub.channels) == {"other"}
+		assert hub.stats()["expired_channels"] == 2
+
+	asyncio.run(run())
+
+
+def test_reconnect_within_the_history_window_replays():
+	async def run():
+		hub = SseHub(history_seconds=60)
+		stream = subscribed(hub, "lesson")
+		first = hub.publish("lesson", {"n": 1})
+		hub.unsubscribe(stream)
+		hub.publish("lesson", {"n": 2})
+
+		reconnected = subscribed(hub, "lesson", last_event_id=f"{hub.epoch}-{first}")
+		assert len(reconnected.pending) == 1 and b'"n":2' in next(iter(reconnected.pending.values()))
+		assert "lesson" not in hub.idle_channels
+
+	asyncio.run(run())
+
+
+def test_channel_count_is_capped_by_dropping_idle_channels():
+	async def run():
+		hub = SseHub(max_channels=3)
+		subscribed(hub, "active")
+		for index in range(10):
+			hub.publish(f"idle-{index}", {"n": index})
+
+		assert len(hub.channels) == 3
+		assert "active" in hub.channels and "idle-9" in hub.channels
+
+	asyncio.run(run())
+
+
+def test_coalesced_events_keep_ids_increasing():
+	async def run():
+		hub = SseHub()
+		stream = SseStream(None, SseBufferLimits(policy=SseBufferPolicy.Coalesce))
+		hub.subscribe(stream, ["lesson"])
+		hub.publish("lesson", {"progress": 1}, key="progress")
+		hub.publish("lesson", {"chat": "hello"})
+		hub.publish("lesson", {"progress": 2}, key="progress")
+		hub.publish("lesson", {"chat": "again"})
+
+		written = []
+
+		async def send(message: dict):
+			written.append(message["body"])
+			stream.close()
+
+		stream.send = send
+		await stream.run()
+
+		ids = [int(number) for number in re.findall(rb"id: [0-9a-f]+-(\d+)", written[0])]
+		assert ids == [2, 3, 4]
+		assert b'"progress":1' not in written[0] and stream.coalesced == 1
+
+	asyncio.run(run())
@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+import jwt
+from auth import Token, TokenUtils
+from services.token_cache import VerifiedTokenCache
+
+
+def create_token(sub: str, expires_in: float = 3600) -> str:
+	return jwt.encode({"sub": sub, "exp": int(time.time() + expires_in)}, key=TokenUtils.key(), algorithm=TokenUtils.algorithm)
+
+
+def test_hit_returns_verified_claims():
+	cache = VerifiedTokenCache()
+	token = create_token("1")
+
+	first = cache.verify("access", token, TokenUtils.decode_access_token)
+	second = cache.verify("access", token, TokenUtils.decode_access_token)
+
+	assert first is second
+	assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_entry_is_not_used_at_exp(monkeypatch):
+	cache = VerifiedTokenCache()
+	token = create_token("1")
+	claims = cache.verify("access", token, TokenUtils.decode_access_token)
+
+	calls = []
+	monkeypatch.setattr(time, "time", lambda: claims.exp)
+	cache.verify("access", token, lambda token: calls.append(token) or claims)
+	monkeypatch.undo()
+
+	assert calls == [token]
+	assert cache.stats()["expired"] == 1
+
+
+def test_lru_eviction_and_purging():
+	cache = VerifiedTokenCache(max_entries=2)
+	tokens = [create_token(str(index)) for index in range(3)]
+	for token in tokens:
+		cache.verify("access", token, TokenUtils.decode_access_token)
+
+	assert cache.stats()["entries"] == 2 and cache.stats()["evictions"] == 1
+	assert cache.purge_subject("2") == 1
+	assert not cache.purge("access", tokens[0])
+	assert cache.stats()["entries"] == 1
+
+
+def test_invalid_token_is_not_cached():
+	cache = VerifiedTokenCache()
+	token = create_token("1")[:-2] + "xx"
+	for _ in range(2):
+		try:
+			cache.verify("access", token, TokenUtils.decode_access_token)
+		except jwt.InvalidSignatureError:
+			pass
+
+	assert cache.stats()["entries"] == 0 and cache.stats()["misses"] == 2
+
+
+def test_concurrent_verification_from_threadpool():
+	# Like the sync auth dependencies, which FastAPI runs on its threadpool
+	VerifiedTokenCache.configure(max_entries=50)
+	tokens = [create_token(str(index)) for index in range(200)]
+
+	def authenticate(index: int):
+		if index % 97 == 0:
+			VerifiedTokenCache.get().purge_subject(str(index % 200))
+		token = tokens[(index * 7) % len(tokens)]
+		return TokenUtils.validated_access_token(token)
+
+	with ThreadPoolExecutor(max_workers=8) as executor:
+		results = list(executor.map(authenticate, range(5000)))
+
+	assert all(isinstance(result, Token) for result in results)
+	stats = VerifiedTokenCache.get().stats()
+	assert stats["entries"] <= 50
+	assert stats["hits"] + stats["misses"] == 5000
+
+
+def test_purged_expiries_do_not_pile_up():
+	# The cache never fills up, so nothing is evicted; purging and verifying again must still keep the heap bounded
+	cache = VerifiedTokenCache(max_entries=10)
+	tokens = [create_token("1", expires_in=3600 + index) for index in range(3)]
+	for _ in range(100):
+		for token in tokens:
+			cache.verify("access", token, TokenUtils.decode_access_token)
+		assert cache.purge("access", tokens[0])
+		assert cache.purge_subject("1") == 2
+
+	assert cache.stats()["entries"] == 0 and cache.stats()["purged"] == 300
+	assert len(cache.expiries) <= 2 * cache.max_entries
+	assert cache.subjects == {}
@@ -0,0 +1,49 @@
+import asyncio
+import os
+from services.tts_cache import TtsCache
+
+
+def test_disk_round_trip(tmp_path):
+	async def run():
+		cache = TtsCache(disk_path=str(tmp_path))
+		key = TtsCache.key("tts-1", "alloy", "mp3", "Hello")
+
+		async def synthesize():
+			return b"audio"
+
+		assert await cache.get_or_synthesize("tts-1", "alloy", "mp3", "Hello", synthesize) == b"audio"
+		assert os.path.getsize(cache.disk_file(key)) == 5
+
+		restarted = TtsCache(disk_path=str(tmp_path))
+		assert await restarted.get_or_synthesize("tts-1", "alloy", "mp3", "Hello", None) == b"audio"
+		assert restarted.disk_hits == 1
+
+	asyncio.run(run())
+
+
+def test_empty_files_are_not_indexed(tmp_path):
+	(tmp_path / "empty.audio").write_bytes(b"")
+	(tmp_path / "full.audio").write_bytes(b"abc")
+
+	cache = TtsCache(disk_path=str(tmp_path))
+	assert list(cache.disk_index) == ["full"]
+	assert cache.disk_bytes == 3
+
+
+def test_file_emptied_after_indexing_is_a_miss(tmp_path):
+	async def run():
+		cache = TtsCache(disk_path=str(tmp_path))
+		key = TtsCache.key("tts-1", "alloy", "mp3", "Hello")
+		cache.disk_index[key] = 5
+		cache.disk_bytes = 5
+		open(cache.disk_file(key), "wb").close()
+
+		async def synthesize():
+			return b"fresh"
+
+		assert await cache.get_or_synthesize("tts-1", "alloy", "mp3", "Hello", synthesize) == b"fresh"
+		assert cache.misses == 1 and cache.disk_hits == 0
+		# Written again by the miss
+		assert cache.disk_index[key] == 5 and cache.disk_bytes == 5
+
+	asyncio.run(run())
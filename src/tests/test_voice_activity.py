@@ -0,0 +1,48 @@
+import numpy as np
+from services.voice_activity import Endpointer, PcmAudio, VoiceActivityDetector
+
+
+def tone(seconds: float, amplitude: float, sample_rate: int = 16000) -> np.ndarray:
+	# A sustained voiced sound, cropped without any pause around it
+	t = np.arange(int(seconds * sample_rate)) / sample_rate
+	envelope = 0.9 + 0.1 * np.sin(2 * np.pi * 4 * t)
+	return amplitude * envelope * (np.sin(2 * np.pi * 160 * t) + 0.5 * np.sin(2 * np.pi * 320 * t))
+
+
+def noise(seconds: float, amplitude: float, sample_rate: int = 16000, seed: int = 0) -> np.ndarray:
+	return np.random.default_rng(seed).normal(0, amplitude, int(seconds * sample_rate))
+
+
+def pcm(samples: np.ndarray, sample_rate: int = 16000) -> PcmAudio:
+	return PcmAudio(np.clip(samples, -32768, 32767).astype(np.int16), sample_rate)
+
+
+def test_tightly_cropped_speech_is_kept():
+	detector = VoiceActivityDetector()
+	for amplitude in (1500, 6000):
+		audio = pcm(tone(1.5, amplitude))
+		trimmed, stats = detector.trim(audio)
+		assert stats.has_speech
+		assert stats.speech_seconds > 1.2
+		assert trimmed.seconds > 1.2
+
+
+def test_silence_around_speech_is_trimmed():
+	audio = pcm(np.concatenate((noise(2, 30), tone(1, 6000), noise(2, 30, seed=1))))
+	trimmed, stats = VoiceActivityDetector().trim(audio)
+	assert stats.has_speech
+	assert 1.0 <= trimmed.seconds < 1.6
+
+
+def test_quiet_recording_has_no_speech():
+	_, stats = VoiceActivityDetector().trim(pcm(noise(2, 30)))
+	assert not stats.has_speech
+
+
+def test_endpointer_detects_speech_from_the_first_frame():
+	# The learner starts talking before the calibration window is over
+	samples = pcm(np.concatenate((tone(1, 6000), noise(1, 30)))).samples.tobytes()
+	endpointer = Endpointer(VoiceActivityDetector(), end_silence_ms=600)
+	ended = [endpointer.feed(samples[offset:offset + 1280]) for offset in range(0, len(samples), 1280)]
+	assert endpointer.speech_seen
+	assert any(ended)
@@ -0,0 +1,28 @@
+import asyncio
+from fastapi.websockets import WebSocketState
+
+
+class FakeWebSocket:
+	def __init__(self, state: WebSocketState = WebSocketState.CONNECTING):
+		self.application_state = state
+		self.client_state = state
+		self.received: asyncio.Queue = asyncio.Queue()
+		self.sent = []
+
+	async def accept(self):
+		self.application_state = self.client_state = WebSocketState.CONNECTED
+
+	async def send_text(self, data: str):
+		self.sent.append(data)
+
+	async def send_bytes(self, data: bytes):
+		self.sent.append(data)
+
+	async def receive(self) -> dict:
+		return await self.received.get()
+
+	async def close(self, code: int = 1000):
+		self.application_state = self.client_state = WebSocketState.DISCONNECTED
+
+	def drop(self, code: int):
+		self.received.put_nowait({"type": "websocket.disconnect", "code": code})
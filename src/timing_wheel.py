@@ -0,0 +1,155 @@
+import asyncio
+import math
+import traceback
+from typing import Callable, Optional
+import weakref
+
+
+class WheelTimer:
+	__slots__ = ("deadline", "callback", "slot")
+
+	def __init__(self, deadline: int, callback: Callable[[], None]):
+		# Deadline in ticks since the wheel's origin
+		self.deadline = deadline
+		self.callback = callback
+		self.slot: Optional[set] = None
+
+	@property
+	def scheduled(self) -> bool:
+		return self.slot is not None
+
+
+class TimingWheel:
+	# Hierarchical timing wheel: `levels` wheels of `slots` slots each, where one slot of level n covers a whole
+	# turn of level n - 1. Scheduling and cancelling are O(1) set operations; a single driver task per event loop
+	# advances the wheel one tick at a time and only runs while timers are scheduled.
+	tick_seconds = 0.01
+	wheels: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, TimingWheel]" = weakref.WeakKeyDictionary()
+
+	def __init__(self, tick_seconds: float = None, levels: int = 4, slot_bits: int = 6):
+		self.tick = tick_seconds or TimingWheel.tick_seconds
+		self.slot_bits = slot_bits
+		self.slot_mask = (1 << slot_bits) - 1
+		self.levels: list[list[set[WheelTimer]]] = [[set() for _ in range(1 << slot_bits)] for _ in range(levels)]
+		self.loop: asyncio.AbstractEventLoop = None
+		self.origin = 0.0
+		self.current_tick = 0
+		self.count = 0
+		self.driver: asyncio.Task = None
+
+		self.fired = 0
+		self.max_lateness_seconds = 0.0
+
+	@staticmethod
+	def configure(tick_seconds: float):
+		# Applies to wheels created afterwards
+		TimingWheel.tick_seconds = tick_seconds
+
+	@staticmethod
+	def get() -> "TimingWheel":
+		loop = asyncio.get_running_loop()
+		wheel = TimingWheel.wheels.get(loop)
+		if wheel is None:
+			wheel = TimingWheel()
+			TimingWheel.wheels[loop] = wheel
+		return wheel
+
+	def schedule(self, delay_seconds: float, callback: Callable[[], None]) -> WheelTimer:
+		if self.loop is None:
+			self.loop = asyncio.get_running_loop()
+			self.origin = self.loop.time()
+
+		if self.count == 0:
+			# Nothing is scheduled, so the wheel can skip the ticks that passed while it was idle
+			self.current_tick = max(self.current_tick, int((self.loop.time() - self.origin) / self.tick))
+
+		# Rounded up, so a timer never fires early; it fires at most one tick late
+		deadline = math.ceil((self.loop.time() + delay_seconds - self.origin) / self.tick)
+		timer = WheelTimer(max(deadline, self.current_tick + 1), callback)
+		self.insert(timer)
+		self.count += 1
+
+		if self.driver is None:
+			self.driver = self.loop.create_task(self.run())
+		return timer
+
+	def cancel(self, timer: WheelTimer) -> bool:
+		if timer.slot is None:
+			return False
+		timer.slot.discard(timer)
+		timer.slot = None
+		self.count -= 1
+		return True
+
+	def reschedule(self, timer: WheelTimer, delay_seconds: float) -> WheelTimer:
+		self.cancel(timer)
+		return self.schedule(delay_seconds, timer.callback)
+
+	def insert(self, timer: WheelTimer):
+		delta = timer.deadline - self.current_tick
+		level = 0
+		while level < len(self.levels) - 1 and delta >= 1 << (self.slot_bits * (level + 1)):
+			level += 1
+
+		# Timers beyond the top level's range are placed in it anyway and moved again when their slot comes up
+		slot = self.levels[level][(timer.deadline >> (self.slot_bits * level)) & self.slot_mask]
+		slot.add(timer)
+		timer.slot = slot
+
+	def advance(self):
+		self.current_tick += 1
+		tick = self.current_tick
+
+		# Move the timers of the higher level slots that start at this tick down the hierarchy:
+		for level in range(1, len(self.levels)):
+			if tick & ((1 << (self.slot_bits * level)) - 1):
+				break
+
+			slot = self.levels[level][(tick >> (self.slot_bits * level)) & self.slot_mask]
+			timers = list(slot)
+			slot.clear()
+			for timer in timers:
+				self.insert(timer)
+
+		slot = self.levels[0][tick & self.slot_mask]
+		if not slot:
+			return
+
+		due = [timer for timer in slot if timer.deadline <= tick]
+		lateness = self.loop.time() - (self.origin + tick * self.tick)
+		self.max_lateness_seconds = max(self.max_lateness_seconds, lateness)
+
+		for timer in due:
+			# An earlier callback may have cancelled this timer
+			if timer.slot is not slot:
+				continue
+			slot.discard(timer)
+			timer.slot = None
+			self.count -= 1
+			self.fired += 1
+			try:
+				timer.callback()
+			except Exception:
+				traceback.print_exc()
+
+	async def run(self):
+		try:
+			while self.count > 0:
+				delay = self.origin + (self.current_tick + 1) * self.tick - self.loop.time()
+				if delay > 0:
+					await asyncio.sleep(delay)
+
+				# Catch up on every tick that is due, e.g. after the loop was blocked for a while:
+				now_tick = int((self.loop.time() - self.origin) / self.tick)
+				while self.current_tick < now_tick and self.count > 0:
+					self.advance()
+		finally:
+			self.driver = None
+
+	def stats(self) -> dict:
+		return {
+			"tick_seconds": self.tick,
+			"scheduled": self.count,
+			"fired": self.fired,
+			"max_lateness_seconds": self.max_lateness_seconds,
+		}